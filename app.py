@@ -9,453 +9,30 @@
 # (C) 行キャリー＋集約ロジックに「シリアルのみぶら下がり＆Lot No.空」の特例対応
 # (D) 新しい型番ブロック開始時に last_lotno / last_exp_norm を確実にリセット（誤キャリー防止）
 # ------------------------------------------------------------
-# pip install streamlit pandas openpyxl requests
+# 抽出ロジック本体は extractor.py、台帳の追記／レポートは ledger.py（どちらも Streamlit 非依存）
+# バッチ実行（UIなし）: python extract_batch.py "入力/*.xlsx" --base 台帳.xlsx -o 更新済み.xlsx
+# pip install streamlit pandas openpyxl requests（任意: python-calamine）
 # 実行: streamlit run app_dragdrop_excel_reports.py
 # ------------------------------------------------------------
-import io, os, re, time, datetime as dt
-from typing import List, Tuple, Optional, Dict, Any
+import os, time
 
 import streamlit as st
 import pandas as pd
 import requests
-from openpyxl import load_workbook, Workbook
-from openpyxl.utils import get_column_letter
 
-HEADERS = ["工程名","LOT","型番","Lot No.","払出数","有効期限","ファイル名"]
-
-# ===================== ユーティリティ =====================
-def norm(s) -> str:
-    if s is None: return ""
-    return str(s).replace("\r"," ").replace("\n"," ").replace("　"," ").strip()
-
-def normalize_date(s: Optional[str]) -> Optional[str]:
-    if not s: return None
-    m = re.search(r"(\d{4})[./-](\d{1,2})[./-](\d{1,2})", s)
-    if not m: return None
-    y, mth, d = int(m.group(1)), int(m.group(2)), int(m.group(3))
-    try:
-        dtv = pd.Timestamp(year=y, month=mth, day=d)
-        return f"{dtv.year}/{dtv.month}/{dtv.day}"
-    except Exception:
-        return None
-
-def autosize(ws):
-    for col in range(1, ws.max_column + 1):
-        letter = get_column_letter(col)
-        max_len = 0
-        for cell in ws[letter]:
-            val = "" if cell.value is None else str(cell.value)
-            max_len = max(max_len, len(val))
-        ws.column_dimensions[letter].width = min(max_len + 2, 80)
-
-# 数量の強化正規化：数値型/小数/カンマ/全角/単位付きもOK
-def _to_int_qty(q) -> Optional[int]:
-    if q is None or (isinstance(q, float) and pd.isna(q)):
-        return None
-    if isinstance(q, (int, float)):
-        return int(round(float(q)))
-    s = str(q).strip()
-    s = s.translate(str.maketrans("０１２３４５６７８９－．，", "0123456789-.,")).replace(",", "")
-    m = re.match(r"^\s*([+-]?\d+(?:\.\d+)?)", s)
-    if not m:
-        return None
-    try:
-        return int(round(float(m.group(1))))
-    except Exception:
-        return None
-
-# NEW: ファイル名から「返庫」判定（Excelにのみ適用）
-def is_henko_from_name(filename_wo_ext: str) -> bool:
-    return "返庫" in (filename_wo_ext or "")
-
-# ===================== Excelヘッダ検出（2段対応） =====================
-HEADER_KEYS = {
-    "model": ["型番","品目","品番","型 式"],
-    "lotno": ["Lot No","LotNo","LOT NO","ロット","Lot"],
-    # qty は「払出数系 ＞ 数量系」で優先
-    "qty_hi": ["払出数","払い出し","払出","出庫","出数"],
-    "qty_lo": ["数量","個数","数"],
-    "exp":   ["有効期限","期限","賞味期限","Exp","有効期日"],
-}
-
-def _n(cell):
-    if pd.isna(cell): return ""
-    return str(cell).strip().replace("　","").replace("\n"," ").replace("\r"," ")
-
-def detect_header(df: pd.DataFrame, scan_rows: int = 60) -> dict|None:
-    def choose_col_by_priority(cells: list[str], high: list[str], low: list[str]) -> Optional[int]:
-        lows = [c.lower() for c in cells]
-        for kw in high:
-            kwl = kw.lower()
-            for c, txt in enumerate(lows):
-                if kwl in txt: return c
-        for kw in low:
-            kwl = kw.lower()
-            for c, txt in enumerate(lows):
-                if kwl in txt: return c
-        return None
-
-    def first_hit(cells: list[str], keys: list[str]) -> Optional[int]:
-        lows = [c.lower() for c in cells]
-        for kw in keys:
-            kwl = kw.lower()
-            for c, txt in enumerate(lows):
-                if kwl in txt: return c
-        return None
-
-    def hit_from_row(cells: list[str]) -> dict:
-        hit={}
-        lot_c = first_hit(cells, HEADER_KEYS["lotno"])
-        if lot_c is not None: hit["lotno"] = lot_c
-        exp_c = first_hit(cells, HEADER_KEYS["exp"])
-        if exp_c is not None: hit["exp"] = exp_c
-        model_c = first_hit(cells, HEADER_KEYS["model"])
-        if model_c is not None: hit["model"] = model_c
-        qty_c = choose_col_by_priority(cells, HEADER_KEYS["qty_hi"], HEADER_KEYS["qty_lo"])
-        if qty_c is not None: hit["qty"] = qty_c
-        if sum(1 for k in ["lotno","qty","exp"] if k in hit) >= 2 and "model" in hit:
-            return hit
-        return {}
-
-    scan_rows = min(len(df), scan_rows)
-    # 1段
-    for r in range(scan_rows):
-        row = [_n(x) for x in df.iloc[r,:].tolist()]
-        if not any(row): continue
-        hit = hit_from_row(row)
-        if hit: return {"row": r, **hit}
-    # 2段（上下マージ）
-    for r in range(scan_rows-1):
-        row1 = [_n(x) for x in df.iloc[r,:].tolist()]
-        row2 = [_n(x) for x in df.iloc[r+1,:].tolist()]
-        width = max(len(row1), len(row2))
-        combo=[]
-        for c in range(width):
-            a = row1[c] if c < len(row1) else ""
-            b = row2[c] if c < len(row2) else ""
-            combo.append((a or b) if (a or b) else "")
-        if not any(combo): continue
-        hit = hit_from_row(combo)
-        if hit: return {"row": r, **hit}
-    return None
-
-def extract_koutei_lot_from_sheet(df: pd.DataFrame, max_scan_rows:int=8, max_scan_cols:int=8) -> Tuple[Optional[str], Optional[str]]:
-    koutei=None; lot=None
-    rows=min(len(df),max_scan_rows); cols=min(df.shape[1],max_scan_cols)
-    # 工程名（上部の最初の非空セル）
-    for r in range(rows):
-        for c in range(cols):
-            v=_n(df.iat[r,c])
-            if v and not re.search(r"\b(lot|ロット)\b", v, flags=re.I):
-                koutei=v; break
-        if koutei: break
-    # LOT（Lot: / Lot. / ロット: を許可）
-    lot_pat = re.compile(r"(?:\bLot\b\.?|ロット)\s*[：:\.\s]\s*([^\s]+)", re.I)
-    for r in range(rows):
-        for c in range(cols):
-            s=_n(df.iat[r,c])
-            if not s: continue
-            m=lot_pat.search(s)
-            if m: lot=m.group(1).strip(); break
-        if lot: break
-    return koutei, lot
-
-# ===================== シート選択（編集用 → 数量多い順 → 先頭） =====================
-def choose_target_sheet_qty_first(xbytes: bytes) -> tuple[str, str]:
-    """
-    優先順:
-      1) '編集用'
-      2) 払出数（数量）に数字が入っている行数が多いシート
-      3) 先頭シート
-    ※ 日付優先／除外パターンは使いません
-    """
-    xls = pd.ExcelFile(io.BytesIO(xbytes))
-    sheet_names = xls.sheet_names
-
-    # 1) 編集用
-    if "編集用" in sheet_names:
-        return "編集用", "編集用が最優先"
-
-    # 2) 数量が入っている件数をカウント（ヘッダ検出して数量列を特定）
-    candidates = []  # (sheet, qty_count)
-    for s in sheet_names:
-        try:
-            df = pd.read_excel(io.BytesIO(xbytes), sheet_name=s, header=None, nrows=200)
-            hmap = detect_header(df, scan_rows=60)
-            if not hmap:
-                candidates.append((s, -1))   # 評価不可
-                continue
-
-            start = hmap["row"] + 1
-            qc = hmap["qty"]
-            sub = df.iloc[start:, :]
-            qty_count = 0
-            for i in range(len(sub)):
-                v = sub.iat[i, qc] if qc < sub.shape[1] else None
-                vi = _to_int_qty(v)
-                # 0 もカウントしたい場合は `vi is not None` に変更
-                if vi is not None and vi != 0:
-                    qty_count += 1
-            candidates.append((s, qty_count))
-        except Exception:
-            candidates.append((s, -1))
-
-    # 件数が評価できたものの中から最大を選ぶ
-    valid = [c for c in candidates if c[1] >= 0]
-    if valid:
-        valid.sort(key=lambda x: x[1], reverse=True)  # 件数降順のみで決定
-        top_sheet, top_cnt = valid[0]
-        if top_cnt > 0:
-            return top_sheet, f"数量セルのあるシート優先（件数={top_cnt}）"
-
-    # 3) 先頭
-    return sheet_names[0], "フォールバック（先頭）"
-
-# ===================== Excel明細抽出（キャリー＋集約＋特例＋境界リセット） =====================
-def parse_excel_table(
-    df: pd.DataFrame,
-    header_map: dict,
-    koutei: str,
-    lot: str,
-    file_label: str,
-    qty_sign:int=1,
-    require_lotno: bool=True,
-    require_exp: bool=True,
-) -> tuple[list[dict], dict]:
-    """
-    - 「型番セルが1回のみ」「同一Lot No.が下に複数行（数量だけ1ずつ等）」をサポート。
-    - 行走査時に last_model / last_lotno / last_exp_norm をキャリー。
-    - (model, lotno, exp_norm) 単位で数量を集約（qty_sign適用後）→ 出力。
-    - 特例: 「シリアルだけが下にぶら下がり、Lot No.欄が全体で空」のブロックは、
-            Lot No.空のまま（許容）で型番行の払出数を1行にまとめて出力。
-            （UIでLot No.必須=ONでもブロック内にLot No.が1つも無ければ許容）
-    - 重要: 新しい“型番”を検知した時点で、last_lotno / last_exp_norm を必ず None にリセットし、
-            前ブロックのLot/期限が誤ってキャリーされるのを防止。
-    """
-    start=header_map["row"]+1
-    mc,lc,qc,ec = header_map["model"],header_map["lotno"],header_map["qty"],header_map["exp"]
-    sub=df.iloc[start:].copy().reset_index(drop=True)
-
-    stats = {"空行":0, "型番欠落":0, "LotNo欠落":0, "数量不正":0, "数量=0":0, "日付不正":0}
-    agg: Dict[tuple, int] = {}
-
-    last_model: Optional[str] = None
-    last_lotno: Optional[str] = None
-    last_exp_norm: Optional[str] = None
-
-    def _cell(row, idx):
-        return row.iloc[idx] if idx < len(row) else None
-
-    def _str_or_none(v):
-        s = None if pd.isna(v) or str(v).strip()=="" else str(v).strip()
-        return s
-
-    def has_any_lotno_until_next_model(start_i: int) -> bool:
-        """現在の行以降、次のモデルが出るまでの間にLotNoが1つでもあるか"""
-        for j in range(start_i+1, len(sub)):
-            rj = sub.iloc[j,:]
-            model_j = _str_or_none(_cell(rj, mc))
-            lotno_j = _str_or_none(_cell(rj, lc))
-            if model_j:  # 次のブロック開始
-                break
-            if lotno_j:
-                return True
-        return False
-
-    def lookahead_first_exp(start_i: int) -> Optional[str]:
-        """現在の行を含め、次のモデルが出るまでに最初に見つかった期限を返す"""
-        for j in range(start_i, len(sub)):
-            rj = sub.iloc[j,:]
-            model_j = _str_or_none(_cell(rj, mc))
-            if j > start_i and model_j:  # 次ブロックに入ったら終了
-                break
-            expv_j = _str_or_none(_cell(rj, ec))
-            exp_norm_j = normalize_date(expv_j) if expv_j else None
-            if exp_norm_j:
-                return exp_norm_j
-        return None
-
-    for i in range(len(sub)):
-        row=sub.iloc[i,:]
-
-        model_raw=_cell(row, mc)
-        lotno_raw=_cell(row, lc)
-        qty_raw  =_cell(row, qc)
-        exp_raw  =_cell(row, ec)
-
-        model = _str_or_none(model_raw)
-        lotno = _str_or_none(lotno_raw)
-        qty_i = _to_int_qty(qty_raw)
-        exp_s = _str_or_none(exp_raw)
-        exp_norm = normalize_date(exp_s) if exp_s else None
-
-        # 完全空行
-        if not any([model, lotno, (qty_i is not None), (exp_s is not None and exp_s!="")]):
-            stats["空行"] += 1
-            continue
-
-        # ★ ブロック境界検知：この行に model があれば新ブロック開始
-        if model:
-            last_model = model
-            # 前ブロックのLot/期限はここで確実に捨てる（誤キャリー防止）
-            last_lotno = None
-            last_exp_norm = None
-
-        # 入力がある項目だけ last_* を更新
-        if lotno: last_lotno = lotno
-        if exp_norm: last_exp_norm = exp_norm
-
-        cur_model = last_model
-        cur_lotno = last_lotno
-        cur_exp   = last_exp_norm
-
-        if not cur_model:
-            stats["型番欠落"] += 1
-            continue
-
-        # 数量チェック
-        if qty_i is None:
-            # 期限だけやシリアル行などは既にキャリー済みなのでエラーにしない
-            continue
-        if qty_i == 0:
-            stats["数量=0"] += 1
-            continue
-        qty_i = abs(qty_i) * qty_sign
-
-        # 期限がこの時点で未確定なら、同ブロック内から先読み
-        if require_exp and not cur_exp:
-            peek_exp = lookahead_first_exp(i)
-            if peek_exp:
-                cur_exp = peek_exp
-                last_exp_norm = peek_exp
-            else:
-                stats["日付不正"] += 1
-                continue
-
-        # Lot No.必須だが、ブロック内にLotNoが1つも無い=シリアルだけの特例は許容
-        if require_lotno and not cur_lotno:
-            if has_any_lotno_until_next_model(i):
-                stats["LotNo欠落"] += 1
-                continue
-            else:
-                cur_lotno = ""  # 特例：空のまま出力
-
-        key = (cur_model, cur_lotno or "", cur_exp or "")
-        agg[key] = agg.get(key, 0) + qty_i
-
-    out: List[Dict[str, Any]] = []
-    for (model, lotno, exp_norm), qty_sum in agg.items():
-        out.append({
-            "工程名": koutei or "",
-            "LOT": lot or "",
-            "型番": model,
-            "Lot No.": lotno,
-            "払出数": qty_sum,
-            "有効期限": exp_norm or "",
-            "ファイル名": file_label
-        })
-
-    return out, stats
-
-# ===================== 集計（品名ごと／工程ごと） =====================
-def ensure_sheet(wb, name, headers):
-    ws = wb[name] if name in wb.sheetnames else wb.create_sheet(name)
-    if ws.max_row < 1 or all(ws.cell(row=1,column=i+1).value is None for i in range(len(headers))):
-        for i,h in enumerate(headers,1): ws.cell(row=1,column=i).value = h
-    return ws
-
-def clear_sheet_body(ws):
-    if ws.max_row > 1:
-        ws.delete_rows(idx=2, amount=ws.max_row-1)
-
-def read_sheet_as_records(ws) -> list[dict]:
-    headers = [str(ws.cell(row=1, column=c).value or "").strip() for c in range(1, ws.max_column+1)]
-    recs=[]
-    for r in range(2, ws.max_row+1):
-        row={}; empty=True
-        for c,h in enumerate(headers,1):
-            v = ws.cell(row=r, column=c).value
-            if v not in (None,""): empty=False
-            row[h]=v
-        if not empty: recs.append(row)
-    return recs
-
-def build_name_map_from_master(wb) -> dict:
-    if "品名マスタ" not in wb.sheetnames:
-        ws = wb.create_sheet("品名マスタ")
-        ws.cell(row=1, column=1, value="品名")
-        ws.cell(row=1, column=2, value="型番")
-        return {}
-    ws = wb["品名マスタ"]
-    mp={}
-    for r in range(2, ws.max_row+1):
-        pname = ws.cell(row=r, column=1).value
-        model = ws.cell(row=r, column=2).value
-        if model:
-            mp[str(model).strip()] = ("" if pname in (None,"") else str(pname).strip())
-    return mp
-
-def refresh_reports_in_workbook(wb, edit_sheet_name="編集用"):
-    if edit_sheet_name not in wb.sheetnames:
-        return
-    ws_edit = wb[edit_sheet_name]
-    records = read_sheet_as_records(ws_edit)
-    ws_by_item = ensure_sheet(wb, "品名ごと", ["品名","型番","払出数合計"])
-    ws_by_proc = ensure_sheet(wb, "工程ごと", ["工程名","品名","型番","払出数合計"])
-    clear_sheet_body(ws_by_item); clear_sheet_body(ws_by_proc)
-    if not records:
-        autosize(ws_by_item); autosize(ws_by_proc); return
-    for rec in records:
-        try: rec["払出数"] = int(rec.get("払出数",0))
-        except: rec["払出数"] = 0
-    name_map = build_name_map_from_master(wb)
-    sum_by_model={}
-    for rec in records:
-        model = str(rec.get("型番") or "").strip()
-        if not model: continue
-        sum_by_model[model] = sum_by_model.get(model,0) + rec["払出数"]
-    for model in sorted(sum_by_model.keys()):
-        pname = name_map.get(model, "")
-        ws_by_item.append([pname, model, sum_by_model[model]])
-    autosize(ws_by_item)
-    sum_by_proc_model={}
-    for rec in records:
-        proc  = str(rec.get("工程名") or "").strip()
-        model = str(rec.get("型番") or "").strip()
-        if not proc or not model: continue
-        key=(proc, model)
-        sum_by_proc_model[key] = sum_by_proc_model.get(key,0) + rec["払出数"]
-    for (proc, model) in sorted(sum_by_proc_model.keys(), key=lambda x:(x[0],x[1])):
-        pname = name_map.get(model, "")
-        ws_by_proc.append([proc, pname, model, sum_by_proc_model[(proc, model)]])
-    autosize(ws_by_proc)
-
-# ===================== “編集用”追記＋レポート再作成 =====================
-def update_workbook_with_rows(base_xlsx_bytes: bytes|None, rows: List[Dict[str,Any]], sheet_name:str="編集用") -> bytes:
-    if base_xlsx_bytes:
-        wb = load_workbook(io.BytesIO(base_xlsx_bytes))
-    else:
-        wb = Workbook()
-        wb.active.title = sheet_name
-        ws0 = wb[sheet_name]; ws0.append(HEADERS)
-        ws_m = wb.create_sheet("品名マスタ")
-        ws_m.cell(row=1, column=1, value="品名")
-        ws_m.cell(row=1, column=2, value="型番")
-        ensure_sheet(wb, "品名ごと", ["品名","型番","払出数合計"])
-        ensure_sheet(wb, "工程ごと", ["工程名","品名","型番","払出数合計"])
-
-    ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.create_sheet(sheet_name)
-    if ws.max_row < 1 or all(ws.cell(row=1,column=c).value is None for c in range(1,len(HEADERS)+1)):
-        for c,h in enumerate(HEADERS,1): ws.cell(row=1,column=c).value = h
-
-    for r in rows:
-        q = _to_int_qty(r.get("払出数"))
-        if q is None or q == 0:
-            continue
-        ws.append([r.get(h,"") for h in HEADERS])
-    autosize(ws)
-    refresh_reports_in_workbook(wb, edit_sheet_name=sheet_name)
-    bio=io.BytesIO(); wb.save(bio); return bio.getvalue()
+from extractor import HEADERS, run_extraction, summarize_date_paths
+import instrument
+from normalizers import norm
+from extract_cache import ExtractionCache
+from ledger import update_workbook_with_rows
+from ledger_job import LedgerJob
+from preview import ResultPreview, page_count
+from readers import DEFAULT_ENGINE, available_engines
+from ledger_store import LedgerStore
+from rowtable import RowTable
+from spill import MEMORY_BUDGET, SpilledFile, content_digest
+from archive import expand_uploads
+from import_history import ImportHistory, drop_duplicate_rows, history_rows_for, ledger_row_keys, load_history, split_known
 
 # ===================== Copilot Studio（Direct Line）連携テスト =====================
 def copilot_directline_test(secret: str, test_message: str = "ping") -> tuple[bool, str]:
@@ -489,7 +66,17 @@ def copilot_directline_test(secret: str, test_message: str = "ping") -> tuple[bo
         return False, f"error: {e}"
 
 # ===================== Streamlit UI =====================
+@st.cache_resource
+def get_extraction_cache() -> ExtractionCache:
+    """全セッション共有の抽出キャッシュ。EXTRACT_CACHE_DIR を設定するとディスク層も使う（再起動後も有効）"""
+    return ExtractionCache(
+        disk_dir=os.environ.get("EXTRACT_CACHE_DIR") or None,
+        disk_max_bytes=int(os.environ.get("EXTRACT_CACHE_MAX_MB", "512")) * 1024**2,
+    )
+
 st.set_page_config(page_title="Excel抽出ツール", page_icon="🧾", layout="wide")
+# EXTRACT_METRICS_LOG を設定すると、計測を JSON ログ（1行1レコード）でそのファイルに追記する（'-' は標準エラー）
+instrument.configure_json_log(os.environ.get("EXTRACT_METRICS_LOG"))
 # タイトルは表示しない（ユーザー要望）
 
 with st.sidebar:
@@ -497,6 +84,44 @@ with st.sidebar:
     require_lotno = st.checkbox("Lot No.を必須にする", value=True)
     require_exp   = st.checkbox("有効期限を必須にする", value=True)
 
+    st.subheader("台帳レポート")
+    full_report = st.checkbox("『品名ごと』『工程ごと』を全件から作り直す", value=False,
+                              help="OFF: 前回の集計に今回の追記分だけを加算（高速）。ON: 編集用を全件読み直す")
+
+    # EXTRACT_LEDGER_DB を設定すると、台帳を SQLite に持てる（xlsx はダウンロード用に書き出すだけ）
+    ledger_db = os.environ.get("EXTRACT_LEDGER_DB") or None
+    use_store = bool(ledger_db) and st.checkbox(f"台帳DB（{ledger_db}）へ追記する", value=True,
+                                                help="追記先Excelの代わりに台帳DBへ追記し、台帳Excelは台帳DBから作ります。"
+                                                     "台帳DBが空のときは、指定した追記先Excelを先に取り込みます")
+
+    st.subheader("重複取込の防止")
+    skip_known = st.checkbox("取込済みのファイルを飛ばす", value=True,
+                             help="追記先Excel（台帳DB）の取込履歴と内容が同じファイルは、解析せずに飛ばします")
+    dedup_rows = st.checkbox("同じ行を追記しない（行単位の重複除去）", value=False,
+                             help="編集用に既にある行・今回の中で重複した行（全列が同じ）を追記しません。台帳が大きいと遅くなります")
+
+    st.subheader("台帳Excelの作成")
+    ledger_in_background = st.radio("作成のタイミング", ["ダウンロード時", "抽出後にバックグラウンドで"], index=0,
+                                    help="ダウンロード時: プレビューだけ見るときは台帳を作りません。"
+                                         "バックグラウンド: 抽出が終わるとすぐ作り始め、できあがるとダウンロードできます"
+                                    ) == "抽出後にバックグラウンドで"
+
+    st.subheader("Excelの読み込み")
+    # 自動: python-calamine が入っていれば calamine、無ければ openpyxl。既定は EXTRACT_READER
+    engine_choices = ["auto"] + available_engines()
+    reader_engine = st.selectbox("読み込みエンジン", engine_choices,
+                                 index=engine_choices.index(DEFAULT_ENGINE) if DEFAULT_ENGINE in engine_choices else 0,
+                                 format_func=lambda e: "自動" if e == "auto" else e,
+                                 help="自動: python-calamine が入っていれば calamine（高速）、無ければ openpyxl で読みます。"
+                                      "どちらでも抽出結果は同じです")
+
+    st.subheader("並列処理")
+    workers = st.number_input("ワーカープロセス数（1=逐次）", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1)
+
+    st.subheader("計測")
+    profile_slowest = st.checkbox("一番遅いファイルをプロファイルする", value=False,
+                                  help="抽出後に最も時間のかかったファイルを cProfile＋tracemalloc の下でもう一度抽出し、結果を添付します（その分遅くなります）")
+
     st.subheader("Copilot連携テスト（Direct Line）")
     directline_secret = st.text_input("Direct Line シークレット（既定のボット）", type="password")
     test_text = st.text_input("テスト送信メッセージ", value="ping")
@@ -510,8 +135,9 @@ with st.sidebar:
             else:
                 st.error(f"❌ 連携NG：{msg}")
 
-st.markdown("### 1) 入力ファイル（Excel／複数可）")
-xlsx_inputs = st.file_uploader("Excel（シート自動選択：編集用＞数量の多いシート＞先頭）", type=["xlsx"], accept_multiple_files=True)
+st.markdown("### 1) 入力ファイル（Excel／zip／複数可）")
+xlsx_inputs = st.file_uploader("Excel または Excel をまとめた zip（サブフォルダ可。シート自動選択：編集用＞数量の多いシート＞先頭）",
+                               type=["xlsx", "zip"], accept_multiple_files=True)
 
 st.markdown("### 2) 追記先Excel（未指定なら新規作成してDL可）")
 out_book = st.file_uploader("既存Excel（“編集用/品名ごと/工程ごと/品名マスタ”を含む想定）", type=["xlsx"])
@@ -520,82 +146,245 @@ st.markdown("---")
 run = st.button("▶ データ抽出")
 
 # 状態
-if "rows_all" not in st.session_state: st.session_state.rows_all=[]
 if "problems" not in st.session_state: st.session_state.problems=[]
-if "updated_excel_bytes" not in st.session_state: st.session_state.updated_excel_bytes=None
+# ledger_job は台帳Excelの作成（LedgerJob）。出来上がった台帳は一時ファイル1つで、次の実行の開始時に消す
+if "ledger_job" not in st.session_state: st.session_state.ledger_job=None
+if "metrics" not in st.session_state: st.session_state.metrics=None
+# プレビュー（ResultPreview）は抽出1回につき1回だけ作る。絞り込み・ページ送りでは作り直さない
+if "preview" not in st.session_state: st.session_state.preview=None
 
 if run:
-    st.session_state.rows_all=[]; st.session_state.problems=[]; st.session_state.updated_excel_bytes=None
+    if st.session_state.ledger_job is not None:
+        st.session_state.ledger_job.discard()
+    st.session_state.problems=[]; st.session_state.ledger_job=None
+    st.session_state.metrics=None; st.session_state.preview=None
+
+    # 追記先（取込履歴を先に読むため、抽出の前に用意する）
+    base = None; base_spill = None
+    if out_book:
+        if out_book.size > MEMORY_BUDGET:
+            base_spill = SpilledFile.from_buffer(out_book.getbuffer())
+            base = base_spill.path
+        else:
+            base = out_book.getvalue()
 
     # -------- Excel処理のみ --------
+    # 明細は RowTable（列ごとの配列。1行1 dict で持たない）。セッションにはプレビューと台帳の作成用にだけ残る
+    rows_all = RowTable()
+    saved_parses = 0; cache_hits = 0; files = []; spilled = []; date_paths = ""; results = []; extract_s = 0.0
+    history = ImportHistory(); digests = []
     if xlsx_inputs:
-        for xf in xlsx_inputs:
+        # メモリ予算（EXTRACT_MEMORY_BUDGET_MB）を超える分は一時ファイルに逃がし、パスで渡す。
+        # zip は中の .xlsx を1件ずつ一時ファイルへ展開し、サブパスをファイル名として扱う
+        files, spilled, archive_problems = expand_uploads(xlsx_inputs, MEMORY_BUDGET)
+        st.session_state.problems.extend(archive_problems)
+        if spilled:
+            st.caption(f"一時ファイル経由で読み込む入力: {len(spilled)} 件（zip の中身・メモリ予算 {MEMORY_BUDGET // 1024**2} MB 超の分）")
+        # 取込履歴（台帳DBに行があれば台帳DB、無ければ追記先Excel）と内容が同じファイルは解析せずに飛ばす
+        try:
+            if use_store and os.path.exists(ledger_db):
+                with LedgerStore(ledger_db) as store:
+                    history = store.history() if store.count() else load_history(base)
+            else:
+                history = load_history(base)
+        except Exception as e:
+            st.session_state.problems.append(f"取込履歴を読めません（すべて取り込みます）: {e}")
+        if skip_known:
+            files, digests, skipped, notes = split_known(files, history)
+            if skipped:
+                st.info(f"取込済みのため {len(skipped)} 件を飛ばしました:\n- " + "\n- ".join(skipped))
+            for msg in notes:
+                st.info(msg)
+        else:
+            digests = [content_digest(src) for _, src in files]
+        # ワーカー数>1 ならファイル単位でプロセス並列。結果はアップロード順に並ぶ
+        # 件数の上限は無し。同時に処理するファイルは展開後サイズの見積もりがメモリ予算に収まる分だけ
+        bar = st.progress(0.0, text=f"抽出中 0 / {len(files)}")
+        def on_progress(done: int, total: int, name: str):
+            bar.progress(done / total, text=f"抽出中 {done} / {total}（{name}）")
+        t0 = time.perf_counter()
+        results = run_extraction(files, require_lotno=require_lotno, require_exp=require_exp,
+                                 workers=workers, cache=get_extraction_cache(),
+                                 memory_budget=MEMORY_BUDGET, progress=on_progress, engine=reader_engine,
+                                 digests=digests)
+        extract_s = time.perf_counter() - t0
+        bar.empty()
+        cache_hits = sum(1 for res in results if res["cached"])
+        date_paths = summarize_date_paths(results)
+        for res in results:
+            rows_all.extend(res["rows"])
+            st.session_state.problems.extend(res["problems"])
+            for msg in res["infos"]:
+                st.info(msg)
+            saved_parses += res["saved_parses"]
+        if dedup_rows and rows_all:
             try:
-                xbytes=xf.read()
-
-                # 変更点：数量優先ロジックで取り込みシートを決定
-                target_sheet, reason = choose_target_sheet_qty_first(xbytes)
-
-                df=pd.read_excel(io.BytesIO(xbytes), sheet_name=target_sheet, header=None)
-
-                koutei, lot = extract_koutei_lot_from_sheet(df)
-                hmap=detect_header(df, scan_rows=60)
-                if not hmap:
-                    st.session_state.problems.append(f"{xf.name}: ヘッダ検出失敗（{target_sheet} / 理由: {reason}）")
-                    continue
-
-                # ファイル名に「返庫」を含む場合、払出数をマイナス符号で取り込む
-                base_name = xf.name.rsplit(".", 1)[0]
-                qty_sign = -1 if is_henko_from_name(base_name) else 1
-
-                rows, rej = parse_excel_table(
-                    df, hmap, koutei or "", lot or "",
-                    file_label=base_name,
-                    qty_sign=qty_sign,
-                    require_lotno=require_lotno,
-                    require_exp=require_exp,
-                )
-                st.session_state.rows_all.extend(rows)
-                if not rows:
-                    st.session_state.problems.append(
-                        f"{xf.name}: 明細0件（{target_sheet} / {reason} / 拒否内訳: {rej}）"
-                    )
+                if use_store and os.path.exists(ledger_db):
+                    with LedgerStore(ledger_db) as store:
+                        keys = store.row_keys() if store.count() else ledger_row_keys(base)
                 else:
-                    bad = {k:v for k,v in rej.items() if v>0}
-                    if bad:
-                        st.info(f"{xf.name}（{target_sheet}）でスキップ: {bad}")
+                    keys = ledger_row_keys(base)
+                rows_all, dropped = drop_duplicate_rows(rows_all, keys)
+                if dropped:
+                    st.info(f"編集用に既にある行・今回の中で重複した行 {dropped} 行を追記しません。")
             except Exception as e:
-                st.session_state.problems.append(f"{xf.name}: 解析エラー: {e}")
+                st.session_state.problems.append(f"行単位の重複除去をできません（すべて追記します）: {e}")
 
-    total=len(st.session_state.rows_all)
+    total=len(rows_all)
+    if total:
+        st.session_state.preview = ResultPreview(rows_all)
+        st.session_state.preview_page = 1
     if st.session_state.problems:
         st.warning("一部で問題:\n- " + "\n- ".join(st.session_state.problems))
     if total==0:
         st.error("有効なデータ行を抽出できませんでした。")
     else:
         st.success(f"合計 {total} 行を抽出しました。")
+        st.caption(f"明細の保持メモリ: {rows_all.nbytes() / 1024**2:.1f} MB"
+                   f"（{rows_all.nbytes() / total:.0f} バイト/行）")
+    if saved_parses:
+        st.caption(f"シート読込の再利用: {saved_parses} 回（再読込を省略）")
+    if date_paths:
+        st.caption(f"有効期限セルの変換経路: {date_paths}（文字列のみ正規表現で解析）")
+    if files:
+        cache = get_extraction_cache()
+        st.caption(f"抽出キャッシュ: 今回 ヒット {cache_hits} / ミス {len(files)-cache_hits}"
+                   f"（累計 ヒット {cache.hits} / ミス {cache.misses}）")
 
     # -------- “編集用”追記＋レポート再作成 --------
+    # 台帳Excelはここでは作らず、作成に必要な入力だけを LedgerJob に持たせる（ダウンロード時／バックグラウンドで作る）。
+    # 台帳DBへの追記は取り込みそのものなのでここで行い、台帳Excelは作成時に台帳DBから書き出す
+    run_id = time.strftime("%Y%m%dT%H%M%S")
+    ledger_s = None
     try:
-        base_bytes = out_book.getvalue() if out_book else None
-        updated = update_workbook_with_rows(base_bytes, st.session_state.rows_all, sheet_name="編集用")
-        st.session_state.updated_excel_bytes = updated
-        st.info("『編集用』へ追記し、『品名ごと』『工程ごと』を最新化しました。")
+        # 明細を取り込めたファイルだけを取込履歴に記録する（台帳と同じ保存で残る）
+        history_rows = history_rows_for(results, digests, history)
+        if use_store:
+            t0 = time.perf_counter()
+            with LedgerStore(ledger_db) as store:
+                if base and store.count() == 0:
+                    st.caption(f"台帳DBへ追記先Excelを取り込みました（{store.import_workbook(base)} 行）")
+                store.append(rows_all, history_rows)
+                if full_report:
+                    store.rebuild_sums()
+            ledger_s = time.perf_counter() - t0
+            def build_ledger(dest: str, db: str=ledger_db):
+                with LedgerStore(db) as store:
+                    store.export_xlsx(dest)
+        else:
+            # 作成はダウンロードされるまで待つことがあるので、追記先は bytes のまま持たず一時ファイルにする。
+            # 追記先の一時ファイル（base_spill）は build_ledger が参照している間（＝作成が終わるまで）消えない
+            if isinstance(base, bytes):
+                base_spill = SpilledFile.from_buffer(out_book.getbuffer())
+                base = base_spill.path
+            def build_ledger(dest: str, base=base, keep=base_spill, rows=rows_all, history_rows=history_rows,
+                             report_mode="full" if full_report else "auto"):
+                update_workbook_with_rows(base, rows, sheet_name="編集用", report_mode=report_mode, dest=dest,
+                                          history_rows=history_rows)
+        job = LedgerJob(build_ledger, on_built=lambda j, run_id=run_id: instrument.log_ledger(
+            run=run_id, seconds=round(j.seconds, 6), bytes=j.size))
+        if ledger_in_background:
+            job.start()
+        st.session_state.ledger_job = job
+        st.info("台帳DBへ追記しました。" if use_store else "台帳Excelの作成を準備しました。")
     except Exception as e:
         st.error(f"Excelの更新に失敗: {e}")
 
+    # -------- 計測 --------
+    if results:
+        instrument.log_run(results, run_id=run_id, workers=int(workers), reader=reader_engine, extract_s=round(extract_s, 6),
+                           ledger_s=None if ledger_s is None else round(ledger_s, 6))
+        profile = None
+        if profile_slowest:
+            with st.spinner("一番遅いファイルをプロファイル中…"):
+                profile = instrument.profile_slowest(files, results, require_lotno, require_exp)
+        st.session_state.metrics = {"table": instrument.metrics_table(results), "extract_s": extract_s,
+                                    "ledger_s": ledger_s, "profile": profile}
+
+    # 入力の一時ファイルはこの実行で使い終わり（追記先は台帳の作成が終わるまで LedgerJob が持つ）
+    for sf in spilled + ([base_spill] if base_spill and use_store else []):
+        sf.cleanup()
+
+# ===================== 計測 =====================
+if st.session_state.metrics:
+    m = st.session_state.metrics
+    with st.expander("処理時間の内訳（ファイル別・工程別）"):
+        job = st.session_state.ledger_job
+        ledger_txt = f"{job.seconds:.2f} 秒" if job is not None and job.seconds is not None else "未作成"
+        store_txt = "" if m["ledger_s"] is None else f" / 台帳DBへの追記 {m['ledger_s']:.2f} 秒"
+        st.caption(f"抽出 {m['extract_s']:.2f} 秒（並列時はファイルごとの合計と一致しません）{store_txt} / 台帳Excelの作成 {ledger_txt}")
+        st.dataframe(pd.DataFrame(m["table"]), use_container_width=True)
+        prof = m["profile"]
+        if prof:
+            st.markdown(f"**プロファイル: {prof['name']}**（{prof['seconds']:.2f} 秒 / "
+                        f"メモリ最大 {prof['peak_bytes']/1024**2:.1f} MB。計測の上乗せ込み）")
+            st.code(prof["pstats"], language="text")
+            st.code(prof["memory_top"], language="text")
+            st.download_button("📥 プロファイル（.prof）をダウンロード", data=prof["prof"],
+                               file_name=f"profile_{prof['name'].rsplit('.', 1)[0]}.prof",
+                               mime="application/octet-stream")
+
 # ===================== プレビュー =====================
-st.markdown("### 抽出結果（先頭300行）")
-if st.session_state.rows_all:
-    df_out = pd.DataFrame(st.session_state.rows_all, columns=HEADERS)[:300]
-    st.dataframe(df_out, use_container_width=True)
+# fragment にして、絞り込み・並べ替え・ページ送りではこの部分だけを再実行する（抽出・台帳の処理は走らない）
+def reset_preview_page():
+    st.session_state.preview_page = 1
+
+@st.fragment
+def show_preview(pv: ResultPreview):
+    # 絞り込み・並べ替えを変えたら1ページ目へ戻す
+    c1, c2, c3 = st.columns(3)
+    f_proc  = c1.multiselect("工程名", pv.options("工程名"), key="preview_proc", on_change=reset_preview_page)
+    f_model = c2.text_input("型番（部分一致）", key="preview_model", on_change=reset_preview_page)
+    f_file  = c3.text_input("ファイル名（部分一致）", key="preview_file", on_change=reset_preview_page)
+    c4, c5, c6 = st.columns(3)
+    sort_by   = c4.selectbox("並べ替え", ["（抽出順）"] + HEADERS, key="preview_sort", on_change=reset_preview_page)
+    ascending = c5.radio("順序", ["昇順", "降順"], horizontal=True, key="preview_order",
+                         on_change=reset_preview_page) == "昇順"
+    page_size = c6.selectbox("1ページの行数", [100, 300, 1000], index=1, key="preview_size", on_change=reset_preview_page)
+    query = dict(filters={"工程名": f_proc, "型番": f_model.strip(), "ファイル名": f_file.strip()},
+                 sort_by=None if sort_by == "（抽出順）" else sort_by, ascending=ascending, page_size=page_size)
+
+    page = st.session_state.get("preview_page", 1)
+    df_page, n = pv.query(page=page, **query)
+    pages = page_count(n, page_size)
+    if page > pages:   # 絞り込みで行が減ったら最終ページへ
+        page = st.session_state.preview_page = pages
+        df_page, n = pv.query(page=page, **query)
+    st.dataframe(df_page, use_container_width=True)
+    c7, c8 = st.columns([1, 3])
+    c7.number_input("ページ", min_value=1, max_value=pages, step=1, key="preview_page")
+    c8.caption(f"{n} / {len(pv)} 行（{pages} ページ）")
+
+st.markdown("### 抽出結果")
+if st.session_state.preview is not None:
+    show_preview(st.session_state.preview)
+
+# ===================== ダウンロード =====================
+# バックグラウンドで作成中は1秒ごとにこの部分だけを再実行し、できあがったら画面全体を描き直す
+@st.fragment(run_every=1.0)
+def wait_for_ledger(job: LedgerJob):
+    if not job.running:
+        st.rerun()
+    st.info("⏳ 台帳Excelを作成中です…（できあがるとダウンロードできます）")
 
 st.markdown("### 更新済みExcelのダウンロード")
-if st.session_state.updated_excel_bytes:
-    st.download_button(
-        "📥 更新済みExcelをダウンロード",
-        data=st.session_state.updated_excel_bytes,
-        file_name=f"updated_{int(time.time())}.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        use_container_width=True,
-    )
+job = st.session_state.ledger_job
+if job is not None:
+    if job.running:
+        wait_for_ledger(job)
+    elif job.error is not None:
+        st.error(f"Excelの更新に失敗: {job.error}")
+    else:
+        if job.ready:
+            st.caption(f"✅ 台帳Excel 作成済み（{job.size / 1024**2:.1f} MB / {job.seconds:.2f} 秒）")
+        else:
+            st.caption("ボタンを押すと台帳Excelを作成してダウンロードします（大きな台帳は少し待ちます）")
+        # data に関数を渡すと、押されたときに別スレッドで呼ばれる（台帳の作成もそこで行う）。
+        # 送信用に台帳全体が bytes でメモリに読まれるのは押したときだけ（それ以外は一時ファイルにしかない）
+        st.download_button(
+            "📥 更新済みExcelをダウンロード",
+            data=job.read_bytes,
+            file_name=f"updated_{int(time.time())}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True,
+        )
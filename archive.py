@@ -0,0 +1,110 @@
+# archive.py
+# zip アーカイブ・フォルダからの入力。中の .xlsx（サブフォルダ含む）を1件ずつ取り出し、
+# 通常の1ファイル単位の抽出（extractor.run_extraction）に [(サブパス, パス)] として渡す。
+#   - zip の各エントリはストリームで一時ファイル（spill.SpilledFile）へ展開する（アーカイブ全体をメモリに載せない）
+#   - 日本語のファイル名は UTF-8 フラグが無ければ UTF-8 → CP932 の順に解釈する（Windows の「送る→圧縮」は CP932）
+#   - ファイル名として報告するのはアーカイブ／フォルダ内のサブパス（例: 9月/返庫_A.xlsx）。
+#     返庫の判定はサブパスの最後の要素（ファイル名）だけで行う（extractor.finish_extraction）
+# ------------------------------------------------------------
+import os, shutil, zipfile
+from typing import Iterable
+
+from spill import MEMORY_BUDGET, Source, SpilledFile, open_source, spill_uploads
+
+_COPY_CHUNK = 1 << 20
+_UTF8_FLAG = 0x800
+
+def is_zip_name(name: str) -> bool:
+    return name.lower().endswith(".zip")
+
+def is_workbook_name(path: str) -> bool:
+    """取り込む .xlsx か（Excel の一時ファイル ~$*.xlsx と macOS の __MACOSX/ は除く）"""
+    parts = path.split("/")
+    return (path.lower().endswith(".xlsx") and not parts[-1].startswith("~$")
+            and "__MACOSX" not in parts)
+
+def decode_entry_name(info: zipfile.ZipInfo) -> str:
+    """エントリ名を復元する。UTF-8 フラグが無い名前は zipfile が CP437 として読んでいるので、元のバイト列から読み直す"""
+    name = info.filename
+    if not info.flag_bits & _UTF8_FLAG:
+        try:
+            raw = name.encode("cp437")
+        except UnicodeEncodeError:
+            raw = None
+        if raw is not None:
+            for enc in ("utf-8", "cp932"):
+                try:
+                    name = raw.decode(enc)
+                    break
+                except UnicodeDecodeError:
+                    pass
+    return name.replace("\\", "/").lstrip("/")
+
+def extract_workbooks(src) -> tuple[list[tuple[str, str]], list[SpilledFile], list[str]]:
+    """
+    zip（Source またはファイルオブジェクト）の中の .xlsx を1件ずつ一時ファイルへ展開する。
+    返り値: ([(サブパス, 一時ファイルのパス)], 一時ファイルの保持用リスト, 展開できなかったエントリのメッセージ)
+    一時ファイルは2つ目のリストを手放すと消えるので、抽出が終わるまで持っておくこと。
+    """
+    files: list[tuple[str, str]] = []
+    spilled: list[SpilledFile] = []
+    problems: list[str] = []
+    fp = src if hasattr(src, "read") else open_source(src)
+    try:
+        with zipfile.ZipFile(fp) as zin:
+            entries = [(decode_entry_name(info), info) for info in zin.infolist() if not info.is_dir()]
+            for name, info in sorted(entries, key=lambda e: e[0]):
+                if not is_workbook_name(name):
+                    continue
+                sf = SpilledFile()
+                try:
+                    with zin.open(info) as src_fp, open(sf.path, "wb") as dst:
+                        shutil.copyfileobj(src_fp, dst, _COPY_CHUNK)
+                except (RuntimeError, zipfile.BadZipFile, NotImplementedError, OSError) as e:
+                    # 暗号化・未対応の圧縮方式・CRC 不一致など
+                    sf.cleanup()
+                    problems.append(f"{name}: 展開できません（{e}）")
+                    continue
+                spilled.append(sf)
+                files.append((name, sf.path))
+    except zipfile.BadZipFile as e:
+        problems.append(f"zip として読めません（{e}）")
+    finally:
+        if fp is not src:
+            fp.close()
+    return files, spilled, problems
+
+def folder_workbooks(root: str) -> list[tuple[str, str]]:
+    """フォルダ以下（サブフォルダ含む）の .xlsx を [(root からの相対パス, パス)] で返す（相対パスは / 区切り・名前順）"""
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fn in filenames:
+            path = os.path.join(dirpath, fn)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            if is_workbook_name(rel):
+                found.append((rel, path))
+    return sorted(found)
+
+def expand_uploads(uploads: Iterable, budget: int = MEMORY_BUDGET) -> tuple[list[tuple[str, Source]], list[SpilledFile], list[str]]:
+    """
+    Streamlit のアップロード（.xlsx と .zip の混在可）を [(ファイル名, Source)] にする（アップロード順、zip は中身をその位置に展開）。
+    .xlsx は spill.spill_uploads でメモリ予算に従って振り分け、.zip は extract_workbooks で一時ファイルへ展開する。
+    problems のメッセージは『zip名: エントリ: 理由』の形。
+    """
+    uploads = list(uploads)
+    books, spilled = spill_uploads([xf for xf in uploads if not is_zip_name(xf.name)], budget)
+    books = iter(books)
+    files: list[tuple[str, Source]] = []
+    problems: list[str] = []
+    for xf in uploads:
+        if not is_zip_name(xf.name):
+            files.append(next(books))
+            continue
+        entries, entry_spills, entry_problems = extract_workbooks(xf)
+        files += entries
+        spilled += entry_spills
+        problems += [f"{xf.name}: {msg}" for msg in entry_problems]
+        if not entries and not entry_problems:
+            problems.append(f"{xf.name}: .xlsx が含まれていません")
+    return files, spilled, problems
@@ -0,0 +1,60 @@
+# bench_autosize.py
+# 列幅合わせのベンチ。大きな『編集用』に少量を追記したときの、
+#   - 旧方式（列ごとに ws[letter] で全セルを走査）
+#   - 全件走査（iter_rows で1回だけ走査）
+#   - 抜粋走査（先頭と末尾の AUTOSIZE_SAMPLE_ROWS 行）
+#   - 追記分のみ（追記した行とヘッダから幅を広げるだけ）
+# を比べる。
+# ------------------------------------------------------------
+# 実行: python bench/bench_autosize.py [--rows 100000] [--append 500]
+# ------------------------------------------------------------
+import argparse, os, sys, time
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from extractor import HEADERS  # noqa: E402
+from ledger import AUTOSIZE_SAMPLE_ROWS, autosize, fit_appended_columns  # noqa: E402
+
+def legacy_autosize(ws):
+    for col in range(1, ws.max_column + 1):
+        letter = get_column_letter(col)
+        max_len = 0
+        for cell in ws[letter]:
+            val = "" if cell.value is None else str(cell.value)
+            max_len = max(max_len, len(val))
+        ws.column_dimensions[letter].width = min(max_len + 2, 80)
+
+def make_row(i: int) -> list:
+    return [f"払出_{i % 50:02d}.xlsx", f"工程{i % 7}", f"LOT{i % 300:04d}", f"M-{i % 900:04d}",
+            f"L{i % 5000:05d}", "2026/12/31", 1 + i % 20]
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--append", type=int, default=500)
+    args = ap.parse_args()
+
+    wb = Workbook(); ws = wb.active
+    ws.append(HEADERS)
+    for i in range(args.rows):
+        ws.append(make_row(i))
+    legacy_autosize(ws)   # 既存台帳は列幅設定済みの想定
+    new_rows = [make_row(args.rows + i) for i in range(args.append)]
+    for values in new_rows:
+        ws.append(values)
+    print(f"既存 {args.rows} 行 + 追記 {args.append} 行")
+
+    for label, fn in [
+        ("旧方式（列ごとに全セル）", lambda: legacy_autosize(ws)),
+        ("全件走査（iter_rows）", lambda: autosize(ws)),
+        (f"抜粋走査（{AUTOSIZE_SAMPLE_ROWS}行）", lambda: autosize(ws, sample_rows=AUTOSIZE_SAMPLE_ROWS)),
+        ("追記分のみ（拡大のみ）", lambda: fit_appended_columns(ws, new_rows, len(HEADERS))),
+    ]:
+        t = time.perf_counter()
+        fn()
+        print(f"  {label:<20} {time.perf_counter()-t:8.3f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# bench_block_lookahead.py
+# ブロック内先読み（Lot No.有無・最初の期限）の最悪ケースベンチ。
+# 型番1行の下にシリアル1個ずつの行が大量にぶら下がり、Lot No.は空・期限はブロック末尾にだけある、
+# という並びは先読みを毎行発生させるため、索引なしでは行数の2乗で遅くなる。
+# ------------------------------------------------------------
+# 実行: python bench/bench_block_lookahead.py [--blocks 100] [--serials 1000]
+# ------------------------------------------------------------
+import argparse, os, sys, time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from extractor import parse_excel_table, parse_excel_table_reference  # noqa: E402
+
+HEADER_MAP = {"row": 0, "model": 0, "lotno": 1, "qty": 2, "exp": 3}
+
+def make_sheet(blocks: int, serials: int) -> pd.DataFrame:
+    data = [["型番", "Lot No.", "払出数", "有効期限", "シリアル"]]
+    for b in range(blocks):
+        data.append([f"M-{b:04d}", None, None, None, None])
+        data += [[None, None, 1, None, f"SN{b:04d}-{k:05d}"] for k in range(serials)]
+        data.append([None, None, None, "2026/12/31", None])
+    return pd.DataFrame(data)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=100)
+    ap.add_argument("--serials", type=int, default=1000)
+    args = ap.parse_args()
+
+    df = make_sheet(args.blocks, args.serials)
+    print(f"{args.blocks} ブロック × {args.serials} シリアル行（計 {len(df)-1} 行）")
+    results = {}
+    for label, fn in [("行ループ＋ブロック索引", parse_excel_table_reference), ("列単位エンジン", parse_excel_table)]:
+        t = time.perf_counter()
+        results[label] = fn(df, HEADER_MAP, "工程", "LOT1", "file")
+        print(f"  {label:<14} {time.perf_counter()-t:8.3f} s")
+    rows, stats = results["列単位エンジン"]
+    assert results["行ループ＋ブロック索引"] == (rows, stats)
+    assert len(rows) == args.blocks and all(r["払出数"] == args.serials for r in rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench_detect_header.py
+# detect_header（一括照合エンジン）と detect_header_reference（旧実装）の比較ベンチ。
+# 200列以上の横長シートで、ヘッダ位置（1段／2段マージ／見つからない）を変えて計測し、結果の一致も確認する。
+# ------------------------------------------------------------
+# 実行: python bench/bench_detect_header.py [--cols 200 400] [--repeat 5]
+# ------------------------------------------------------------
+import argparse, os, random, sys, timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from extractor import detect_header, detect_header_reference  # noqa: E402
+
+def make_sheet(cols: int, header_row: int, merged: bool, seed: int = 0) -> pd.DataFrame:
+    """上部に雑多なセル、header_row にヘッダ（merged なら上下2段に分割）、以降に明細を置いた横長シート"""
+    rnd = random.Random(seed)
+    rows = 120
+    data = np.full((rows, cols), np.nan, dtype=object)
+    for r in range(header_row):
+        for c in rnd.sample(range(cols), k=cols // 3):
+            data[r, c] = rnd.choice(["備考", "担当: 山田", "2025/9/16", 123, "　作業指示　", "区分"])
+    names = ["型番", "Lot No.", "払出数", "有効期限"]
+    pos = sorted(rnd.sample(range(cols), k=len(names)))
+    for c in range(cols):
+        if data[header_row, c] is np.nan:
+            data[header_row, c] = f"項目{c}"
+    for name, c in zip(names, pos):
+        if merged and name != "型番":
+            data[header_row, c] = np.nan
+            data[header_row + 1, c] = name
+        else:
+            data[header_row, c] = name
+    for r in range(header_row + 2, rows):
+        for c in pos:
+            data[r, c] = rnd.choice(["M-1", "LN-9", 3, "2026/1/1", None])
+    return pd.DataFrame(data)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cols", type=int, nargs="+", default=[200, 400])
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    cases = [("1段(5行目)", 5, False), ("1段(50行目)", 50, False), ("2段マージ", 10, True), ("ヘッダ無し", None, False)]
+    print(f"{'列数':>5} {'ケース':<12} {'旧実装[ms]':>11} {'新実装[ms]':>11} {'倍率':>6}")
+    for cols in args.cols:
+        for label, hr, merged in cases:
+            df = make_sheet(cols, hr if hr is not None else 0, merged)
+            if hr is None:
+                df = df.iloc[1:].reset_index(drop=True).astype(object).where(lambda d: d != "型番", "型")
+            ref = detect_header_reference(df)
+            new = detect_header(df)
+            assert ref == new, (label, cols, ref, new)
+            t_ref = min(timeit.repeat(lambda: detect_header_reference(df), number=1, repeat=args.repeat))
+            t_new = min(timeit.repeat(lambda: detect_header(df), number=1, repeat=args.repeat))
+            print(f"{cols:>5} {label:<12} {t_ref*1e3:>11.2f} {t_new*1e3:>11.2f} {t_ref/t_new:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
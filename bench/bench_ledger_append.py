@@ -0,0 +1,50 @@
+# bench_ledger_append.py
+# 既存台帳への追記のベンチ。大きな台帳に少量を追記したときの
+#   - openpyxl 経路（load_workbook でブック全体を読み込む）
+#   - パッケージ経路（xlsx_append: 編集用のXMLを流し写し、レポートだけ作り直す）
+# の時間とピークメモリ（tracemalloc）を比べ、両者の内容が一致することも確認する。
+# ------------------------------------------------------------
+# 実行: python bench/bench_ledger_append.py [--rows 200000] [--append 500]
+# ------------------------------------------------------------
+import argparse, io, os, sys, time, tracemalloc
+
+from openpyxl import load_workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from extractor import HEADERS  # noqa: E402
+from ledger import update_workbook_with_openpyxl, write_new_ledger  # noqa: E402
+from xlsx_append import append_rows_to_package  # noqa: E402
+
+def make_rows(n: int, offset: int = 0) -> list[dict]:
+    return [dict(zip(HEADERS, [f"工程{i % 7}", f"LOT{i % 300:04d}", f"M-{i % 900:04d}", f"L{i % 5000:05d}",
+                               1 + i % 20, "2026/12/31", f"払出_{i % 50:02d}"]))
+            for i in range(offset, offset + n)]
+
+def sheet_values(xbytes: bytes) -> dict:
+    wb = load_workbook(io.BytesIO(xbytes), read_only=True)
+    return {ws.title: list(ws.iter_rows(values_only=True)) for ws in wb}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--append", type=int, default=500)
+    args = ap.parse_args()
+
+    base = write_new_ledger(make_rows(args.rows))
+    new = make_rows(args.append, offset=args.rows)
+    print(f"既存 {args.rows} 行（{len(base)/1e6:.1f} MB）+ 追記 {args.append} 行")
+    results = {}
+    for label, fn in [("openpyxl 経路", lambda: update_workbook_with_openpyxl(base, new)),
+                      ("パッケージ経路", lambda: append_rows_to_package(base, new))]:
+        tracemalloc.start()
+        t = time.perf_counter()
+        results[label] = fn()
+        dt = time.perf_counter() - t
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {label:<12} {dt:8.2f} s  ピーク {peak/1e6:8.1f} MB")
+    assert results["パッケージ経路"] is not None
+    assert sheet_values(results["openpyxl 経路"]) == sheet_values(results["パッケージ経路"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_normalizers.py
+# セル値正規化のマイクロベンチ。従来の実装（毎回 re.search／str.maketrans／pd.Timestamp）と
+# normalizers の スカラー版（メモ化なし相当の初回・メモ化が効いた2回目）・列版 を比べ、結果の一致も確認する。
+# ------------------------------------------------------------
+# 実行: python bench/bench_normalizers.py [--cells 100000] [--unique 300]
+# ------------------------------------------------------------
+import argparse, os, random, re, sys, time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import normalizers as N  # noqa: E402
+
+# ---- 従来の実装（比較用にそのまま残す） ----
+def legacy_normalize_date(s):
+    if not s: return None
+    m = re.search(r"(\d{4})[./-](\d{1,2})[./-](\d{1,2})", s)
+    if not m: return None
+    y, mth, d = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    try:
+        dtv = pd.Timestamp(year=y, month=mth, day=d)
+        return f"{dtv.year}/{dtv.month}/{dtv.day}"
+    except Exception:
+        return None
+
+def legacy_to_int_qty(q):
+    if q is None or (isinstance(q, float) and pd.isna(q)):
+        return None
+    if isinstance(q, (int, float)):
+        return int(round(float(q)))
+    s = str(q).strip()
+    s = s.translate(str.maketrans("０１２３４５６７８９－．，", "0123456789-.,")).replace(",", "")
+    m = re.match(r"^\s*([+-]?\d+(?:\.\d+)?)", s)
+    if not m:
+        return None
+    try:
+        return int(round(float(m.group(1))))
+    except Exception:
+        return None
+
+def legacy_n(cell):
+    if pd.isna(cell): return ""
+    return str(cell).strip().replace("　","").replace("\n"," ").replace("\r"," ")
+
+def make_columns(cells: int, unique: int, seed: int = 1) -> dict[str, list]:
+    rnd = random.Random(seed)
+    dates = [f"20{rnd.randint(24, 30)}{rnd.choice('/-.')}{rnd.randint(1, 12)}{rnd.choice('/-.')}{rnd.randint(1, 31)}"
+             for _ in range(unique)] + [None]
+    qtys = [rnd.choice([rnd.randint(1, 50), f"{rnd.randint(1, 50)}個", f"１{rnd.randint(0, 9)}", f"{rnd.randint(1, 9)},000", None])
+            for _ in range(unique)]
+    texts = [rnd.choice(["型番", "Lot No.", "払出数", "有効 期限", "備考\n", "　数量　", None, 12, 3.5]) for _ in range(unique)]
+    return {
+        "date": [rnd.choice(dates) for _ in range(cells)],
+        "qty": [rnd.choice(qtys) for _ in range(cells)],
+        "text": [rnd.choice(texts) for _ in range(cells)],
+        # 実ファイルの有効期限列：大半は日付型（pandas が Timestamp にする）、一部がシリアル値・文字列
+        "exp_typed": [rnd.choice([pd.Timestamp(2025, rnd.randint(1, 12), rnd.randint(1, 28))] * 8
+                                 + [45000 + rnd.randint(0, 900), rnd.choice(dates)]) for _ in range(cells)],
+    }
+
+def bench(label: str, fn, *args):
+    t = time.perf_counter()
+    out = fn(*args)
+    print(f"  {label:<28} {time.perf_counter()-t:8.4f} s")
+    return out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cells", type=int, default=100_000)
+    ap.add_argument("--unique", type=int, default=300, help="列あたりのユニーク値の数（実データは繰り返しが多い）")
+    args = ap.parse_args()
+    cols = make_columns(args.cells, args.unique)
+    print(f"{args.cells} セル × 3列（ユニーク値 約 {args.unique}）")
+
+    for name, legacy, scalar, column in [
+        ("normalize_date", legacy_normalize_date, N.normalize_date, N.normalize_date_array),
+        ("to_int_qty", legacy_to_int_qty, N.to_int_qty, lambda v: N.to_int_qty_series(v).astype(object).tolist()),
+        ("_n / clean_cell", legacy_n, N.clean_cell, None),
+    ]:
+        values = cols["date" if name == "normalize_date" else "qty" if name == "to_int_qty" else "text"]
+        print(name)
+        N._normalize_date_str.cache_clear(); N._qty_from_str.cache_clear()
+        want = bench("従来（1セルずつ）", lambda: [legacy(v) for v in values])
+        got = bench("スカラー版（キャッシュ空から）", lambda: [scalar(v) for v in values])
+        bench("スカラー版（キャッシュ済み）", lambda: [scalar(v) for v in values])
+        assert got == want
+        if column is not None:
+            N._normalize_date_str.cache_clear(); N._qty_from_str.cache_clear()
+            got = bench("列版（ユニーク値ごと）", column, np.array(values, dtype=object))
+            assert [None if v is pd.NA else v for v in got] == want
+
+    # 有効期限セル：従来は str → 正規表現 → Timestamp の往復、いまは型のまま整形
+    values = np.array(cols["exp_typed"], dtype=object)
+    print("有効期限セル（日付型・シリアル値・文字列の混在）")
+    N._normalize_date_str.cache_clear()
+    bench("従来（文字列へ戻して正規表現）", lambda: [legacy_normalize_date(N.str_or_none(v)) for v in values])
+    counts: dict = {}
+    bench("normalize_date_cells", N.normalize_date_cells, values, counts)
+    print(f"  経路: {counts}")
+
+if __name__ == "__main__":
+    main()
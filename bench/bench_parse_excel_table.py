@@ -0,0 +1,63 @@
+# bench_parse_excel_table.py
+# parse_excel_table（列単位エンジン）と parse_excel_table_reference（旧・行ループ）の比較ベンチ。
+# 型番1回のみ／Lot No.の下ぶら下がり／シリアルのみ／期限の後出し を混ぜたシートで、出力と stats の一致も確認する。
+# ------------------------------------------------------------
+# 実行: python bench/bench_parse_excel_table.py [--rows 5000 50000] [--repeat 3]
+# ------------------------------------------------------------
+import argparse, datetime as dt, os, random, sys, time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from extractor import parse_excel_table, parse_excel_table_reference  # noqa: E402
+
+HEADER_MAP = {"row": 0, "model": 0, "lotno": 1, "qty": 2, "exp": 3}
+
+def make_sheet(rows: int, seed: int = 0) -> pd.DataFrame:
+    rnd = random.Random(seed)
+    data = [["型番", "Lot No.", "払出数", "有効期限", "備考"]]
+    while len(data) < rows + 1:
+        model = f"M-{rnd.randint(1, 300)}"
+        kind = rnd.random()
+        if kind < 0.3:    # シリアルのみ（Lot No.空）
+            data.append([model, None, rnd.randint(1, 5), dt.datetime(2026, rnd.randint(1, 12), 1), None])
+            data += [[None, None, None, None, f"SN{k:05d}"] for k in range(rnd.randint(1, 8))]
+        elif kind < 0.7:  # 型番1回のみ＋Lot No.ぶら下がり
+            data.append([model, None, None, None, None])
+            lot = f"LN{rnd.randint(1, 9999)}"
+            data += [[None, lot, 1, "2026/4/1", None] for _ in range(rnd.randint(1, 6))]
+        else:             # 期限の後出し・不正値混在
+            data.append([model, f"LN{rnd.randint(1, 9999)}", rnd.choice([1, "２", "3個", 0, "x"]), None, None])
+            data.append([None, None, None, rnd.choice(["2027-1-1", "2027/13/1", None]), None])
+        if rnd.random() < 0.05:
+            data.append([np.nan] * 5)
+    return pd.DataFrame(data[: rows + 1])
+
+def best(fn, repeat: int) -> float:
+    ts = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); ts.append(time.perf_counter() - t)
+    return min(ts)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, nargs="+", default=[5000, 50000])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'行数':>7} {'旧実装[s]':>10} {'新実装[s]':>10} {'倍率':>6}")
+    for rows in args.rows:
+        df = make_sheet(rows)
+        for require_lotno in (True, False):
+            for require_exp in (True, False):
+                for sign in (1, -1):
+                    args_ = (df, HEADER_MAP, "工程", "LOT1", "file", sign, require_lotno, require_exp)
+                    assert parse_excel_table(*args_) == parse_excel_table_reference(*args_), (rows, require_lotno, require_exp, sign)
+        args_ = (df, HEADER_MAP, "工程", "LOT1", "file")
+        t_ref = best(lambda: parse_excel_table_reference(*args_), args.repeat)
+        t_new = best(lambda: parse_excel_table(*args_), args.repeat)
+        print(f"{rows:>7} {t_ref:>10.3f} {t_new:>10.3f} {t_ref/t_new:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
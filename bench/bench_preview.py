@@ -0,0 +1,62 @@
+# bench_preview.py
+# 抽出結果プレビュー（preview.ResultPreview）の操作ごとの所要時間。
+# 大きな結果（既定 100 万行）で、作成・ページ送り・絞り込み・並べ替え（初回／2回目以降）を計り、
+# 目標（1操作 100 ms 未満）を超えたものに印を付ける。並べ替え＋絞り込みの結果は pandas での素直な計算と照合する。
+# ------------------------------------------------------------
+# 実行: python bench/bench_preview.py [--rows 1000000] [--files 500]
+# ------------------------------------------------------------
+import argparse, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from preview import ResultPreview  # noqa: E402
+from rowtable import RowTable  # noqa: E402
+
+TARGET_MS = 100
+
+def make_rows(rows: int, files: int) -> RowTable:
+    n = max(1, rows // files)
+    t = RowTable()
+    for i in range(files):
+        t.extend(RowTable.from_columns({
+            "工程名": f"工程{i % 7}", "LOT": f"LOT{i:04d}",
+            "型番": [f"M-{(i * 31 + k) % 900:04d}" for k in range(n)],
+            "Lot No.": [f"L{(i * 997 + k) % 50000:05d}" for k in range(n)],
+            "払出数": [1 + k % 20 for k in range(n)],
+            "有効期限": [f"20{26 + k % 4}/{1 + k % 12}/{1 + k % 28}" for k in range(n)],
+            "ファイル名": f"払出/{i:04d}",
+        }, n))
+    return t
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--files", type=int, default=500)
+    args = ap.parse_args()
+    rows = make_rows(args.rows, args.files)
+
+    t = time.perf_counter()
+    pv = ResultPreview(rows)
+    print(f"{len(pv)} 行  作成 {(time.perf_counter() - t) * 1000:7.1f} ms（抽出1回につき1回）")
+    cases = [
+        ("先頭ページ", {}),
+        ("最終ページ", {"page": len(pv) // 300}),
+        ("型番 部分一致", {"filters": {"型番": "M-01"}}),
+        ("工程名＋型番", {"filters": {"工程名": ["工程3"], "型番": "12"}}),
+        ("型番で並べ替え（初回）", {"sort_by": "型番"}),
+        ("型番で並べ替え（2回目・50ページ目）", {"sort_by": "型番", "page": 50}),
+        ("払出数 降順（初回）", {"sort_by": "払出数", "ascending": False}),
+        ("払出数 降順＋ファイル名 部分一致", {"sort_by": "払出数", "ascending": False, "filters": {"ファイル名": "00"}}),
+    ]
+    for label, query in cases:
+        t = time.perf_counter()
+        page, n = pv.query(**query)
+        ms = (time.perf_counter() - t) * 1000
+        print(f"  {label:<32} {ms:7.1f} ms  {n:>8} 行{'  ← 目標超え' if ms >= TARGET_MS else ''}")
+
+    page, n = pv.query(filters={"ファイル名": "00"}, sort_by="払出数", ascending=False, page=3, page_size=300)
+    df = pv.frame.astype({h: object for h in ("工程名", "LOT", "型番", "Lot No.", "有効期限", "ファイル名")})
+    expect = df[df["ファイル名"].str.contains("00", regex=False)].sort_values("払出数", ascending=False, kind="stable")
+    assert n == len(expect) and page.index.tolist() == (expect.index[600:900] + 1).tolist()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# bench_readers.py
+# ブックの読み込みエンジン（readers.py の openpyxl / calamine）の比較。既定（auto）をどうするかの根拠にする。
+# 明細の行数を変えた合成ファイル（synth.py）ごとに、両エンジンで
+#   - シート選択（先頭行のストリーム読み）＋取り込みシートの読込
+#   - 1ファイル分の抽出（extract_workbook）全体
+# を計り、calamine の方が遅いファイル（大きさ）があるかを出す。無ければ auto＝「入っていれば calamine」のままでよい。
+# あわせて、シート一覧・選択結果・全シートの DataFrame・先頭行の値・抽出結果が両エンジンで一致することを確かめる
+# （日付・シリアル値・文字列の有効期限、2段に分かれた結合ヘッダを含む）。
+# ------------------------------------------------------------
+# 実行: python bench/bench_readers.py [--rows 50 500 2000 10000 40000] [--repeat 3] [実ファイル.xlsx ...]
+# ------------------------------------------------------------
+import argparse, os, sys, time
+
+from openpyxl.cell.cell import ERROR_CODES
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from extractor import SCORE_ROW_CAP, WorkbookSession, choose_target_sheet_qty_first, extract_workbook  # noqa: E402
+from readers import available_engines  # noqa: E402
+from synth import make_workbook  # noqa: E402
+
+def best(fn, repeat: int) -> float:
+    out = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        out = min(out, time.perf_counter() - t)
+    return out
+
+def select_and_read(src, engine: str):
+    with WorkbookSession(src, engine) as book:
+        sheet, _ = choose_target_sheet_qty_first(book)
+        book.sheet(sheet)
+
+def head_values(book: WorkbookSession, sheet: str) -> list[tuple]:
+    """先頭行の値（エラーセルは空とみなし、行末の空セル・末尾の空行は詰める）"""
+    out = []
+    for r in book.iter_rows(sheet, SCORE_ROW_CAP):
+        values = [None if v in ERROR_CODES else v for v in r]
+        while values and values[-1] is None:
+            values.pop()
+        out.append(tuple(values))
+    while out and not out[-1]:
+        out.pop()
+    return out
+
+def extract(src, engine: str):
+    """抽出結果の比べる部分（失敗したらその例外の repr。run_extraction でも問題として記録されるだけなので）"""
+    try:
+        rec = extract_workbook(src, engine=engine)
+    except Exception as e:
+        return repr(e)
+    return {k: rec[k] for k in ("sheet", "reason", "header", "rows", "stats", "date_paths")}
+
+def check_same(label: str, src) -> None:
+    """両エンジンで読んだ値と抽出結果が同じか（違えば AssertionError）"""
+    with WorkbookSession(src, "openpyxl") as a, WorkbookSession(src, "calamine") as b:
+        assert a.sheet_names == b.sheet_names, label
+        assert choose_target_sheet_qty_first(a) == choose_target_sheet_qty_first(b), label
+        for s in a.sheet_names:
+            assert a.sheet(s).equals(b.sheet(s)), f"{label}: {s} の DataFrame"
+            # openpyxl はエラーセルを '#N/A' などで返し、結合範囲だけの末尾の行も空行で返す（calamine ではどちらも無し）
+            assert head_values(a, s) == head_values(b, s), f"{label}: {s} の先頭行"
+    assert extract(src, "openpyxl") == extract(src, "calamine"), f"{label}: 抽出結果"
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("inputs", nargs="*", help="あわせて計る実ファイル（.xlsx）")
+    ap.add_argument("--rows", type=int, nargs="+", default=[50, 500, 2000, 10000, 40000], help="合成ファイルの明細行数")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    if "calamine" not in available_engines():
+        sys.exit("python-calamine が入っていません（pip install python-calamine）")
+
+    cases = []
+    for n in args.rows:
+        cases.append((f"合成 {n} 行", make_workbook(rows=n, seed=n)))
+        cases.append((f"合成 {n} 行・2段ヘッダ", make_workbook(rows=n, merged_header=True, seed=n + 1)))
+    for p in args.inputs:
+        cases.append((os.path.basename(p), p))
+
+    print(f"{'ファイル':<24} {'サイズ':>9}   {'選択＋読込 openpyxl / calamine':>30}   {'抽出全体 openpyxl / calamine':>30}")
+    slower = []   # calamine の方が抽出全体で遅かったファイル
+    for label, src in cases:
+        check_same(label, src)
+        size = len(src) if isinstance(src, bytes) else os.path.getsize(src)
+        sel = [best(lambda: select_and_read(src, e), args.repeat) for e in ("openpyxl", "calamine")]
+        ext = [best(lambda: extract(src, e), args.repeat) for e in ("openpyxl", "calamine")]
+        if ext[1] >= ext[0]:
+            slower.append(f"{label}（{size/1024:.0f} KB）")
+        print(f"{label:<24} {size/1024:7.0f}KB   {sel[0]*1000:9.1f} / {sel[1]*1000:9.1f} ms（{sel[0]/sel[1]:4.1f} 倍）"
+              f"   {ext[0]*1000:9.1f} / {ext[1]*1000:9.1f} ms（{ext[0]/ext[1]:4.1f} 倍）")
+
+    print("両エンジンの値・抽出結果は一致")
+    if not slower:
+        print("すべてのファイルで calamine の方が速い（auto＝入っていれば calamine のままでよい）")
+    else:
+        print("calamine の方が遅かったファイル（auto を大きさで分けるか検討する）:\n- " + "\n- ".join(slower))
+
+if __name__ == "__main__":
+    main()
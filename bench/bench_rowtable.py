@@ -0,0 +1,69 @@
+# bench_rowtable.py
+# 抽出した明細の持ち方のベンチ。同じ明細を
+#   - 従来の list[dict]（1行1 dict、日本語キー7つ）
+#   - RowTable（列ごとの配列。文字列は値の一覧＋番号）
+# で持ったときのメモリ（tracemalloc）と、プレビュー用 DataFrame を作る時間を比べ、中身が一致することも確認する。
+# 明細は実際の抽出と同じく、ファイルごとに作った表を1つにまとめる（工程名・LOT・ファイル名はファイル内で同じ値）。
+# ------------------------------------------------------------
+# 実行: python bench/bench_rowtable.py [--rows 1000000] [--files 200]
+# ------------------------------------------------------------
+import argparse, os, sys, time, tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from rowtable import HEADERS, RowTable  # noqa: E402
+
+def make_file_records(i: int, n: int) -> list[dict]:
+    """parse_excel_table 相当の1ファイル分（毎回新しい文字列を作る＝実際の抽出と同じく値は共有されない）"""
+    return [{"工程名": f"工程{i % 7}", "LOT": f"LOT{i:04d}", "型番": f"M-{(i * 31 + k) % 900:04d}",
+             "Lot No.": f"L{(i * 997 + k) % 50000:05d}", "払出数": 1 + k % 20,
+             "有効期限": f"20{26 + k % 4}/{1 + k % 12}/{1 + k % 28}", "ファイル名": f"払出_{i:04d}"}
+            for k in range(n)]
+
+def measure(build):
+    tracemalloc.start()
+    t = time.perf_counter()
+    obj = build()
+    dt = time.perf_counter() - t
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, dt, size
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--files", type=int, default=200)
+    args = ap.parse_args()
+    per_file = max(1, args.rows // args.files)
+    n = per_file * args.files
+    print(f"{args.files} ファイル × {per_file} 行 = {n} 行")
+
+    def build_records():
+        rows = []
+        for i in range(args.files):
+            rows.extend(make_file_records(i, per_file))
+        return rows
+
+    def build_table():
+        t = RowTable()
+        for i in range(args.files):
+            t.extend(RowTable.from_records(make_file_records(i, per_file)))
+        return t
+
+    records, rec_s, rec_bytes = measure(build_records)
+    table, tab_s, tab_bytes = measure(build_table)
+    print(f"  {'list[dict]':<10} 作成 {rec_s:6.2f} s  保持 {rec_bytes/1e6:8.1f} MB（{rec_bytes/n:6.0f} バイト/行）")
+    print(f"  {'RowTable':<10} 作成 {tab_s:6.2f} s  保持 {tab_bytes/1e6:8.1f} MB（{tab_bytes/n:6.0f} バイト/行）"
+          f"  nbytes() {table.nbytes()/n:.0f} バイト/行")
+
+    t = time.perf_counter(); df_rec = pd.DataFrame(records, columns=HEADERS); rec_df_s = time.perf_counter() - t
+    t = time.perf_counter(); df_tab = table.to_frame(); tab_df_s = time.perf_counter() - t
+    print(f"  DataFrame 化  list[dict] {rec_df_s:6.2f} s（{df_rec.memory_usage(deep=True).sum()/1e6:.1f} MB）"
+          f" / RowTable {tab_df_s:6.2f} s（{df_tab.memory_usage(deep=True).sum()/1e6:.1f} MB）")
+
+    assert table == records
+    assert df_tab.astype(df_rec.dtypes.to_dict()).equals(df_rec)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# bench_suite.py
+# 抽出パイプラインの工程別ベンチ。synth.py の合成ファイルで、1ファイルずつ
+#   ブックを開く → シート選択 → シート読込 → 工程名/LOT → ヘッダ検出 → 明細抽出
+# を分けて計り、最後に台帳（新規作成・既存への追記）を計る。結果は JSON に保存し、前回の JSON と比べられる。
+# ------------------------------------------------------------
+# 実行: python bench/bench_suite.py [--scenario 標準 2段ヘッダ] [--files 10] [--rows 5000] [--repeat 3]
+#                                  [-o 今回.json] [--compare 前回.json]
+# ------------------------------------------------------------
+import argparse, datetime as dt, json, os, platform, sys, time
+
+import openpyxl
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+from extractor import (  # noqa: E402
+    WorkbookSession, choose_target_sheet_qty_first, detect_header, extract_koutei_lot_from_sheet,
+    finish_extraction, parse_excel_table,
+)
+from ledger import update_workbook_with_rows  # noqa: E402
+from rowtable import RowTable  # noqa: E402
+from synth import make_fileset  # noqa: E402
+
+# シナリオ名 → make_fileset への上書き
+SCENARIOS = {
+    "標準":     {},
+    "編集用あり": {"edit_sheet": True},
+    "2段ヘッダ":  {"merged_header": True},
+    "横長多シート": {"cols": 60, "sheets": 6},
+}
+STAGES = ["open", "select", "read", "koutei_lot", "header", "parse", "ledger_new", "ledger_append"]
+STAGE_LABELS = {
+    "open": "ブックを開く", "select": "シート選択", "read": "シート読込", "koutei_lot": "工程名/LOT",
+    "header": "ヘッダ検出", "parse": "明細抽出", "ledger_new": "台帳 新規作成", "ledger_append": "台帳 追記",
+}
+
+def run_once(fileset: list[tuple[str, bytes]]) -> tuple[dict, int]:
+    """全ファイルを工程ごとに計って (工程→合計秒, 抽出行数) を返す"""
+    t = {s: 0.0 for s in STAGES}
+    rows_all = RowTable()
+    def clock(stage, fn, *args, **kw):
+        t0 = time.perf_counter()
+        out = fn(*args, **kw)
+        t[stage] += time.perf_counter() - t0
+        return out
+    for name, xbytes in fileset:
+        book = clock("open", WorkbookSession, xbytes)
+        with book:
+            sheet, reason = clock("select", choose_target_sheet_qty_first, book)
+            df = clock("read", book.sheet, sheet)
+        koutei, lot = clock("koutei_lot", extract_koutei_lot_from_sheet, df)
+        hmap = clock("header", detect_header, df, scan_rows=60)
+        rec = {"sheet": sheet, "reason": reason, "header": hmap, "rows": RowTable(), "stats": {}, "saved_parses": 0}
+        if hmap:
+            rec["rows"], rec["stats"] = clock("parse", parse_excel_table, df, hmap, koutei or "", lot or "", "")
+        rows_all.extend(finish_extraction(name, rec)["rows"])
+    half = len(rows_all) // 2
+    ledger = clock("ledger_new", update_workbook_with_rows, None, rows_all.take(list(range(half))))
+    clock("ledger_append", update_workbook_with_rows, ledger, rows_all.take(list(range(half, len(rows_all)))))
+    return t, len(rows_all)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    ap.add_argument("--files", type=int, default=10)
+    ap.add_argument("--rows", type=int, default=5000, help="1ファイルの明細行数")
+    ap.add_argument("--cols", type=int, default=8)
+    ap.add_argument("--sheets", type=int, default=3)
+    ap.add_argument("--repeat", type=int, default=3, help="工程ごとに最小値を採る")
+    ap.add_argument("-o", "--output", help="結果を保存する JSON のパス")
+    ap.add_argument("--compare", help="比較する前回の JSON")
+    args = ap.parse_args()
+
+    result = {
+        "meta": {
+            "time": dt.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "pandas": pd.__version__, "openpyxl": openpyxl.__version__,
+            "platform": platform.platform(), "files": args.files, "rows": args.rows, "cols": args.cols,
+            "sheets": args.sheets, "repeat": args.repeat,
+        },
+        "scenarios": {},
+    }
+    prev = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            prev = json.load(f)
+
+    for name in args.scenario:
+        params = {"files": args.files, "rows": args.rows, "cols": args.cols, "sheets": args.sheets, **SCENARIOS[name]}
+        fileset = make_fileset(**params)
+        best = {s: float("inf") for s in STAGES}
+        for _ in range(args.repeat):
+            t, n_rows = run_once(fileset)
+            best = {s: min(best[s], t[s]) for s in STAGES}
+        result["scenarios"][name] = {"params": params, "rows_out": n_rows, "stages": best}
+
+        print(f"[{name}] {params['files']} ファイル × {params['rows']} 行 → {n_rows} 行")
+        before = (prev or {}).get("scenarios", {}).get(name, {}).get("stages", {})
+        for s in STAGES:
+            line = f"  {STAGE_LABELS[s]:<10} {best[s]:8.3f} s"
+            if s in before and before[s] > 0:
+                line += f"   前回 {before[s]:8.3f} s（{best[s]/before[s]:5.2f} 倍）"
+            print(line)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"→ {args.output}")
+
+if __name__ == "__main__":
+    main()
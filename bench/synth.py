@@ -0,0 +1,137 @@
+# synth.py
+# ベンチ用の合成Excel生成。実際の払出ファイルに近い構成を、行数・列数・シート数を指定して作る。
+#   - 複数シート（明細シート＋集計表・メモなどの“おとり”シート）。編集用シートの有無を選べる
+#   - 上部に工程名と「Lot: …」、その下にヘッダ（1段／2段に分かれたヘッダ）
+#   - 明細ブロック: 型番1回のみ＋Lot No.ぶら下がり／シリアルのみ（Lot No.空）／期限の後出し・不正値混在
+#   - 有効期限は日付型が中心で、文字列・シリアル値も混ぜる
+#   - ファイル名に「返庫」を含むファイルを一定割合で作る
+# ------------------------------------------------------------
+# 実行: python bench/synth.py -o 出力フォルダ [--files 20] [--rows 5000] [--cols 8] [--sheets 3] [--edit-sheet] [--merged-header]
+# import して make_workbook / make_fileset を使うこともできる（bench_suite.py）。
+# ------------------------------------------------------------
+import argparse, datetime as dt, io, os, random
+
+from openpyxl import Workbook
+
+DETAIL_HEADERS = ["型番", "Lot No.", "払出数", "有効期限"]
+NOISE_HEADERS = ["備考", "シリアル", "担当", "保管場所", "区分", "単位", "入庫日", "検査"]
+
+def _expiry(rnd: random.Random):
+    k = rnd.random()
+    if k < 0.75:
+        return dt.datetime(rnd.randint(2025, 2029), rnd.randint(1, 12), rnd.randint(1, 28))
+    if k < 0.9:
+        return f"{rnd.randint(2025, 2029)}{rnd.choice('/-.')}{rnd.randint(1, 12)}/{rnd.randint(1, 28)}"
+    if k < 0.95:
+        return 45000 + rnd.randint(0, 1500)   # 書式なしのシリアル値
+    return rnd.choice(["2027/13/1", "未定", None])
+
+def _detail_rows(rnd: random.Random, rows: int) -> list[list]:
+    """[型番, Lot No., 払出数, 有効期限, シリアル] の明細行を rows 行ぶん"""
+    out: list[list] = []
+    while len(out) < rows:
+        model = f"M-{rnd.randint(1, 400):04d}"
+        kind = rnd.random()
+        if kind < 0.25:    # シリアルのみ（Lot No.空）：型番行に数量、下にシリアルだけの行
+            out.append([model, None, rnd.randint(1, 5), _expiry(rnd), None])
+            out += [[None, None, None, None, f"SN{rnd.randint(0, 99999):05d}"] for _ in range(rnd.randint(1, 8))]
+        elif kind < 0.7:   # 型番1回のみ＋同じLot No.が下に複数行（数量1ずつ）
+            out.append([model, None, None, None, None])
+            lot, exp = f"LN{rnd.randint(1, 9999):04d}", _expiry(rnd)
+            out += [[None, lot, 1, exp, None] for _ in range(rnd.randint(1, 6))]
+        else:              # 期限の後出し・数量の表記ゆれ／不正値
+            out.append([model, f"LN{rnd.randint(1, 9999):04d}", rnd.choice([1, 2, "２", "3個", "1,000", 0, "x"]), None, None])
+            out.append([None, None, None, _expiry(rnd), None])
+        if rnd.random() < 0.03:
+            out.append([None] * 5)
+    return out[:rows]
+
+def _write_detail_sheet(ws, rnd: random.Random, rows: int, cols: int, merged_header: bool, koutei: str):
+    cols = max(cols, len(DETAIL_HEADERS) + 1)
+    ws.append([koutei])
+    ws.append([f"Lot: LOT-{rnd.randint(1000, 9999)}"])
+    ws.append([])
+    # 明細4列＋シリアル列を先頭寄りにランダム配置し、残りは雑多な列で埋める
+    pos = sorted(rnd.sample(range(cols), k=len(DETAIL_HEADERS) + 1))
+    names = DETAIL_HEADERS + ["シリアル"]
+    header = [NOISE_HEADERS[c % len(NOISE_HEADERS)] + str(c) for c in range(cols)]
+    if merged_header:   # 2段ヘッダ：型番だけ上段、残りは下段（上段は空）
+        upper, lower = list(header), [None] * cols
+        for name, c in zip(names, pos):
+            if name == "型番":
+                upper[c] = name
+            else:
+                upper[c] = None
+                lower[c] = name
+        ws.append(upper); ws.append(lower)
+    else:
+        for name, c in zip(names, pos):
+            header[c] = name
+        ws.append(header)
+    for values in _detail_rows(rnd, rows):
+        row = [None] * cols
+        for v, c in zip(values, pos):
+            row[c] = v
+        if rnd.random() < 0.3:
+            row[rnd.randrange(cols)] = rnd.choice(["確認済", "要確認", 3, None])
+        ws.append(row)
+
+def _write_decoy_sheet(ws, rnd: random.Random, rows: int):
+    """明細ヘッダを持たない集計表・メモ（シート選択で読まれるが選ばれない）"""
+    ws.append(["集計", None, "作成日", dt.datetime(2025, 9, 16)])
+    ws.append(["区分", "件数", "金額"])
+    for _ in range(rows):
+        ws.append([rnd.choice(["A", "B", "C"]), rnd.randint(0, 99), rnd.randint(100, 99999)])
+
+def make_workbook(rows: int = 2000, cols: int = 8, sheets: int = 3, edit_sheet: bool = False,
+                  merged_header: bool = False, seed: int = 0) -> bytes:
+    """
+    明細シート1枚＋おとりシート（sheets-1 枚）のブックを xlsx の bytes で返す。
+    edit_sheet=True なら明細シートの名前を『編集用』にする（シート選択で最優先される）。
+    """
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    detail_at = rnd.randrange(max(sheets, 1))
+    for s in range(max(sheets, 1)):
+        if s == detail_at:
+            ws = wb.create_sheet("編集用" if edit_sheet else f"払出{s+1}")
+            _write_detail_sheet(ws, rnd, rows, cols, merged_header, koutei=rnd.choice(["組立工程", "検査工程", "梱包工程"]))
+        else:
+            ws = wb.create_sheet(rnd.choice(["集計", "メモ", "一覧"]) + str(s + 1))
+            _write_decoy_sheet(ws, rnd, min(rows // 4, 500))
+    bio = io.BytesIO(); wb.save(bio); return bio.getvalue()
+
+def make_fileset(files: int = 10, rows: int = 2000, cols: int = 8, sheets: int = 3, edit_sheet: bool = False,
+                 merged_header: bool = False, henko_ratio: float = 0.2, seed: int = 0) -> list[tuple[str, bytes]]:
+    """[(ファイル名, bytes), ...]。henko_ratio の割合でファイル名に「返庫」を含める"""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(files):
+        henko = rnd.random() < henko_ratio
+        name = f"{'返庫' if henko else '払出'}_{i:03d}.xlsx"
+        out.append((name, make_workbook(rows, cols, sheets, edit_sheet, merged_header, seed=seed * 1000 + i)))
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="ベンチ用の合成Excelを書き出す")
+    ap.add_argument("-o", "--outdir", required=True)
+    ap.add_argument("--files", type=int, default=20)
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--cols", type=int, default=8)
+    ap.add_argument("--sheets", type=int, default=3)
+    ap.add_argument("--edit-sheet", action="store_true", help="明細シートを『編集用』にする")
+    ap.add_argument("--merged-header", action="store_true", help="ヘッダを上下2段に分ける")
+    ap.add_argument("--henko-ratio", type=float, default=0.2)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    fileset = make_fileset(args.files, args.rows, args.cols, args.sheets, args.edit_sheet,
+                           args.merged_header, args.henko_ratio, args.seed)
+    for name, xbytes in fileset:
+        with open(os.path.join(args.outdir, name), "wb") as f:
+            f.write(xbytes)
+    print(f"{len(fileset)} ファイルを {args.outdir} に書き出しました")
+
+if __name__ == "__main__":
+    main()
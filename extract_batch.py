@@ -0,0 +1,202 @@
+# extract_batch.py
+# UIなしのバッチ実行（夜間バッチ用）。Streamlit / requests は import しない。
+# 入力Excel（パス／グロブ）から明細を抽出し、台帳Excelの『編集用』へ追記して『品名ごと』『工程ごと』を最新化する。
+# ------------------------------------------------------------
+# 実行例:
+#   python extract_batch.py "D:/払出/2025-09-16/*.xlsx" --base 台帳.xlsx -o 台帳_更新.xlsx
+#   python extract_batch.py a.xlsx b.xlsx -o 新規台帳.xlsx --workers 8
+#   python extract_batch.py "D:/払出/2025-09" 月末分.zip -o 台帳_更新.xlsx   （フォルダ・zip はサブフォルダの .xlsx も取り込む）
+#   python extract_batch.py "in/*.xlsx" --store 台帳.db [-o 台帳.xlsx]      （台帳を SQLite に持ち、xlsx は書き出すだけ）
+# 台帳の取込履歴（内容ハッシュ）にあるファイルは解析せずに飛ばす（--reimport で無効）。
+# ------------------------------------------------------------
+import argparse, glob, os, sys, time
+
+from archive import extract_workbooks, folder_workbooks, is_zip_name
+from extractor import run_extraction, summarize_date_paths
+from import_history import (
+    drop_duplicate_rows, history_rows_for, ledger_row_keys, load_history, split_known,
+)
+from readers import DEFAULT_ENGINE, available_engines
+from rowtable import RowTable
+from spill import content_digest
+
+def expand_inputs(patterns: list[str]) -> list[str]:
+    """パス／グロブを展開（Windows のシェルは展開しないためここで行う）。重複は最初の1件だけ残す"""
+    paths: list[str] = []
+    for p in patterns:
+        hits = sorted(glob.glob(p)) if glob.has_magic(p) else [p]
+        for h in hits:
+            if h not in paths:
+                paths.append(h)
+    return paths
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Excel明細を抽出して台帳Excelへ追記する（UIなし）")
+    ap.add_argument("inputs", nargs="+", help="入力Excel・フォルダ・zip のパスまたはグロブ（例: in/*.xlsx）")
+    ap.add_argument("--base", help="追記先の既存台帳Excel（未指定なら新規作成）")
+    ap.add_argument("-o", "--output", help="出力する台帳Excelのパス（--store 指定時は省略可）")
+    ap.add_argument("--store", help="台帳の SQLite ファイル。ここへ追記し、-o があれば台帳Excelを書き出す"
+                                    "（空のストアに --base を渡すと、その台帳を先に取り込む）")
+    ap.add_argument("--no-require-lotno", action="store_true", help="Lot No.を必須にしない")
+    ap.add_argument("--no-require-exp", action="store_true", help="有効期限を必須にしない")
+    ap.add_argument("--workers", type=int, default=1, help="ワーカープロセス数（1=逐次）")
+    engines = ["auto"] + available_engines()
+    ap.add_argument("--reader", choices=engines, default=DEFAULT_ENGINE if DEFAULT_ENGINE in engines else "auto",
+                    help="Excelの読み込みエンジン（auto: python-calamine が入っていれば calamine。既定: EXTRACT_READER または auto）")
+    ap.add_argument("--cache-dir", help="抽出キャッシュのディレクトリ（指定時のみ使用）")
+    ap.add_argument("--memory-budget-mb", type=int, default=None,
+                    help="並列時に同時に処理するファイルの展開後サイズの合計上限（既定: EXTRACT_MEMORY_BUDGET_MB または 256）")
+    ap.add_argument("--reimport", action="store_true", help="取込履歴にある（取込済みの）ファイルも飛ばさずに取り込む")
+    ap.add_argument("--dedup-rows", action="store_true", help="編集用に既にある行・今回の中で重複した行（全列が同じ）を追記しない")
+    ap.add_argument("--full-report", action="store_true", help="『品名ごと』『工程ごと』を編集用の全件から作り直す（増分更新しない）")
+    ap.add_argument("--check-reports", action="store_true", help="出力後にレポートと編集用の全件集計を突き合わせる")
+    ap.add_argument("--metrics-log", help="ファイル別・工程別の計測を JSON ログで追記するパス（'-' は標準エラー）")
+    ap.add_argument("--profile", help="一番遅いファイルを cProfile＋tracemalloc で取り直し、.prof をこのパスに保存する")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    paths = expand_inputs(args.inputs)
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        print("入力ファイルが見つかりません:\n- " + "\n- ".join(missing), file=sys.stderr)
+        return 2
+    if not paths:
+        print("入力ファイルがありません。", file=sys.stderr)
+        return 2
+    if not args.output and not args.store:
+        print("-o か --store のどちらかを指定してください。", file=sys.stderr)
+        return 2
+    if args.base and args.output and os.path.abspath(args.base) == os.path.abspath(args.output):
+        print("--base と -o に同じファイルは指定できません。", file=sys.stderr)
+        return 2
+
+    # ファイルは読み込まずにパスで渡す（抽出・キャッシュのハッシュともファイルから直接読む）。
+    # フォルダ・zip の中身は、フォルダ／zip 内のサブパスをファイル名として扱う
+    files, spilled = [], []
+    for p in paths:
+        if os.path.isdir(p):
+            files += folder_workbooks(p)
+        elif is_zip_name(p):
+            entries, entry_spills, entry_problems = extract_workbooks(p)
+            files += entries; spilled += entry_spills
+            for msg in entry_problems:
+                print(f"{os.path.basename(p)}: {msg}", file=sys.stderr)
+        else:
+            files.append((os.path.basename(p), p))
+    if not files:
+        print("取り込む .xlsx がありません。", file=sys.stderr)
+        return 2
+
+    # 取込履歴（ストアに行があればストア、無ければ --base）と内容が同じファイルは解析せずに飛ばす
+    store = None
+    if args.store:
+        from ledger_store import LedgerStore
+        store = LedgerStore(args.store)
+    use_store_history = store is not None and store.count() > 0
+    history = store.history() if use_store_history else load_history(args.base)
+    skipped = []
+    if args.reimport:
+        digests = [content_digest(src) for _, src in files]
+    else:
+        files, digests, skipped, notes = split_known(files, history)
+        if skipped:
+            print(f"取込済みのため {len(skipped)} 件を飛ばしました:\n- " + "\n- ".join(skipped), file=sys.stderr)
+        for msg in notes:
+            print(msg, file=sys.stderr)
+
+    cache = None
+    if args.cache_dir:
+        from extract_cache import ExtractionCache
+        cache = ExtractionCache(disk_dir=args.cache_dir)
+
+    from spill import MEMORY_BUDGET
+    budget = args.memory_budget_mb * 1024**2 if args.memory_budget_mb else MEMORY_BUDGET
+    def on_progress(done: int, total: int, name: str):
+        print(f"\r抽出中 {done} / {total}", end="\n" if done == total else "", file=sys.stderr, flush=True)
+
+    t_extract = time.perf_counter()
+    results = run_extraction(
+        files,
+        require_lotno=not args.no_require_lotno,
+        require_exp=not args.no_require_exp,
+        workers=args.workers,
+        cache=cache,
+        memory_budget=budget,
+        progress=on_progress if sys.stderr.isatty() else None,
+        engine=args.reader,
+        digests=digests,
+    )
+    extract_s = time.perf_counter() - t_extract
+    rows_all, problems = RowTable(), []
+    for res in results:
+        rows_all.extend(res["rows"])
+        problems.extend(res["problems"])
+        for msg in res["infos"]:
+            print(msg, file=sys.stderr)
+    if problems:
+        print("一部で問題:\n- " + "\n- ".join(problems), file=sys.stderr)
+    dropped = 0
+    if args.dedup_rows and rows_all:
+        keys = store.row_keys() if use_store_history else ledger_row_keys(args.base)
+        rows_all, dropped = drop_duplicate_rows(rows_all, keys)
+        if dropped:
+            print(f"編集用に既にある行・今回の中で重複した行 {dropped} 行を追記しません。", file=sys.stderr)
+    date_paths = summarize_date_paths(results)
+    if date_paths:
+        print(f"有効期限セルの変換経路: {date_paths}", file=sys.stderr)
+    if rows_all:
+        print(f"明細の保持メモリ: {rows_all.nbytes() / 1024**2:.1f} MB（{rows_all.nbytes() / len(rows_all):.0f} バイト/行）",
+              file=sys.stderr)
+
+    # 台帳の読み書きは openpyxl を使うので、抽出が終わってから読み込む
+    from ledger import update_workbook_with_rows, check_report_consistency
+    t_ledger = time.perf_counter()
+    # 明細を取り込めたファイルだけを取込履歴に記録する
+    history_rows = history_rows_for(results, digests, history)
+    if store is not None:
+        with store:
+            if args.base:
+                if store.count() == 0:
+                    print(f"台帳ストアへ取り込み: {args.base}（{store.import_workbook(args.base)} 行）", file=sys.stderr)
+                else:
+                    print("台帳ストアが空ではないため --base は使いません。", file=sys.stderr)
+            store.append(rows_all, history_rows)
+            if args.full_report:
+                store.rebuild_sums()
+            if args.output:
+                store.export_xlsx(args.output)
+    else:
+        # 追記先はパスのまま読み、結果も -o へ直接書き出す（台帳全体を bytes で持たない）
+        update_workbook_with_rows(args.base, rows_all, sheet_name="編集用",
+                                  report_mode="full" if args.full_report else "auto", dest=args.output,
+                                  history_rows=history_rows)
+    ledger_s = time.perf_counter() - t_ledger
+
+    if args.metrics_log or args.profile:
+        import instrument
+        instrument.configure_json_log(args.metrics_log)
+        instrument.log_run(results, workers=args.workers, reader=args.reader, extract_s=round(extract_s, 6), ledger_s=round(ledger_s, 6))
+        if args.profile:
+            prof = instrument.profile_slowest(files, results, not args.no_require_lotno, not args.no_require_exp)
+            if prof is None:
+                print("プロファイル: 計測できるファイルがありません（すべてキャッシュヒット）", file=sys.stderr)
+            else:
+                with open(args.profile, "wb") as f:
+                    f.write(prof["prof"])
+                print(f"プロファイル: {prof['name']}（{prof['seconds']:.2f} 秒 / メモリ最大 "
+                      f"{prof['peak_bytes']/1024**2:.1f} MB）→ {args.profile}", file=sys.stderr)
+                print(prof["pstats"], file=sys.stderr)
+                print(prof["memory_top"], file=sys.stderr)
+    if args.check_reports and args.output:
+        from openpyxl import load_workbook
+        diffs = check_report_consistency(load_workbook(args.output, read_only=True))
+        if diffs:
+            print("レポート不一致:\n- " + "\n- ".join(diffs), file=sys.stderr)
+            return 3
+        print("レポート整合性: OK")
+
+    print(f"{len(files)} ファイル / 合計 {len(rows_all)} 行を抽出 → {args.output or args.store}（{time.perf_counter()-t0:.2f} 秒）")
+    return 0 if rows_all or skipped or dropped else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# extract_cache.py
+# 抽出結果キャッシュ（実行・セッションをまたいで再利用）。
+# キー = (ファイル内容の SHA-256, Lot No.必須, 有効期限必須, 抽出器バージョン)
+# 値   = extractor.extract_workbook の戻り値（選択シート・理由・ヘッダ位置・明細・拒否内訳）
+#   - メモリ: 件数上限つき LRU
+#   - ディスク（任意）: 1件1ファイルの pickle。合計サイズが上限を超えたら最終利用が古い順に削除
+# ------------------------------------------------------------
+import os, pickle, tempfile, threading
+from collections import OrderedDict
+from typing import Optional
+
+from extractor import EXTRACTOR_VERSION
+from spill import Source, content_digest
+
+class ExtractionCache:
+    def __init__(self, max_items: int = 128, disk_dir: Optional[str] = None, disk_max_bytes: int = 512 * 1024**2):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()   # Streamlit の各セッション（スレッド）から共有される
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(src: Source, require_lotno: bool, require_exp: bool, digest: Optional[str] = None) -> str:
+        """digest（spill.content_digest の値）が分かっていれば渡す（同じファイルを2回ハッシュしない）"""
+        if digest is None:
+            digest = content_digest(src)   # パスなら mmap で読む
+        return f"{digest}-{int(bool(require_lotno))}{int(bool(require_exp))}-v{EXTRACTOR_VERSION}"
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            rec = self._mem.get(key)
+            if rec is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return rec
+        rec = self._disk_get(key)
+        with self._lock:
+            if rec is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._mem_put(key, rec)
+        return rec
+
+    def put(self, key: str, rec: dict):
+        with self._lock:
+            self._mem_put(key, rec)
+        self._disk_put(key, rec)
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            self.hits = self.misses = 0
+        if self.disk_dir:
+            for path, _, _ in self._disk_entries():
+                _remove_quietly(path)
+
+    # ---- メモリ層 ----
+    def _mem_put(self, key: str, rec: dict):
+        self._mem[key] = rec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    # ---- ディスク層 ----
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".pkl")
+
+    def _disk_get(self, key: str) -> Optional[dict]:
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                rec = pickle.load(f)
+            os.utime(path)   # 最終利用時刻を更新（削除順に使う）
+            return rec
+        except FileNotFoundError:
+            return None
+        except Exception:
+            _remove_quietly(path)   # 壊れたエントリは捨てて再抽出させる
+            return None
+
+    def _disk_put(self, key: str, rec: dict):
+        if not self.disk_dir:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(rec, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            _remove_quietly(tmp)
+            return
+        self._evict_disk()
+
+    def _disk_entries(self) -> list[tuple[str, float, int]]:
+        out = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                stt = os.stat(path)
+            except FileNotFoundError:
+                continue
+            out.append((path, stt.st_mtime, stt.st_size))
+        return out
+
+    def _evict_disk(self):
+        entries = self._disk_entries()
+        total = sum(size for _, _, size in entries)
+        for path, _, size in sorted(entries, key=lambda e: e[1]):
+            if total <= self.disk_max_bytes:
+                break
+            _remove_quietly(path)
+            total -= size
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
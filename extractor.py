@@ -0,0 +1,842 @@
+# extractor.py
+# Excel明細抽出のコア（シート選択・ヘッダ検出・キャリー＋集約）。
+# Streamlit / requests に依存しないので、UI（app.py）以外からも import できる。
+# プロセス並列（ProcessPoolExecutor）のワーカーもこのモジュールの関数を直接呼ぶ。
+# ------------------------------------------------------------
+import re
+from typing import List, Tuple, Optional, Dict, Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from normalizers import (  # normalize_date / _to_int_qty / _n は従来どおり extractor からも import できる
+    normalize_date, normalize_date_cell, to_int_qty as _to_int_qty, clean_cell as _n,
+    str_or_none_array, normalize_date_cells, to_int_qty_series, DATE_PATHS,
+)
+from instrument import StageTimer
+from rowtable import HEADERS, RowTable   # HEADERS は従来どおり extractor からも import できる
+from readers import open_reader
+from spill import Source, estimate_unpacked_size
+
+# ===================== ユーティリティ =====================
+# NEW: ファイル名から「返庫」判定（Excelにのみ適用）
+def is_henko_from_name(filename_wo_ext: str) -> bool:
+    return "返庫" in (filename_wo_ext or "")
+
+# ===================== Excelヘッダ検出（2段対応） =====================
+HEADER_KEYS = {
+    "model": ["型番","品目","品番","型 式"],
+    "lotno": ["Lot No","LotNo","LOT NO","ロット","Lot"],
+    # qty は「払出数系 ＞ 数量系」で優先
+    "qty_hi": ["払出数","払い出し","払出","出庫","出数"],
+    "qty_lo": ["数量","個数","数"],
+    "exp":   ["有効期限","期限","賞味期限","Exp","有効期日"],
+}
+
+# --- 一括照合エンジン ---
+# 全キーワード（小文字・重複除去）に1ビットずつ割り当て、セルごとに「含むキーワード」のビットマスクを持つ。
+# 走査範囲を1回だけ正規化してマスク行列にし、1段・2段マージの両判定をその行列から行う。
+_HEADER_KW: list[str] = list(dict.fromkeys(kw.lower() for keys in HEADER_KEYS.values() for kw in keys))
+_HEADER_KW_BITS = np.array([1 << i for i in range(len(_HEADER_KW))], dtype=np.int64)
+# どれか1つでも含むかの事前判定（大半のセルはここで落ちる）
+_HEADER_KW_RE = re.compile("|".join(re.escape(kw) for kw in _HEADER_KW))
+# 列種別ごとの探索順（キーワード番号）。qty は「払出数系 ＞ 数量系」の順に並べて優先順位を表現
+_HEADER_GROUPS: dict[str, list[int]] = {
+    g: list(dict.fromkeys(_HEADER_KW.index(kw.lower()) for kw in keys))
+    for g, keys in {
+        "lotno": HEADER_KEYS["lotno"],
+        "exp":   HEADER_KEYS["exp"],
+        "model": HEADER_KEYS["model"],
+        "qty":   HEADER_KEYS["qty_hi"] + HEADER_KEYS["qty_lo"],
+    }.items()
+}
+_cell_mask_memo: Dict[str, int] = {}
+
+def _cell_mask(txt: str) -> int:
+    """小文字化済みセル文字列 → 含まれるキーワードのビットマスク"""
+    m = _cell_mask_memo.get(txt)
+    if m is None:
+        m = 0
+        if _HEADER_KW_RE.search(txt):
+            for i, kw in enumerate(_HEADER_KW):
+                if kw in txt: m |= 1 << i
+        if len(_cell_mask_memo) < 100_000:
+            _cell_mask_memo[txt] = m
+    return m
+
+def _mask_row(values) -> tuple[np.ndarray, np.ndarray]:
+    """1行分の値を _n 正規化して (キーワードマスク, 非空フラグ) にする"""
+    n = len(values)
+    masks = np.zeros(n, dtype=np.int64)
+    filled = np.zeros(n, dtype=bool)
+    for c, v in enumerate(values):
+        if v is None or (type(v) is float and v != v):
+            continue
+        txt = _n(v)
+        if not txt: continue
+        filled[c] = True
+        masks[c] = _cell_mask(txt.lower())
+    return masks, filled
+
+def _stack_mask_rows(rows: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray]:
+    """_mask_row の結果を右側ゼロ埋めで行列にまとめる"""
+    width = max((len(m) for m, _ in rows), default=0)
+    masks = np.zeros((len(rows), width), dtype=np.int64)
+    filled = np.zeros((len(rows), width), dtype=bool)
+    for r, (m, f) in enumerate(rows):
+        masks[r, :len(m)] = m
+        filled[r, :len(f)] = f
+    return masks, filled
+
+def _header_hit_from_masks(mrow: np.ndarray) -> dict:
+    """マスク1行（または2段マージ行）がヘッダなら {列種別: 列番号}、違えば {}"""
+    hits = (mrow[:, None] & _HEADER_KW_BITS[None, :]) != 0   # (列, キーワード)
+    has = hits.any(axis=0)
+    first_col = hits.argmax(axis=0)
+    hit = {}
+    for g, kws in _HEADER_GROUPS.items():
+        for k in kws:
+            if has[k]:
+                hit[g] = int(first_col[k]); break
+    if sum(1 for k in ["lotno","qty","exp"] if k in hit) >= 2 and "model" in hit:
+        return hit
+    return {}
+
+def _merged_header_hit(masks: np.ndarray, filled: np.ndarray) -> dict|None:
+    """2段（上下マージ：上のセルが空なら下のセルを採用）ヘッダの判定"""
+    if len(masks) < 2: return None
+    combo = np.where(filled[:-1], masks[:-1], masks[1:])
+    for r in np.flatnonzero(combo.any(axis=1)):
+        hit = _header_hit_from_masks(combo[r])
+        if hit: return {"row": int(r), **hit}
+    return None
+
+_HEADER_ROWWISE_ROWS = 8  # 先頭からこの行数までは1行ずつ取り出す（ヘッダが上部にある大多数のシートで一括変換を省く）
+
+def detect_header(df: pd.DataFrame, scan_rows: int = 60) -> dict|None:
+    scan_rows = min(len(df), scan_rows)
+    head = min(scan_rows, _HEADER_ROWWISE_ROWS)
+    rows = []
+    # 1段（正規化しながら判定し、見つかればそれ以降は正規化しない）
+    for r in range(scan_rows):
+        if r < head:
+            values = df.iloc[r,:].to_numpy(dtype=object)
+        else:
+            if r == head:
+                rest = df.iloc[head:scan_rows].to_numpy(dtype=object)
+            values = rest[r-head]
+        rows.append(_mask_row(values))
+        m = rows[-1][0]
+        if m.any():
+            hit = _header_hit_from_masks(m)
+            if hit: return {"row": r, **hit}
+    # 2段（上下マージ）は正規化済みの行列をそのまま使う
+    return _merged_header_hit(*_stack_mask_rows(rows))
+
+def detect_header_reference(df: pd.DataFrame, scan_rows: int = 60) -> dict|None:
+    """旧実装（行ごと・キーワード群ごとの走査）。detect_header との一致確認／ベンチマーク用"""
+    def choose_col_by_priority(cells: list[str], high: list[str], low: list[str]) -> Optional[int]:
+        lows = [c.lower() for c in cells]
+        for kw in high:
+            kwl = kw.lower()
+            for c, txt in enumerate(lows):
+                if kwl in txt: return c
+        for kw in low:
+            kwl = kw.lower()
+            for c, txt in enumerate(lows):
+                if kwl in txt: return c
+        return None
+
+    def first_hit(cells: list[str], keys: list[str]) -> Optional[int]:
+        lows = [c.lower() for c in cells]
+        for kw in keys:
+            kwl = kw.lower()
+            for c, txt in enumerate(lows):
+                if kwl in txt: return c
+        return None
+
+    def hit_from_row(cells: list[str]) -> dict:
+        hit={}
+        lot_c = first_hit(cells, HEADER_KEYS["lotno"])
+        if lot_c is not None: hit["lotno"] = lot_c
+        exp_c = first_hit(cells, HEADER_KEYS["exp"])
+        if exp_c is not None: hit["exp"] = exp_c
+        model_c = first_hit(cells, HEADER_KEYS["model"])
+        if model_c is not None: hit["model"] = model_c
+        qty_c = choose_col_by_priority(cells, HEADER_KEYS["qty_hi"], HEADER_KEYS["qty_lo"])
+        if qty_c is not None: hit["qty"] = qty_c
+        if sum(1 for k in ["lotno","qty","exp"] if k in hit) >= 2 and "model" in hit:
+            return hit
+        return {}
+
+    scan_rows = min(len(df), scan_rows)
+    # 1段
+    for r in range(scan_rows):
+        row = [_n(x) for x in df.iloc[r,:].tolist()]
+        if not any(row): continue
+        hit = hit_from_row(row)
+        if hit: return {"row": r, **hit}
+    # 2段（上下マージ）
+    for r in range(scan_rows-1):
+        row1 = [_n(x) for x in df.iloc[r,:].tolist()]
+        row2 = [_n(x) for x in df.iloc[r+1,:].tolist()]
+        width = max(len(row1), len(row2))
+        combo=[]
+        for c in range(width):
+            a = row1[c] if c < len(row1) else ""
+            b = row2[c] if c < len(row2) else ""
+            combo.append((a or b) if (a or b) else "")
+        if not any(combo): continue
+        hit = hit_from_row(combo)
+        if hit: return {"row": r, **hit}
+    return None
+
+def extract_koutei_lot_from_sheet(df: pd.DataFrame, max_scan_rows:int=8, max_scan_cols:int=8) -> Tuple[Optional[str], Optional[str]]:
+    koutei=None; lot=None
+    rows=min(len(df),max_scan_rows); cols=min(df.shape[1],max_scan_cols)
+    # 工程名（上部の最初の非空セル）
+    for r in range(rows):
+        for c in range(cols):
+            v=_n(df.iat[r,c])
+            if v and not re.search(r"\b(lot|ロット)\b", v, flags=re.I):
+                koutei=v; break
+        if koutei: break
+    # LOT（Lot: / Lot. / ロット: を許可）
+    lot_pat = re.compile(r"(?:\bLot\b\.?|ロット)\s*[：:\.\s]\s*([^\s]+)", re.I)
+    for r in range(rows):
+        for c in range(cols):
+            s=_n(df.iat[r,c])
+            if not s: continue
+            m=lot_pat.search(s)
+            if m: lot=m.group(1).strip(); break
+        if lot: break
+    return koutei, lot
+
+# ===================== ブック読込セッション（1アップロード=1回だけ開く） =====================
+class WorkbookSession:
+    """
+    アップロード1件分のExcelを1回だけ開き、各シートは初回要求時に1回だけ読み込む。
+    シート選択・工程名/LOT抽出・ヘッダ検出・明細抽出で同じ DataFrame を共有する。
+      - engine       : 読み込みに使っているエンジン（readers.ENGINES のどれか）
+      - parses       : 実際に pd.ExcelFile.parse を行った回数
+      - saved_parses : 省略できた読込回数（キャッシュ返却＋シート評価のストリーム読み。
+                       旧実装ではどちらも pd.read_excel でブックを開き直していた）
+      - cells_streamed : シート評価のストリーム読みで流したセル数（計測用）
+    """
+    def __init__(self, src: Source, engine: Optional[str]=None):
+        # engine は readers.resolve_engine のとおり（None は既定＝EXTRACT_READER。auto は calamine が入っていれば calamine）
+        self._reader = open_reader(src, engine)
+        self.engine: str = self._reader.engine
+        self.sheet_names: list[str] = self._reader.sheet_names
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self.parses = 0
+        self.saved_parses = 0
+        self.cells_streamed = 0
+
+    def sheet(self, name: str) -> pd.DataFrame:
+        df = self._frames.get(name)
+        if df is not None:
+            self.saved_parses += 1
+            return df
+        df = self._reader.parse(name)
+        self._frames[name] = df
+        self.parses += 1
+        return df
+
+    def iter_rows(self, name: str, max_row: int):
+        """先頭 max_row 行を値タプルとして流す（DataFrame化しない。値の形はどのエンジンでも openpyxl の values_only と同じ）"""
+        self.saved_parses += 1
+        for values in self._reader.iter_rows(name, max_row):
+            self.cells_streamed += len(values)
+            yield values
+
+    def close(self):
+        self._frames.clear()
+        self._reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ===================== シート選択（編集用 → 数量多い順 → 先頭） =====================
+SCORE_ROW_CAP = 200   # シート評価で読む行数の上限
+SCORE_SCAN_ROWS = 60  # その中でヘッダを探す行数
+
+def score_sheet_rows(rows, scan_rows: int = SCORE_SCAN_ROWS) -> int:
+    """
+    行ストリーム（値タプル）を1回だけ流し、ヘッダ検出と「払出数≠0」セルのカウントを同時に行う。
+    - ヘッダ確定前の行だけを保持し（高々 scan_rows 行）、確定後は届いた行をその場で数えて捨てる
+    - 判定順は detect_header と同じ（1段を scan_rows 行すべて試してから2段マージ）
+    ヘッダが見つからなければ -1（評価不可）。
+    """
+    pending: list[tuple] = []      # ヘッダ確定前の生の行
+    window: list[tuple[np.ndarray, np.ndarray]] = []  # 同・走査範囲の正規化済みマスク（2段マージ判定用）
+    qc: Optional[int] = None
+    qty_count = 0
+
+    def count(values, qc: int) -> int:
+        v = values[qc] if qc < len(values) else None
+        vi = _to_int_qty(v)
+        # 0 もカウントしたい場合は `vi is not None` に変更
+        return 1 if (vi is not None and vi != 0) else 0
+
+    def merged_then_count() -> Optional[tuple[int, int]]:
+        hit = _merged_header_hit(*_stack_mask_rows(window))
+        if not hit: return None
+        return hit["qty"], sum(count(v, hit["qty"]) for v in pending[hit["row"]+1:])
+
+    for r, values in enumerate(rows):
+        if qc is not None:
+            qty_count += count(values, qc)
+            continue
+        pending.append(values)
+        if r < scan_rows:
+            window.append(_mask_row(values))
+            m = window[-1][0]
+            hit = _header_hit_from_masks(m) if m.any() else {}
+            if hit:
+                qc = hit["qty"]; pending = []
+            continue
+        # 1段ヘッダが走査範囲に無かった → 2段マージを試し、見つかれば保持分を数えて続行
+        found = merged_then_count()
+        if not found: return -1
+        qc, qty_count = found
+        pending = []
+    if qc is not None:
+        return qty_count
+    # 走査範囲に満たない短いシート
+    found = merged_then_count()
+    return found[1] if found else -1
+
+def choose_target_sheet_qty_first(book: "WorkbookSession|Source", engine: Optional[str]=None) -> tuple[str, str]:
+    """
+    優先順:
+      1) '編集用'
+      2) 払出数（数量）に数字が入っている行数が多いシート
+      3) 先頭シート
+    ※ 日付優先／除外パターンは使いません
+    ※ WorkbookSession を渡すと、評価で読んだシートをその後の抽出でも再利用する
+      （bytes／パスを渡したときは engine のエンジンで開く）
+    """
+    if not isinstance(book, WorkbookSession):
+        with WorkbookSession(book, engine) as tmp:
+            return choose_target_sheet_qty_first(tmp)
+    sheet_names = book.sheet_names
+
+    # 1) 編集用
+    if "編集用" in sheet_names:
+        return "編集用", "編集用が最優先"
+
+    # 2) 数量が入っている件数をカウント（先頭 SCORE_ROW_CAP 行をストリーム読みし、ヘッダ検出しながら数える）
+    candidates = []  # (sheet, qty_count)
+    for s in sheet_names:
+        try:
+            candidates.append((s, score_sheet_rows(book.iter_rows(s, max_row=SCORE_ROW_CAP))))
+        except Exception:
+            candidates.append((s, -1))
+
+    # 件数が評価できたものの中から最大を選ぶ
+    valid = [c for c in candidates if c[1] >= 0]
+    if valid:
+        valid.sort(key=lambda x: x[1], reverse=True)  # 件数降順のみで決定
+        top_sheet, top_cnt = valid[0]
+        if top_cnt > 0:
+            return top_sheet, f"数量セルのあるシート優先（件数={top_cnt}）"
+
+    # 3) 先頭
+    return sheet_names[0], "フォールバック（先頭）"
+
+# ===================== Excel明細抽出（キャリー＋集約＋特例＋境界リセット） =====================
+def _build_block_index(models: list, lotnos: list, exp_norms: list) -> tuple[list[int], list[tuple]]:
+    """
+    型番ブロックの索引を1回の後方走査で作る（ブロック内の先読みを O(1) にするため）。
+    ブロック = 型番セルのある行 〜 次の型番行の手前（最初の型番行より前の行もひとまとまりとして扱う）。
+    返り値: (行 → ブロック番号, ブロック番号 → (開始行, 終了行(含まない), Lot No.の有無, 最初の有効な期限))
+    ※ ブロック番号は後方走査で閉じた順（シート下側が小さい番号）
+    """
+    n = len(models)
+    row_block = [0] * n
+    blocks: list[tuple] = []
+    end = n; has_lot = False; first_exp = None
+    for i in range(n-1, -1, -1):
+        row_block[i] = len(blocks)   # いま開いているブロックが閉じたときの番号
+        if lotnos[i]: has_lot = True
+        if exp_norms[i]: first_exp = exp_norms[i]
+        if models[i] or i == 0:
+            blocks.append((i, end, has_lot, first_exp))
+            end = i; has_lot = False; first_exp = None
+    return row_block, blocks
+
+def parse_excel_table(
+    df: pd.DataFrame,
+    header_map: dict,
+    koutei: str,
+    lot: str,
+    file_label: str,
+    qty_sign:int=1,
+    require_lotno: bool=True,
+    require_exp: bool=True,
+    diag: Optional[dict]=None,
+) -> tuple[RowTable, dict]:
+    """
+    - 「型番セルが1回のみ」「同一Lot No.が下に複数行（数量だけ1ずつ等）」をサポート。
+    - 行走査時に last_model / last_lotno / last_exp_norm をキャリー。
+    - (model, lotno, exp_norm) 単位で数量を集約（qty_sign適用後）→ 出力。
+    - 特例: 「シリアルだけが下にぶら下がり、Lot No.欄が全体で空」のブロックは、
+            Lot No.空のまま（許容）で型番行の払出数を1行にまとめて出力。
+            （UIでLot No.必須=ONでもブロック内にLot No.が1つも無ければ許容）
+    - 重要: 新しい“型番”を検知した時点で、last_lotno / last_exp_norm を必ず None にリセットし、
+            前ブロックのLot/期限が誤ってキャリーされるのを防止。
+    - diag に dict を渡すと、有効期限セルの変換経路ごとの件数を diag["有効期限"] に入れる（日付型／シリアル値／文字列）。
+    - 明細は RowTable（列ごとの配列）で返す（to_records() が parse_excel_table_reference の list[dict] と同じになる）。
+    """
+    # 列単位エンジン：行ごとの状態遷移を以下の列演算に置き換える（結果は parse_excel_table_reference と同一）
+    #   ブロックID = 型番セルが入っている行の累積和（0 = 最初の型番より前）
+    #   型番       = 前方埋め（ブロック先頭の型番）
+    #   Lot/期限   = ブロック内で前方埋め（境界でリセット）
+    #   期限の先読み = ブロック内で後方埋め（require_exp 時、前方埋めで決まらない行のみ）
+    #   シリアル特例 = ブロック内に Lot No. が1つも無ければ Lot 空を許容
+    start=header_map["row"]+1
+    mc,lc,qc,ec = header_map["model"],header_map["lotno"],header_map["qty"],header_map["exp"]
+    sub=df.iloc[start:]
+    n=len(sub)
+
+    stats = {"空行":0, "型番欠落":0, "LotNo欠落":0, "数量不正":0, "数量=0":0, "日付不正":0}
+    if n == 0:
+        if diag is not None:
+            diag["有効期限"] = {}
+        return RowTable(), stats
+
+    def _col(idx) -> np.ndarray:
+        if idx < sub.shape[1]:
+            return sub.iloc[:, idx].to_numpy(dtype=object)
+        return np.full(n, None, dtype=object)
+
+    # セル値の変換はユニーク値ごとに1回（normalizers の列版）
+    model = pd.Series(str_or_none_array(_col(mc)), dtype=object)
+    lotno = pd.Series(str_or_none_array(_col(lc)), dtype=object)
+    qty   = to_int_qty_series(_col(qc))
+    exp_raw = _col(ec)
+    exp_s = pd.Series(str_or_none_array(exp_raw), dtype=object)
+    # 期限は型のまま変換（日付型・シリアル値は文字列を経由しない）
+    date_paths: dict = {}
+    exp_norm = pd.Series(normalize_date_cells(exp_raw, date_paths), dtype=object)
+    if diag is not None:
+        diag["有効期限"] = date_paths
+
+    has_model, has_lot, has_qty, has_exp = model.notna(), lotno.notna(), qty.notna(), exp_s.notna()
+
+    # 完全空行
+    empty = ~(has_model | has_lot | has_qty | has_exp)
+    stats["空行"] = int(empty.sum())
+    live = ~empty
+
+    # ★ ブロック境界：model がある行で新ブロック開始（前ブロックのLot/期限は引き継がない）
+    block = has_model.cumsum()
+    cur_model = model.ffill()
+    cur_lotno = lotno.groupby(block).ffill()
+    cur_exp   = exp_norm.groupby(block).ffill()
+
+    no_model = live & (block == 0)
+    stats["型番欠落"] = int(no_model.sum())
+
+    # 数量チェック（数量なしの行＝期限だけ／シリアル行はキャリー済みなのでエラーにしない）
+    take = live & (block > 0) & has_qty
+    zero = take & (qty == 0).fillna(False)
+    stats["数量=0"] = int(zero.sum())
+    take &= ~zero
+
+    # 期限がこの時点で未確定なら、同ブロック内から先読み
+    if require_exp:
+        cur_exp = cur_exp.fillna(exp_norm.groupby(block).bfill())
+        bad = take & cur_exp.isna()
+        stats["日付不正"] = int(bad.sum())
+        take &= ~bad
+
+    # Lot No.必須だが、ブロック内にLotNoが1つも無い=シリアルだけの特例は許容
+    if require_lotno:
+        block_has_lot = has_lot.groupby(block).transform("any")
+        bad = take & cur_lotno.isna() & block_has_lot
+        stats["LotNo欠落"] = int(bad.sum())
+        take &= ~bad
+
+    picked = pd.DataFrame({
+        "model": cur_model[take],
+        "lotno": cur_lotno[take].fillna(""),
+        "exp":   cur_exp[take].fillna(""),
+        "qty":   qty[take].abs() * qty_sign,
+    })
+    agg = picked.groupby(["model","lotno","exp"], sort=False)["qty"].sum()
+
+    # 工程名・LOT・ファイル名はシート内で同じ値なので、値を1回だけ持つ
+    out = RowTable.from_columns({
+        "工程名": koutei or "",
+        "LOT": lot or "",
+        "型番": agg.index.get_level_values(0).tolist(),
+        "Lot No.": agg.index.get_level_values(1).tolist(),
+        "払出数": [int(q) for q in agg.tolist()],
+        "有効期限": [e or "" for e in agg.index.get_level_values(2).tolist()],
+        "ファイル名": file_label,
+    }, len(agg))
+
+    return out, stats
+
+def parse_excel_table_reference(
+    df: pd.DataFrame,
+    header_map: dict,
+    koutei: str,
+    lot: str,
+    file_label: str,
+    qty_sign:int=1,
+    require_lotno: bool=True,
+    require_exp: bool=True,
+    diag: Optional[dict]=None,
+) -> tuple[List[Dict[str,Any]], dict]:
+    """
+    旧実装（1行ずつ sub.iloc[i,:] を走査してキャリー＋集約）。
+    parse_excel_table（列単位エンジン）と出力・stats・diag が一致することの確認用に残している。
+    """
+    start=header_map["row"]+1
+    mc,lc,qc,ec = header_map["model"],header_map["lotno"],header_map["qty"],header_map["exp"]
+    sub=df.iloc[start:].copy().reset_index(drop=True)
+
+    stats = {"空行":0, "型番欠落":0, "LotNo欠落":0, "数量不正":0, "数量=0":0, "日付不正":0}
+    agg: Dict[tuple, int] = {}
+
+    last_model: Optional[str] = None
+    last_lotno: Optional[str] = None
+    last_exp_norm: Optional[str] = None
+
+    def _cell(row, idx):
+        return row.iloc[idx] if idx < len(row) else None
+
+    def _str_or_none(v):
+        s = None if pd.isna(v) or str(v).strip()=="" else str(v).strip()
+        return s
+
+    # ブロック索引（先読み用）を本ループの前に1回だけ作る
+    def _column(idx) -> list:
+        return sub.iloc[:, idx].tolist() if idx < sub.shape[1] else [None] * len(sub)
+    models_c = [_str_or_none(v) for v in _column(mc)]
+    lotnos_c = [_str_or_none(v) for v in _column(lc)]
+    row_block, blocks = _build_block_index(
+        models_c, lotnos_c, [normalize_date_cell(v) for v in _column(ec)])
+    date_paths: dict = {}
+    if diag is not None:
+        diag["有効期限"] = date_paths
+
+    def has_any_lotno_until_next_model(start_i: int) -> bool:
+        """
+        現在の行以降、次のモデルが出るまでの間にLotNoが1つでもあるか。
+        呼び出し時点ではブロック内の現在行までに LotNo が無いので、ブロック全体の有無と一致する。
+        """
+        return blocks[row_block[start_i]][2]
+
+    def lookahead_first_exp(start_i: int) -> Optional[str]:
+        """
+        現在の行を含め、次のモデルが出るまでに最初に見つかった期限を返す。
+        呼び出し時点ではブロック内の現在行までに期限が無いので、ブロック最初の期限と一致する。
+        """
+        return blocks[row_block[start_i]][3]
+
+    for i in range(len(sub)):
+        row=sub.iloc[i,:]
+
+        model_raw=_cell(row, mc)
+        lotno_raw=_cell(row, lc)
+        qty_raw  =_cell(row, qc)
+        exp_raw  =_cell(row, ec)
+
+        model = _str_or_none(model_raw)
+        lotno = _str_or_none(lotno_raw)
+        qty_i = _to_int_qty(qty_raw)
+        exp_s = _str_or_none(exp_raw)
+        exp_norm = normalize_date_cell(exp_raw, date_paths)
+
+        # 完全空行
+        if not any([model, lotno, (qty_i is not None), (exp_s is not None and exp_s!="")]):
+            stats["空行"] += 1
+            continue
+
+        # ★ ブロック境界検知：この行に model があれば新ブロック開始
+        if model:
+            last_model = model
+            # 前ブロックのLot/期限はここで確実に捨てる（誤キャリー防止）
+            last_lotno = None
+            last_exp_norm = None
+
+        # 入力がある項目だけ last_* を更新
+        if lotno: last_lotno = lotno
+        if exp_norm: last_exp_norm = exp_norm
+
+        cur_model = last_model
+        cur_lotno = last_lotno
+        cur_exp   = last_exp_norm
+
+        if not cur_model:
+            stats["型番欠落"] += 1
+            continue
+
+        # 数量チェック
+        if qty_i is None:
+            # 期限だけやシリアル行などは既にキャリー済みなのでエラーにしない
+            continue
+        if qty_i == 0:
+            stats["数量=0"] += 1
+            continue
+        qty_i = abs(qty_i) * qty_sign
+
+        # 期限がこの時点で未確定なら、同ブロック内から先読み
+        if require_exp and not cur_exp:
+            peek_exp = lookahead_first_exp(i)
+            if peek_exp:
+                cur_exp = peek_exp
+                last_exp_norm = peek_exp
+            else:
+                stats["日付不正"] += 1
+                continue
+
+        # Lot No.必須だが、ブロック内にLotNoが1つも無い=シリアルだけの特例は許容
+        if require_lotno and not cur_lotno:
+            if has_any_lotno_until_next_model(i):
+                stats["LotNo欠落"] += 1
+                continue
+            else:
+                cur_lotno = ""  # 特例：空のまま出力
+
+        key = (cur_model, cur_lotno or "", cur_exp or "")
+        agg[key] = agg.get(key, 0) + qty_i
+
+    out: List[Dict[str, Any]] = []
+    for (model, lotno, exp_norm), qty_sum in agg.items():
+        out.append({
+            "工程名": koutei or "",
+            "LOT": lot or "",
+            "型番": model,
+            "Lot No.": lotno,
+            "払出数": qty_sum,
+            "有効期限": exp_norm or "",
+            "ファイル名": file_label
+        })
+
+    return out, stats
+
+# ===================== 1ファイル分の抽出（逐次／プロセス並列で共通） =====================
+# 抽出結果（extract_workbook の戻り値）の形が変わる／同じ入力で出力が変わる修正をしたら上げる（キャッシュ無効化用）
+EXTRACTOR_VERSION = "10"
+
+def extract_workbook(src: Source, require_lotno: bool=True, require_exp: bool=True, engine: Optional[str]=None) -> dict:
+    """
+    ファイル内容だけで決まる部分の抽出（シート選択 → 工程名/LOT → ヘッダ検出 → 明細抽出）。
+    ファイル名に依存しないよう、明細は ファイル名="" ・符号+1 で作る（finish_extraction で付け直す）。
+    結果はキャッシュ・プロセス間受け渡しの単位になる。
+    返り値: {"sheet", "reason", "header", "rows", "stats", "saved_parses", "date_paths", "metrics"}（header=None はヘッダ検出失敗）
+      date_paths = 有効期限セルの変換経路ごとの件数（日付型／シリアル値／文字列）
+      metrics    = 工程ごとの所要時間と入出力行数・走査セル数（instrument.StageTimer.as_dict）
+                   cells_scanned = シート評価で流したセル数＋取り込みシートのセル数、engine = 読み込みエンジン
+    engine は readers.resolve_engine のとおり（どのエンジンでも結果は同じなので、キャッシュのキーには含めない）。
+    """
+    timer = StageTimer()
+    with timer.stage("open"):
+        book = WorkbookSession(src, engine)
+    with book:
+        # 変更点：数量優先ロジックで取り込みシートを決定
+        with timer.stage("select"):
+            target_sheet, reason = choose_target_sheet_qty_first(book)
+        with timer.stage("read"):
+            df = book.sheet(target_sheet)
+        saved_parses = book.saved_parses
+        cells_streamed = book.cells_streamed
+        engine = book.engine
+
+    rec = {"sheet": target_sheet, "reason": reason, "header": None, "rows": RowTable(), "stats": {},
+           "saved_parses": saved_parses, "date_paths": {}}
+    def finish(rows_in: int) -> dict:
+        rec["metrics"] = timer.as_dict(sheet=target_sheet, rows_in=rows_in, rows_out=len(rec["rows"]),
+                                       cells_scanned=cells_streamed + df.size, engine=engine)
+        return rec
+
+    with timer.stage("koutei_lot"):
+        koutei, lot = extract_koutei_lot_from_sheet(df)
+    with timer.stage("header"):
+        hmap=detect_header(df, scan_rows=60)
+    if not hmap:
+        return finish(rows_in=len(df))
+    diag: dict = {}
+    with timer.stage("parse"):
+        rows, rej = parse_excel_table(
+            df, hmap, koutei or "", lot or "",
+            file_label="",
+            qty_sign=1,
+            require_lotno=require_lotno,
+            require_exp=require_exp,
+            diag=diag,
+        )
+    rec.update(header=hmap, rows=rows, stats=rej, date_paths=diag["有効期限"])
+    return finish(rows_in=len(df) - hmap["row"] - 1)
+
+def finish_extraction(name: str, rec: dict, cached: bool=False) -> dict:
+    """
+    extract_workbook の結果にファイル名由来の情報（ファイル名列・返庫の符号）と UI 向けメッセージを付ける。
+    返り値: {"name", "rows", "problems": [...], "infos": [...], "saved_parses", "cached", "date_paths", "metrics"}
+      rows は RowTable。metrics はキャッシュヒット時は {}（その回の計測ではないため）
+    """
+    res = {"name": name, "rows": RowTable(), "problems": [], "infos": [],
+           "saved_parses": 0 if cached else rec["saved_parses"], "cached": cached,
+           "date_paths": rec.get("date_paths", {}), "metrics": {} if cached else rec.get("metrics", {})}
+    target_sheet, reason = rec["sheet"], rec["reason"]
+    if not rec["header"]:
+        res["problems"].append(f"{name}: ヘッダ検出失敗（{target_sheet} / 理由: {reason}）")
+        return res
+
+    # ファイル名に「返庫」を含む場合、払出数をマイナス符号で取り込む
+    # zip／フォルダ由来の name はサブパス（a/b/返庫.xlsx）。ファイル名列はサブパスのまま、判定は最後の要素だけで行う
+    base_name = name.rsplit(".", 1)[0]
+    qty_sign = -1 if is_henko_from_name(base_name.rsplit("/", 1)[-1]) else 1
+    rows = rec["rows"].relabel(base_name, qty_sign)
+    rej = rec["stats"]
+    res["rows"] = rows
+    if not rows:
+        res["problems"].append(
+            f"{name}: 明細0件（{target_sheet} / {reason} / 拒否内訳: {rej}）"
+        )
+    else:
+        bad = {k:v for k,v in rej.items() if v>0}
+        if bad:
+            res["infos"].append(f"{name}（{target_sheet}）でスキップ: {bad}")
+    return res
+
+def summarize_date_paths(results: list[dict]) -> str:
+    """各ファイルの date_paths を合計して『日付型 N / シリアル値 N / 文字列 N』の形にする（セルが無ければ ''）"""
+    total: dict = {}
+    for res in results:
+        for path, k in res.get("date_paths", {}).items():
+            total[path] = total.get(path, 0) + k
+    if not total:
+        return ""
+    return " / ".join(f"{path} {total.get(path, 0)}" for path in DATE_PATHS)
+
+def _failed_result(name: str, msg: str) -> dict:
+    return {"name": name, "rows": RowTable(), "problems": [f"{name}: {msg}"], "infos": [], "saved_parses": 0, "cached": False,
+            "date_paths": {}, "metrics": {}}
+
+def extract_one_file(name: str, src: Source, require_lotno: bool=True, require_exp: bool=True,
+                     engine: Optional[str]=None) -> dict:
+    """1ファイル分の抽出（失敗も例外にせず結果の problems に入れて返す）"""
+    try:
+        return finish_extraction(name, extract_workbook(src, require_lotno, require_exp, engine))
+    except Exception as e:
+        return _failed_result(name, f"解析エラー: {e}")
+
+def run_extraction(
+    files: List[Tuple[str, Source]],
+    require_lotno: bool=True,
+    require_exp: bool=True,
+    workers: int=1,
+    cache=None,
+    memory_budget: Optional[int]=None,
+    progress: Optional[Callable[[int, int, str], None]]=None,
+    engine: Optional[str]=None,
+    digests: Optional[List[str]]=None,
+) -> list[dict]:
+    """
+    files = [(ファイル名, bytes またはファイルパス), ...] を抽出し、結果をアップロード順のリストで返す。
+    パスで渡すと、並列時もワーカーへはパスだけが送られ、各ワーカーがファイルから直接読む。
+    cache（extract_cache.ExtractionCache）を渡すと、内容ハッシュが一致するファイルは解析せずに返す。
+    digests = files と同じ並びの内容ハッシュ（spill.content_digest）が分かっていれば渡す（キャッシュのキーに使い、読み直さない）。
+    workers > 1 のときは未キャッシュ分をファイル単位で ProcessPoolExecutor に投げる（入力順に並べ直す）。
+    ワーカーが異常終了するとプールごと使えなくなるため、巻き添えになったファイルは1件ずつ別プロセスで再実行し、
+    それでも落ちるファイルだけをそのファイルの問題として記録する（実行全体は止めない）。
+    memory_budget（バイト）を渡すと、並列時に同時に処理中のファイルの展開後サイズ（spill.estimate_unpacked_size）の
+    合計がこれを超えないように、終わった分だけ次を投入する（1件で超えるファイルは単独で処理する）。
+    逐次のときは常に1件ずつなので関係しない。ファイル数に上限は無い。
+    progress(終わった件数, 全件数, ファイル名) は1件終わるたびにこのプロセスで呼ばれる（進捗表示用）。
+    engine はブックの読み込みエンジン（readers.resolve_engine。None は EXTRACT_READER の既定）。
+    """
+    results: List[Optional[dict]] = [None] * len(files)
+    keys: List[Optional[str]] = [None] * len(files)
+    todo: List[int] = []
+    n_done = 0
+
+    def report(i: int):
+        nonlocal n_done
+        n_done += 1
+        if progress is not None:
+            progress(n_done, len(files), files[i][0])
+
+    for i, (name, src) in enumerate(files):
+        if cache is not None:
+            keys[i] = cache.key(src, require_lotno, require_exp, digests[i] if digests else None)
+            rec = cache.get(keys[i])
+            if rec is not None:
+                results[i] = finish_extraction(name, rec, cached=True)
+                report(i)
+                continue
+        todo.append(i)
+
+    def done(i: int, rec: dict):
+        if cache is not None:
+            cache.put(keys[i], rec)
+        results[i] = finish_extraction(files[i][0], rec)
+
+    workers = max(1, min(int(workers), len(todo)))
+    if workers == 1:
+        for i in todo:
+            try:
+                done(i, extract_workbook(files[i][1], require_lotno, require_exp, engine))
+            except Exception as e:
+                results[i] = _failed_result(files[i][0], f"解析エラー: {e}")
+            report(i)
+        return results
+
+    # multiprocessing の import は並列時だけ（バッチCLIの起動を軽くする）
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    cost = {i: estimate_unpacked_size(files[i][1]) for i in todo} if memory_budget else {}
+    broken: List[int] = []
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        pending = deque(todo)
+        running: dict = {}   # future → ファイル番号
+        in_flight = 0        # 処理中のファイルの見積もり合計
+        while pending or running:
+            # 予算内なら次を投入（何も処理中でなければ、予算を超えるファイルでも1件は投入する）
+            while pending and (not running or not memory_budget or in_flight + cost[pending[0]] <= memory_budget):
+                i = pending[0]
+                try:
+                    fut = ex.submit(extract_workbook, files[i][1], require_lotno, require_exp, engine)
+                except BrokenProcessPool:
+                    broken.extend(pending); pending.clear()
+                    break
+                pending.popleft()
+                running[fut] = i
+                in_flight += cost.get(i, 0)
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                i = running.pop(fut)
+                in_flight -= cost.get(i, 0)
+                try:
+                    done(i, fut.result())
+                except BrokenProcessPool:
+                    broken.append(i)
+                    continue
+                except Exception as e:
+                    results[i] = _failed_result(files[i][0], f"解析エラー: {e}")
+                report(i)
+
+    for i in sorted(broken):
+        name, src = files[i]
+        with ProcessPoolExecutor(max_workers=1) as ex:
+            try:
+                done(i, ex.submit(extract_workbook, src, require_lotno, require_exp, engine).result())
+            except BrokenProcessPool as e:
+                results[i] = _failed_result(name, f"解析エラー（ワーカー異常終了）: {e}")
+            except Exception as e:
+                results[i] = _failed_result(name, f"解析エラー: {e}")
+        report(i)
+    return results
@@ -0,0 +1,134 @@
+# import_history.py
+# 取込履歴（どのファイルをいつ台帳へ取り込んだか）。前日分と一緒に再アップロードされたファイルを、
+# シート選択より前（解析せず）に飛ばして、編集用に同じ行が二重に入るのを防ぐ。
+#   - 台帳の非表示シート『_取込履歴』（ledger_store では import_history 表）に [内容ハッシュ, ファイル名, 取込日時, 行数]
+#   - 内容ハッシュが一致 → 取込済みとして飛ばす。ファイル名（編集用のファイル名列と同じ、拡張子なしのサブパス）だけが
+#     一致 → 内容が変わった同名ファイルとして取り込み、その旨を知らせる
+#   - 任意: 行単位の重複除去（HEADERS の値の組（row_key）の集合で、台帳に既にある行・今回の中で重複した行を落とす）
+# ------------------------------------------------------------
+import datetime as dt
+from typing import Iterable, Optional
+
+from extractor import HEADERS, _to_int_qty
+from rowtable import RowTable, Rows
+from spill import Source, content_digest, excel_input
+
+HISTORY_SHEET = "_取込履歴"
+HISTORY_HEADERS = ["内容ハッシュ", "ファイル名", "取込日時", "行数"]
+
+def file_label(name: str) -> str:
+    """ファイル名列に入る値（拡張子を除いたサブパス。extractor.finish_extraction と同じ）"""
+    return name.rsplit(".", 1)[0]
+
+class ImportHistory:
+    """取込履歴の索引（内容ハッシュ → 行、ファイル名 → 行）。同じキーは後の記録が勝つ"""
+    def __init__(self, rows: Iterable = ()):
+        self.by_hash: dict[str, list] = {}
+        self.by_name: dict[str, list] = {}
+        for row in rows:
+            row = list(row)[:4]
+            if row and row[0]:
+                self._index(row)
+
+    def _index(self, row: list):
+        self.by_hash[str(row[0])] = row
+        if row[1]:
+            self.by_name[str(row[1])] = row
+
+    def __len__(self) -> int:
+        return len(self.by_hash)
+
+    def record(self, digest: str, name: str, n_rows: int, when: Optional[dt.datetime]=None) -> list:
+        """取り込んだファイルを1件記録し、履歴シートに足す行を返す"""
+        when = when or dt.datetime.now()
+        row = [digest, file_label(name), when.strftime("%Y-%m-%d %H:%M:%S"), n_rows]
+        self._index(row)
+        return row
+
+def load_history(src: Optional[Source]) -> ImportHistory:
+    """台帳 xlsx（bytes／パス）の『_取込履歴』を読む（無ければ空）"""
+    if not src:
+        return ImportHistory()
+    from openpyxl import load_workbook
+    wb = load_workbook(excel_input(src), read_only=True)
+    try:
+        if HISTORY_SHEET not in wb.sheetnames:
+            return ImportHistory()
+        return ImportHistory(wb[HISTORY_SHEET].iter_rows(min_row=2, max_col=4, values_only=True))
+    finally:
+        wb.close()
+
+def split_known(files: list[tuple[str, Source]], history: ImportHistory) -> tuple[list[tuple[str, Source]], list[str], list[str], list[str]]:
+    """
+    取込済みのファイルを除く（解析の前に内容ハッシュだけで判定する）。
+    返り値: (取り込むファイル, 内容ハッシュ（取り込むファイルと同じ並び）, 飛ばしたファイルのメッセージ, 同名ファイルのお知らせ)
+    内容ハッシュはファイル名ではなく並びで対応させる（別フォルダ・zip の中身などで同じ名前のファイルがあるため）。
+    今回の中で内容が同じファイルが複数あれば、最初の1件だけを取り込む。
+    """
+    todo, digests, skipped, notes = [], [], [], []
+    seen: dict[str, str] = {}
+    for name, src in files:
+        digest = content_digest(src)
+        known = history.by_hash.get(digest)
+        if known is not None:
+            skipped.append(f"{name}: 取込済み（{known[2]} に『{known[1]}』として {known[3]} 行）")
+            continue
+        if digest in seen:
+            skipped.append(f"{name}: 今回の『{seen[digest]}』と内容が同じ")
+            continue
+        seen[digest] = name
+        same_name = history.by_name.get(file_label(name))
+        if same_name is not None:
+            notes.append(f"{name}: 同じファイル名を {same_name[2]} に取込済み（内容が違うため取り込みます）")
+        todo.append((name, src))
+        digests.append(digest)
+    return todo, digests, skipped, notes
+
+def history_rows_for(results: list[dict], digests: list[str], history: ImportHistory) -> list[list]:
+    """
+    明細を取り込めたファイルを履歴に記録し、履歴シートに足す行を返す（問題のあったファイルは次回また取り込めるよう記録しない）。
+    digests は results と同じ並び（run_extraction に渡したファイルの順）の内容ハッシュ。
+    """
+    now = dt.datetime.now()
+    return [history.record(digest, res["name"], len(res["rows"]), now)
+            for res, digest in zip(results, digests) if res["rows"]]
+
+# ===================== 行単位の重複除去（任意） =====================
+def row_key(values) -> tuple:
+    """
+    編集用の1行（HEADERS 順の値）の比較用キー。空セルと '' は同じ、払出数は整数で比べる。
+    値そのもののタプルを返す（ハッシュ値だけで比べると、衝突したときに重複でない行を落としてしまう）
+    """
+    return tuple(
+        _to_int_qty(v) if i == 4 else ("" if v is None else str(v).strip())
+        for i, v in enumerate(values)
+    )
+
+def ledger_row_keys(src: Optional[Source], sheet_name: str="編集用") -> set[tuple]:
+    """台帳 xlsx の編集用にある行のキー（row_key）の集合"""
+    if not src:
+        return set()
+    from openpyxl import load_workbook
+    wb = load_workbook(excel_input(src), read_only=True)
+    try:
+        if sheet_name not in wb.sheetnames:
+            return set()
+        return {row_key(v[:len(HEADERS)]) for v in wb[sheet_name].iter_rows(min_row=2, max_col=len(HEADERS), values_only=True)
+                if any(c not in (None, "") for c in v)}
+    finally:
+        wb.close()
+
+def drop_duplicate_rows(rows: Rows, keys: set[tuple]) -> tuple[Rows, int]:
+    """keys（台帳に既にある行）と今回の中で重複する行を落とす。keys には残した行を足す。(残した行, 落とした数)"""
+    values = rows.iter_values() if isinstance(rows, RowTable) else ([r.get(h) for h in HEADERS] for r in rows)
+    kept = []
+    for i, v in enumerate(values):
+        k = row_key(v)
+        if k in keys:
+            continue
+        keys.add(k)
+        kept.append(i)
+    if len(kept) == len(rows):
+        return rows, 0
+    out = rows.take(kept) if isinstance(rows, RowTable) else [rows[i] for i in kept]
+    return out, len(rows) - len(kept)
@@ -0,0 +1,147 @@
+# instrument.py
+# 抽出の計測。「今日は抽出が遅い」と言われたときに、どのファイルのどの工程で時間を使ったかを後から追えるようにする。
+#   - extract_workbook の中で StageTimer を回し、工程ごとの所要時間・入出力行数・走査セル数を rec["metrics"] に入れる
+#     （プロセス並列でも戻り値と一緒に戻る。キャッシュヒットしたファイルは計測なし）
+#   - 1ファイル1行＋実行全体1行の JSON ログ（logger "extract.metrics"。出力先は configure_json_log で指定）
+#   - 任意: 一番遅かったファイルを cProfile＋tracemalloc の下で取り直し、プロファイルを添付する
+# ------------------------------------------------------------
+import json, logging, sys, time
+from contextlib import contextmanager
+from typing import Optional
+
+# 工程名は bench/bench_suite.py と揃える
+STAGES = ("open", "select", "read", "koutei_lot", "header", "parse")
+STAGE_LABELS = {
+    "open": "ブックを開く", "select": "シート選択", "read": "シート読込", "koutei_lot": "工程名/LOT",
+    "header": "ヘッダ検出", "parse": "明細抽出",
+}
+
+logger = logging.getLogger("extract.metrics")
+
+class StageTimer:
+    """工程ごとの経過時間（秒）を積算する。with timer.stage("read"): ..."""
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def as_dict(self, **counts) -> dict:
+        """{"stages": {工程: 秒}, "total": 秒, **counts}（counts は rows_in / rows_out / cells_scanned）"""
+        return {"stages": dict(self.stages), "total": sum(self.stages.values()), **counts}
+
+# ===================== 表示・ログ =====================
+def metrics_table(results: list[dict]) -> list[dict]:
+    """UI の表用：1ファイル1行（工程の列はミリ秒）"""
+    table = []
+    for res in results:
+        m = res.get("metrics") or {}
+        row = {"ファイル": res["name"], "シート": m.get("sheet", ""), "エンジン": m.get("engine", ""),
+               "キャッシュ": "ヒット" if res.get("cached") else ""}
+        for s in STAGES:
+            row[f"{STAGE_LABELS[s]}(ms)"] = round(m["stages"][s] * 1000, 1) if s in m.get("stages", {}) else None
+        row["合計(ms)"] = round(m["total"] * 1000, 1) if "total" in m else None
+        row["入力行"] = m.get("rows_in")
+        row["出力行"] = len(res["rows"])
+        row["走査セル"] = m.get("cells_scanned")
+        table.append(row)
+    return table
+
+def configure_json_log(dest: Optional[str]) -> None:
+    """JSON ログの出力先を設定する（'-' は標準エラー、それ以外はファイルに追記）。None なら何もしない"""
+    if not dest:
+        return
+    for h in logger.handlers:
+        if getattr(h, "_metrics_dest", None) == dest:
+            return
+    h = logging.StreamHandler(sys.stderr) if dest == "-" else logging.FileHandler(dest, encoding="utf-8")
+    h._metrics_dest = dest
+    h.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(h)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def _emit(record: dict) -> None:
+    logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+def log_run(results: list[dict], **run) -> None:
+    """
+    1ファイル1行（event=file）と実行全体1行（event=run）を JSON で出す。
+    run には workers / ledger_s（台帳更新の秒数）など実行単位の値を渡す。
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    run_id = run.pop("run_id", None) or time.strftime("%Y%m%dT%H%M%S")
+    for res in results:
+        m = res.get("metrics") or {}
+        _emit({"event": "file", "run": run_id, "name": res["name"], "sheet": m.get("sheet"),
+               "engine": m.get("engine"), "cached": res.get("cached", False), "failed": bool(res["problems"]) and not res["rows"],
+               "stages": {s: round(v, 6) for s, v in m.get("stages", {}).items()},
+               "total_s": round(m.get("total", 0.0), 6), "rows_in": m.get("rows_in"),
+               "rows_out": len(res["rows"]), "cells_scanned": m.get("cells_scanned")})
+    _emit({"event": "run", "run": run_id, "files": len(results),
+           "rows_out": sum(len(res["rows"]) for res in results),
+           "cache_hits": sum(1 for res in results if res.get("cached")), **run})
+
+def log_ledger(**fields) -> None:
+    """台帳Excelの作成1回を event=ledger で出す（抽出とは別のタイミング＝ダウンロード時・バックグラウンドで作るため）"""
+    if logger.isEnabledFor(logging.INFO):
+        _emit({"event": "ledger", **fields})
+
+# ===================== プロファイル（任意） =====================
+def slowest_index(results: list[dict]) -> Optional[int]:
+    """計測のあるファイルのうち合計時間が最大のもの（キャッシュヒットのみなら None）"""
+    timed = [(res["metrics"]["total"], i) for i, res in enumerate(results) if (res.get("metrics") or {}).get("total")]
+    return max(timed)[1] if timed else None
+
+def profile_extraction(name: str, src, require_lotno: bool=True, require_exp: bool=True, top: int=30,
+                       engine: Optional[str]=None) -> dict:
+    """
+    1ファイル（bytes またはパス）を cProfile と tracemalloc の下で抽出し直す（計測の上乗せがあるので、時間は通常実行より長く出る）。
+    返り値: {"name", "seconds", "peak_bytes", "pstats"（累積時間順の上位 top 行）,
+             "memory_top"（終了時点で残っている確保の上位）, "prof"（.prof 形式の bytes。snakeviz 等で開ける）}
+    """
+    import cProfile, io, marshal, pstats, tracemalloc
+    from extractor import extract_workbook
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    pr = cProfile.Profile()
+    t0 = time.perf_counter()
+    pr.enable()
+    try:
+        rec = extract_workbook(src, require_lotno, require_exp, engine)
+    finally:
+        pr.disable()
+        seconds = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        snap = tracemalloc.take_snapshot()
+        if started:
+            tracemalloc.stop()
+    del rec
+
+    out = io.StringIO()
+    stats = pstats.Stats(pr, stream=out)
+    stats.sort_stats("cumulative").print_stats(top)
+    snap = snap.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                               tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                               tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")])
+    memory_top = "\n".join(str(s) for s in snap.statistics("lineno")[:15])
+    return {"name": name, "seconds": seconds, "peak_bytes": peak, "pstats": out.getvalue(),
+            "memory_top": memory_top, "prof": marshal.dumps(stats.stats)}
+
+def profile_slowest(files: list[tuple], results: list[dict],
+                    require_lotno: bool=True, require_exp: bool=True) -> Optional[dict]:
+    """run_extraction の結果から一番遅かったファイルを選んで profile_extraction する（そのときと同じエンジンで読む）"""
+    i = slowest_index(results)
+    if i is None:
+        return None
+    name, src = files[i]
+    return profile_extraction(name, src, require_lotno, require_exp, engine=results[i]["metrics"].get("engine"))
@@ -0,0 +1,407 @@
+# ledger.py
+# 台帳Excel（編集用／品名マスタ／品名ごと／工程ごと）の追記とレポート再作成。
+# Streamlit に依存しないので、UI（app.py）とバッチCLI（extract_batch.py）の両方から使う。
+# ------------------------------------------------------------
+import io
+from functools import lru_cache
+from unicodedata import east_asian_width
+
+from openpyxl import load_workbook, Workbook
+from openpyxl.utils import get_column_letter
+
+from extractor import HEADERS, _to_int_qty
+from rowtable import RowTable, Rows
+from spill import Source, excel_input
+from import_history import HISTORY_HEADERS, HISTORY_SHEET
+
+# ===================== 列幅 =====================
+AUTOSIZE_MAX_WIDTH = 80
+AUTOSIZE_SAMPLE_ROWS = 2000   # 幅が未設定の列を既存行から測るときの行数上限（先頭と末尾から半分ずつ）
+
+@lru_cache(maxsize=65536)
+def _wide_display_width(s: str) -> int:
+    w = 0
+    for line in s.split("\n"):
+        w = max(w, sum(2 if east_asian_width(ch) in ("F", "W") else 1 for ch in line))
+    return w
+
+def display_width(s: str) -> int:
+    """Excel上の表示幅の目安（全角=2, 半角=1）。改行を含む場合は最長の行"""
+    if s.isascii():
+        return len(s) if "\n" not in s else max(map(len, s.split("\n")))
+    return _wide_display_width(s)
+
+def measure_widths(rows, widths: list[int]|None=None) -> list[int]:
+    """行（値のシーケンス）の列ごとの最大表示幅。widths を渡すとそこへ max で畳み込む"""
+    widths = [] if widths is None else widths
+    for values in rows:
+        if len(values) > len(widths):
+            widths.extend([0] * (len(values) - len(widths)))
+        for i, v in enumerate(values):
+            if v is None:
+                continue
+            w = display_width(v if isinstance(v, str) else str(v))
+            if w > widths[i]:
+                widths[i] = w
+    return widths
+
+def apply_widths(ws, widths: list[int], grow_only: bool=False):
+    """表示幅から列幅を設定する。grow_only=True なら設定済みの幅より狭くはしない"""
+    for i, w in enumerate(widths, 1):
+        letter = get_column_letter(i)
+        width = min(w + 2, AUTOSIZE_MAX_WIDTH)
+        if grow_only and letter in ws.column_dimensions:
+            cur = ws.column_dimensions[letter].width
+            if cur and cur >= width:
+                continue
+        ws.column_dimensions[letter].width = width
+
+def iter_sample_rows(ws, sample_rows: int|None=None):
+    """シートの値を行ごとに返す。sample_rows を超える大きなシートは先頭と末尾の一部だけ"""
+    max_row = ws.max_row
+    if not sample_rows or max_row <= sample_rows:
+        yield from ws.iter_rows(values_only=True)
+        return
+    half = sample_rows // 2
+    yield from ws.iter_rows(min_row=1, max_row=half, values_only=True)
+    yield from ws.iter_rows(min_row=max_row - half + 1, max_row=max_row, values_only=True)
+
+def autosize(ws, sample_rows: int|None=None):
+    """シート全体（sample_rows 指定時は先頭と末尾の抜粋）を走査して列幅を合わせる"""
+    apply_widths(ws, measure_widths(iter_sample_rows(ws, sample_rows), [0] * ws.max_column))
+
+def fit_appended_columns(ws, new_rows: list[list], ncols: int):
+    """
+    追記した行とヘッダだけから列幅を広げる（既存の幅は縮めない）。
+    幅が未設定の列があるときだけ、既存行を抜粋で測って補う。
+    """
+    widths = measure_widths([[c.value for c in ws[1]]] + new_rows, [0] * ncols)
+    unset = any(get_column_letter(i) not in ws.column_dimensions for i in range(1, len(widths) + 1))
+    if unset and ws.max_row > len(new_rows) + 1:
+        measure_widths(iter_sample_rows(ws, AUTOSIZE_SAMPLE_ROWS), widths)
+    apply_widths(ws, widths, grow_only=True)
+
+# ===================== 集計（品名ごと／工程ごと） =====================
+def ensure_sheet(wb, name, headers):
+    ws = wb[name] if name in wb.sheetnames else wb.create_sheet(name)
+    if ws.max_row < 1 or all(ws.cell(row=1,column=i+1).value is None for i in range(len(headers))):
+        for i,h in enumerate(headers,1): ws.cell(row=1,column=i).value = h
+    return ws
+
+def clear_sheet_body(ws):
+    if ws.max_row > 1:
+        ws.delete_rows(idx=2, amount=ws.max_row-1)
+
+def read_sheet_as_records(ws) -> list[dict]:
+    rows = ws.iter_rows(values_only=True)
+    first = next(rows, ())
+    headers = [str(v or "").strip() for v in first]
+    recs=[]
+    for values in rows:
+        row={}; empty=True
+        for c,h in enumerate(headers):
+            v = values[c] if c < len(values) else None
+            if v not in (None,""): empty=False
+            row[h]=v
+        if not empty: recs.append(row)
+    return recs
+
+def name_map_from_rows(rows) -> dict:
+    """品名マスタの (品名, 型番) の並びから 型番→品名 の辞書を作る"""
+    mp={}
+    for pname, model in rows:
+        if model:
+            mp[str(model).strip()] = ("" if pname in (None,"") else str(pname).strip())
+    return mp
+
+def build_name_map_from_master(wb) -> dict:
+    if "品名マスタ" not in wb.sheetnames:
+        ws = wb.create_sheet("品名マスタ")
+        ws.cell(row=1, column=1, value="品名")
+        ws.cell(row=1, column=2, value="型番")
+        return {}
+    ws = wb["品名マスタ"]
+    return name_map_from_rows(ws.iter_rows(min_row=2, max_col=2, values_only=True))
+
+REPORT_SNAPSHOT_SHEET = "_集計スナップショット"   # 非表示。増分更新の起点になる集計値
+ITEM_HEADERS = ["品名","型番","払出数合計"]
+PROC_HEADERS = ["工程名","品名","型番","払出数合計"]
+
+def aggregate_records(records, sum_by_model: dict|None=None, sum_by_proc_model: dict|None=None) -> tuple[dict, dict]:
+    """
+    編集用の行（HEADERS キーの dict）を 型番別／(工程名, 型番)別 に合計する。
+    既存の合計を渡すとそこへ加算する（増分更新）。
+    """
+    sum_by_model = {} if sum_by_model is None else sum_by_model
+    sum_by_proc_model = {} if sum_by_proc_model is None else sum_by_proc_model
+    for rec in records:
+        try: qty = int(rec.get("払出数",0))
+        except: qty = 0
+        model = str(rec.get("型番") or "").strip()
+        if not model: continue
+        sum_by_model[model] = sum_by_model.get(model,0) + qty
+        proc  = str(rec.get("工程名") or "").strip()
+        if not proc: continue
+        key=(proc, model)
+        sum_by_proc_model[key] = sum_by_proc_model.get(key,0) + qty
+    return sum_by_model, sum_by_proc_model
+
+def parse_report_snapshot(rows) -> tuple[int|None, dict, dict]:
+    """スナップショットシートの本体行（[区分, 工程名, 型番, 払出数合計]）を (編集用行数, 型番別, 工程×型番別) に戻す"""
+    sum_by_model, sum_by_proc_model = {}, {}
+    edit_rows = None
+    for kind, proc, model, qty in rows:
+        if kind == "編集用行数":
+            edit_rows = qty
+        elif kind == "型番" and model:
+            sum_by_model[str(model)] = int(qty or 0)
+        elif kind == "工程" and proc and model:
+            sum_by_proc_model[(str(proc), str(model))] = int(qty or 0)
+    return edit_rows, sum_by_model, sum_by_proc_model
+
+def load_report_snapshot(wb, edit_sheet_name="編集用") -> tuple[dict, dict]|None:
+    """
+    非表示シートの集計スナップショットを読む。
+    編集用の行数が記録時と違う（手で行を足した／消した）場合は信用せず None。
+    """
+    if REPORT_SNAPSHOT_SHEET not in wb.sheetnames or edit_sheet_name not in wb.sheetnames:
+        return None
+    ws = wb[REPORT_SNAPSHOT_SHEET]
+    edit_rows, sum_by_model, sum_by_proc_model = parse_report_snapshot(ws.iter_rows(min_row=2, max_col=4, values_only=True))
+    if edit_rows != wb[edit_sheet_name].max_row:
+        return None
+    return sum_by_model, sum_by_proc_model
+
+def load_report_sheets_aggregate(wb) -> tuple[dict, dict]|None:
+    """既存の『品名ごと』『工程ごと』シートの合計値を読み戻す（スナップショットが無い台帳の増分更新用）"""
+    if "品名ごと" not in wb.sheetnames or "工程ごと" not in wb.sheetnames:
+        return None
+    ws_item, ws_proc = wb["品名ごと"], wb["工程ごと"]
+    if [c.value for c in ws_item[1][:3]] != ITEM_HEADERS or [c.value for c in ws_proc[1][:4]] != PROC_HEADERS:
+        return None
+    sum_by_model, sum_by_proc_model = {}, {}
+    for _, model, qty in ws_item.iter_rows(min_row=2, max_col=3, values_only=True):
+        if model: sum_by_model[str(model).strip()] = int(qty or 0)
+    for proc, _, model, qty in ws_proc.iter_rows(min_row=2, max_col=4, values_only=True):
+        if proc and model: sum_by_proc_model[(str(proc).strip(), str(model).strip())] = int(qty or 0)
+    return sum_by_model, sum_by_proc_model
+
+def report_snapshot_rows(sum_by_model: dict, sum_by_proc_model: dict, edit_rows: int) -> list[list]:
+    """集計スナップショットシートの中身（ヘッダ行を含む）"""
+    out = [["区分","工程名","型番","払出数合計"], ["編集用行数", None, None, edit_rows]]
+    out += [["型番", None, model, sum_by_model[model]] for model in sorted(sum_by_model)]
+    out += [["工程", proc, model, sum_by_proc_model[(proc, model)]] for (proc, model) in sorted(sum_by_proc_model)]
+    return out
+
+def save_report_snapshot(wb, sum_by_model: dict, sum_by_proc_model: dict, edit_sheet_name="編集用"):
+    if REPORT_SNAPSHOT_SHEET in wb.sheetnames:
+        ws = wb[REPORT_SNAPSHOT_SHEET]
+        clear_sheet_body(ws)
+    else:
+        ws = wb.create_sheet(REPORT_SNAPSHOT_SHEET)
+        ws.sheet_state = "hidden"
+        ws.append(["区分","工程名","型番","払出数合計"])
+    for values in report_snapshot_rows(sum_by_model, sum_by_proc_model, wb[edit_sheet_name].max_row)[1:]:
+        ws.append(values)
+
+def report_rows(sum_by_model: dict, sum_by_proc_model: dict, name_map: dict) -> tuple[list[list], list[list]]:
+    """『品名ごと』『工程ごと』の本体行（ヘッダを除く）"""
+    item_rows = [[name_map.get(model, ""), model, sum_by_model[model]] for model in sorted(sum_by_model.keys())]
+    proc_rows = [[proc, name_map.get(model, ""), model, sum_by_proc_model[(proc, model)]]
+                 for (proc, model) in sorted(sum_by_proc_model.keys(), key=lambda x:(x[0],x[1]))]
+    return item_rows, proc_rows
+
+def write_report_sheets(wb, sum_by_model: dict, sum_by_proc_model: dict):
+    ws_by_item = ensure_sheet(wb, "品名ごと", ITEM_HEADERS)
+    ws_by_proc = ensure_sheet(wb, "工程ごと", PROC_HEADERS)
+    clear_sheet_body(ws_by_item); clear_sheet_body(ws_by_proc)
+    name_map = build_name_map_from_master(wb) if (sum_by_model or sum_by_proc_model) else {}
+    item_rows, proc_rows = report_rows(sum_by_model, sum_by_proc_model, name_map)
+    # 列幅は書き込む値から決める（シートを読み直さない）
+    for ws, body in ((ws_by_item, item_rows), (ws_by_proc, proc_rows)):
+        for values in body:
+            ws.append(values)
+        apply_widths(ws, measure_widths([[c.value for c in ws[1]]] + body, [0] * ws.max_column))
+
+def refresh_reports_in_workbook(wb, edit_sheet_name="編集用", base: tuple[dict, dict]|None=None, new_records=None):
+    """
+    『品名ごと』『工程ごと』を最新化する。
+      - base と new_records を渡すと増分更新（base の合計に追記分だけを加算。編集用は読まない）
+      - base=None なら編集用を全件読み直して作り直す（全件再作成）
+    どちらの場合も、次回の増分更新用に集計スナップショット（非表示シート）を書き直す。
+    """
+    if edit_sheet_name not in wb.sheetnames:
+        return
+    if base is not None and new_records is not None:
+        sum_by_model = dict(base[0]); sum_by_proc_model = dict(base[1])
+        aggregate_records(new_records, sum_by_model, sum_by_proc_model)
+    else:
+        sum_by_model, sum_by_proc_model = aggregate_records(read_sheet_as_records(wb[edit_sheet_name]))
+    write_report_sheets(wb, sum_by_model, sum_by_proc_model)
+    save_report_snapshot(wb, sum_by_model, sum_by_proc_model, edit_sheet_name)
+
+def check_report_consistency(wb, edit_sheet_name="編集用") -> list[str]:
+    """
+    編集用を全件集計し直した結果と『品名ごと』『工程ごと』の内容を比べる。差分の説明のリストを返す（空なら一致）。
+    """
+    full = aggregate_records(read_sheet_as_records(wb[edit_sheet_name])) if edit_sheet_name in wb.sheetnames else ({}, {})
+    cur = load_report_sheets_aggregate(wb) or ({}, {})
+    diffs = []
+    for label, a, b in (("品名ごと", full[0], cur[0]), ("工程ごと", full[1], cur[1])):
+        for k in sorted(set(a) | set(b), key=str):
+            if a.get(k) != b.get(k):
+                diffs.append(f"{label} {k}: 全件集計={a.get(k)} / レポート={b.get(k)}")
+    return diffs
+
+# ===================== 新規台帳（write-only） =====================
+def iter_ledger_values(rows: Rows):
+    """編集用へ書く値の並び（払出数が空・0 の行は除く）。RowTable は dict を作らずに列から読む"""
+    if isinstance(rows, RowTable):
+        for values in rows.iter_values():
+            if values[4]:
+                yield values
+        return
+    for r in rows:
+        q = _to_int_qty(r.get("払出数"))
+        if q is None or q == 0:
+            continue
+        yield [r.get(h,"") for h in HEADERS]
+
+def write_new_ledger(rows: Rows, sheet_name:str="編集用", dest: str|None=None,
+                     history_rows: list[list]|None=None) -> bytes|str:
+    """
+    追記先が無いときの新規台帳を openpyxl の write-only モードで書き出す。
+    セルオブジェクトを保持しないので、行数が増えてもメモリは入力の rows（RowTable なら列の配列）分だけで済む。
+      1周目: 列幅と集計（品名ごと／工程ごと／スナップショット）を求める
+      2周目: 『編集用』へ流し込む（write-only では列幅を先に決める必要がある）
+    シート構成・値は update_workbook_with_rows(None, ...) の通常経路と同じ。
+    dest（パス）を渡すとそこへ書き出してパスを返す（bytes を作らない）。
+    """
+    widths = measure_widths([HEADERS])
+    n_rows = 0
+    def records():
+        nonlocal n_rows
+        for values in iter_ledger_values(rows):
+            measure_widths((values,), widths)
+            n_rows += 1
+            yield dict(zip(HEADERS, values))
+    sum_by_model, sum_by_proc_model = aggregate_records(records())
+    item_rows, proc_rows = report_rows(sum_by_model, sum_by_proc_model, {})   # 品名マスタは空
+    return write_ledger_workbook(iter_ledger_values(rows), widths, n_rows, (sum_by_model, sum_by_proc_model),
+                                 (item_rows, proc_rows), [], sheet_name, dest, history_rows)
+
+def write_ledger_workbook(edit_values, edit_widths: list[int], n_rows: int, sums: tuple[dict, dict],
+                          reports: tuple[list[list], list[list]], master_rows: list[list],
+                          sheet_name:str="編集用", dest: str|None=None, history_rows: list[list]|None=None) -> bytes|str:
+    """
+    台帳一式（編集用／品名マスタ／品名ごと／工程ごと／集計スナップショット／取込履歴）を write-only で書き出す。
+      edit_values : 編集用の本体行（HEADERS 順の値の並び）を1回だけ流す iterable。edit_widths はその列幅、n_rows は行数
+      sums        : (型番別, 工程×型番別) の合計（スナップショット用）、reports: 『品名ごと』『工程ごと』の本体行
+    集計は呼び出し側で済ませて渡す（write_new_ledger と ledger_store.LedgerStore.export_xlsx が使う）。
+    """
+    item_rows, proc_rows = reports
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    apply_widths(ws, edit_widths)
+    ws.append(HEADERS)
+    for values in edit_values:
+        ws.append(values)
+    ws_m = wb.create_sheet("品名マスタ")
+    ws_m.append(["品名","型番"])
+    for values in master_rows:
+        ws_m.append(values)
+    for name, headers, body in (("品名ごと", ITEM_HEADERS, item_rows), ("工程ごと", PROC_HEADERS, proc_rows)):
+        ws_r = wb.create_sheet(name)
+        apply_widths(ws_r, measure_widths([headers] + body))
+        ws_r.append(headers)
+        for values in body:
+            ws_r.append(values)
+    ws_s = wb.create_sheet(REPORT_SNAPSHOT_SHEET)
+    ws_s.sheet_state = "hidden"
+    for values in report_snapshot_rows(*sums, n_rows + 1):
+        ws_s.append(values)
+    ws_h = wb.create_sheet(HISTORY_SHEET)   # 空でも作っておく（次回からパッケージ単位の追記で足せる）
+    ws_h.sheet_state = "hidden"
+    for values in [HISTORY_HEADERS] + list(history_rows or []):
+        ws_h.append(values)
+    return save_output(wb.save, dest)
+
+def save_output(save, dest: str|None=None) -> bytes|str:
+    """save(ファイルオブジェクト) で書き出す。dest（パス）があればそこへ書いてパスを、無ければ bytes を返す"""
+    if dest is None:
+        bio=io.BytesIO(); save(bio); return bio.getvalue()
+    with open(dest, "wb") as f:
+        save(f)
+    return dest
+
+# ===================== “編集用”追記＋レポート再作成 =====================
+def update_workbook_with_rows(
+    base_xlsx: Source|None,
+    rows: Rows,
+    sheet_name:str="編集用",
+    report_mode:str="auto",
+    dest: str|None=None,
+    history_rows: list[list]|None=None,
+) -> bytes|str:
+    """
+    report_mode:
+      "auto"        … 集計スナップショットが使えれば増分更新、なければ全件再作成
+      "incremental" … スナップショットが無ければ既存の『品名ごと』『工程ごと』を起点に増分更新
+      "full"        … 常に編集用を全件読み直して再作成
+    追記先が無い（新規台帳）ときは write_new_ledger で一括書き出しする（report_mode は関係しない）。
+    既存台帳は、スナップショットが有効なら xlsx_append でパッケージ単位に追記し（ブック全体を読み込まない）、
+    使えない構造なら openpyxl で読み込んで追記する。
+    base_xlsx は bytes でもファイルパスでもよい。dest（パス）を渡すと結果をそこへ書き出してパスを返し、
+    省略すると bytes を返す（dest に base_xlsx と同じパスは指定しないこと）。
+    history_rows は非表示シート『_取込履歴』に足す行（import_history.history_rows_for）。
+    """
+    if not base_xlsx:
+        return write_new_ledger(rows, sheet_name, dest, history_rows)
+    if report_mode != "full":
+        from xlsx_append import append_rows_to_package
+        out = append_rows_to_package(base_xlsx, rows, sheet_name, dest, history_rows)
+        if out is not None:
+            return out
+    return update_workbook_with_openpyxl(base_xlsx, rows, sheet_name, report_mode, dest, history_rows)
+
+def update_workbook_with_openpyxl(
+    base_xlsx: Source,
+    rows: Rows,
+    sheet_name:str="編集用",
+    report_mode:str="auto",
+    dest: str|None=None,
+    history_rows: list[list]|None=None,
+) -> bytes|str:
+    """既存台帳を openpyxl で丸ごと読み込んで追記する（どんな構造の台帳でも扱える通常経路）"""
+    wb = load_workbook(excel_input(base_xlsx))
+
+    ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.create_sheet(sheet_name)
+    if ws.max_row < 1 or all(ws.cell(row=1,column=c).value is None for c in range(1,len(HEADERS)+1)):
+        for c,h in enumerate(HEADERS,1): ws.cell(row=1,column=c).value = h
+
+    # 増分更新の起点（追記前の状態で判定する）
+    base = None
+    if report_mode != "full":
+        base = load_report_snapshot(wb, sheet_name)
+        if base is None and (report_mode == "incremental" or ws.max_row <= 1):
+            base = load_report_sheets_aggregate(wb) if ws.max_row > 1 else ({}, {})
+
+    appended, appended_values = [], []
+    for values in iter_ledger_values(rows):
+        ws.append(values)
+        appended_values.append(values)
+        appended.append(dict(zip(HEADERS, values)))
+    fit_appended_columns(ws, appended_values, ws.max_column)
+    refresh_reports_in_workbook(wb, edit_sheet_name=sheet_name, base=base, new_records=appended)
+    append_history(wb, history_rows)
+    return save_output(wb.save, dest)
+
+def append_history(wb, history_rows: list[list]|None):
+    """非表示シート『_取込履歴』に行を足す（シートが無ければ作る）"""
+    if HISTORY_SHEET not in wb.sheetnames:
+        ws = wb.create_sheet(HISTORY_SHEET)
+        ws.sheet_state = "hidden"
+        ws.append(HISTORY_HEADERS)
+    ws = wb[HISTORY_SHEET]
+    for values in history_rows or []:
+        ws.append(values)
@@ -0,0 +1,105 @@
+# ledger_job.py
+# 台帳Excelの作成を抽出から切り離す（Streamlit には依存しない）。
+#   - 抽出が終わった時点では作成に必要な入力（追記先・明細・取込履歴）を持つだけにし、
+#     作成はダウンロードを押したとき（download_button の data に read_bytes を渡す）か、
+#     抽出後にバックグラウンドのスレッド（start。ジョブごとに1本なので、他のセッションの作成を待たない）で行う。どちらから呼ばれても作成は1回だけ
+#   - 出来上がった台帳は一時ファイル（spill.SpilledFile）1つ。bytes でセッションに持たない
+#     （ダウンロードを押したときだけ、Streamlit がその回の送信用に台帳全体を bytes でメモリに持つ）
+#   - 作成が終わったら入力を手放す。discard()（次の実行の開始時）で一時ファイルも消す
+# ------------------------------------------------------------
+import threading, time
+from typing import Callable, Optional
+
+from spill import SpilledFile
+
+class LedgerJob:
+    """
+    build(dest) は台帳を dest（パス）へ書き出す関数。入力は build のクロージャで持つ
+    （追記先の一時ファイルなど、作成まで消えては困るものも build から参照しておく）。
+    """
+    def __init__(self, build: Callable[[str], object], on_built: Optional[Callable[["LedgerJob"], None]]=None):
+        self._build = build
+        self._on_built = on_built
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._discarded = False
+        self.file: Optional[SpilledFile] = None
+        self.error: Optional[Exception] = None
+        self.seconds: Optional[float] = None
+
+    # ===================== 状態 =====================
+    @property
+    def ready(self) -> bool:
+        return self.file is not None
+
+    @property
+    def running(self) -> bool:
+        """バックグラウンドで作成中"""
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def size(self) -> Optional[int]:
+        return self.file.size if self.file is not None else None
+
+    # ===================== 作成 =====================
+    def start(self) -> None:
+        """このジョブ専用のスレッドでバックグラウンドで作成する"""
+        if self._thread is None and not self.ready:
+            self._thread = threading.Thread(target=self._run, name="ledger", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.result()
+        except Exception:
+            pass   # error に残してある（画面側で表示する）
+
+    def result(self) -> SpilledFile:
+        """
+        出来上がった台帳の一時ファイル（まだなら作る。作成中なら終わるまで待つ）。失敗したらその例外を送出。
+        discard() 後は（作成済みでも）RuntimeError
+        """
+        with self._lock:
+            if self._discarded:
+                raise RuntimeError("台帳の作成は取り消されました")
+            if self.file is None and self.error is None:
+                build = self._build
+                if build is None:   # 判定の直後に discard された
+                    raise RuntimeError("台帳の作成は取り消されました")
+                sf = SpilledFile()
+                t0 = time.perf_counter()
+                try:
+                    build(sf.path)
+                except Exception as e:
+                    sf.cleanup()
+                    self.error = e
+                else:
+                    self.seconds = time.perf_counter() - t0
+                    self.file = sf
+                self._build = None   # 入力（追記先・明細）を手放す
+                if self._discarded and self.file is not None:
+                    self.file.cleanup()
+                    self.file = None
+                elif self.file is not None and self._on_built is not None:
+                    self._on_built(self)
+            if self._discarded:   # 作成中に discard された
+                raise RuntimeError("台帳の作成は取り消されました")
+            if self.error is not None:
+                raise self.error
+            return self.file
+
+    def read_bytes(self) -> bytes:
+        """
+        ダウンロード用の中身（download_button の data に渡す。押されたときに作成する）。
+        Streamlit は data の関数の戻り値をどのみち bytes にしてメモリに置くので、ファイルはここで読んで閉じる
+        """
+        with self.result().open() as f:
+            return f.read()
+
+    def discard(self) -> None:
+        """作成前なら取り消し、作成済みなら一時ファイルを消す（作成中なら終わった時点で消える）"""
+        self._discarded = True
+        if self.file is not None:
+            self.file.cleanup()
+            self.file = None
+        self._build = None
@@ -0,0 +1,187 @@
+# ledger_store.py
+# 台帳の保存先を SQLite にする（任意）。xlsx は必要なときに書き出す「表示用の形」とし、
+# 毎回大きくなる xlsx を読み込んで保存し直す処理を無くす。
+#   - ledger      : 編集用と同じ列（HEADERS）。型番／工程名（＋型番）／LOT／ファイル名に索引
+#   - item_master : 品名マスタ（型番 → 品名）
+#   - sum_model / sum_proc_model : 『品名ごと』『工程ごと』の合計。追記と同じトランザクションで加算するので、
+#     レポートは台帳の行数によらず集計済みの行（型番・工程×型番の数）を品名マスタと結合して読むだけで済む
+#   - import_history : 取込履歴（import_history.py。台帳 xlsx の『_取込履歴』と同じ列）
+#   - 追記は1回の実行分を1トランザクションで入れる（途中で失敗したら何も入らない。取込履歴も同じトランザクション）
+# 集計の規則は ledger.aggregate_records と同じ（型番が空の行は数えない、工程名が空の行は工程ごとに入れない）。
+# 書き出す xlsx は ledger.write_new_ledger と同じ構成（集計スナップショット付きなので、その後 xlsx 側へ追記もできる）。
+# ------------------------------------------------------------
+# 使い方:
+#   store = LedgerStore("台帳.db")
+#   store.import_workbook("既存台帳.xlsx")   # 初回だけ（既存の編集用と品名マスタを取り込む）
+#   store.append(rows)                       # rows = 抽出結果（RowTable または HEADERS キーの dict のリスト）
+#   store.export_xlsx("台帳.xlsx")
+# ------------------------------------------------------------
+import sqlite3
+from typing import Optional
+
+from extractor import HEADERS, _to_int_qty
+from import_history import HISTORY_SHEET, ImportHistory, row_key
+from rowtable import Rows
+from ledger import (
+    aggregate_records, iter_ledger_values, measure_widths, name_map_from_rows, read_sheet_as_records,
+    write_ledger_workbook,
+)
+from spill import Source, excel_input
+
+SCHEMA_VERSION = "1"
+
+def _q(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+_COLS = ", ".join(_q(h) for h in HEADERS)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    "工程名" TEXT, "LOT" TEXT, "型番" TEXT, "Lot No." TEXT, "払出数" INTEGER, "有効期限" TEXT, "ファイル名" TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_ledger_model ON ledger ("型番");
+CREATE INDEX IF NOT EXISTS ix_ledger_proc  ON ledger ("工程名", "型番");
+CREATE INDEX IF NOT EXISTS ix_ledger_lot   ON ledger ("LOT");
+CREATE INDEX IF NOT EXISTS ix_ledger_file  ON ledger ("ファイル名");
+CREATE TABLE IF NOT EXISTS item_master (model TEXT PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS sum_model (model TEXT PRIMARY KEY, qty INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS sum_proc_model (proc TEXT NOT NULL, model TEXT NOT NULL, qty INTEGER NOT NULL,
+                                           PRIMARY KEY (proc, model));
+CREATE TABLE IF NOT EXISTS import_history (id INTEGER PRIMARY KEY, digest TEXT NOT NULL, name TEXT,
+                                           imported_at TEXT, n_rows INTEGER);
+CREATE INDEX IF NOT EXISTS ix_history_digest ON import_history (digest);
+CREATE INDEX IF NOT EXISTS ix_history_name   ON import_history (name);
+"""
+
+def _text(v) -> Optional[str]:
+    if v is None: return None
+    return v if isinstance(v, str) else str(v)
+
+class LedgerStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('schema_version', ?)", (SCHEMA_VERSION,))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ===================== 追記 =====================
+    def append(self, rows: Rows, history_rows: list[list]|None=None) -> int:
+        """
+        抽出結果を追記し、同じトランザクションで集計を加算する（history_rows があれば取込履歴も）。入れた行数を返す。
+        編集用と同じく払出数が空・0 の行は入れない（ledger.iter_ledger_values）。
+        """
+        values = [[*v[:4], _to_int_qty(v[4]), *v[5:]] for v in iter_ledger_values(rows)]
+        return self._insert(values, history_rows)
+
+    def _insert(self, values: list[list], history_rows: list[list]|None=None) -> int:
+        by_model, by_proc = aggregate_records(dict(zip(HEADERS, row)) for row in values)
+        with self._conn:
+            self._conn.executemany("INSERT INTO import_history (digest, name, imported_at, n_rows) VALUES (?,?,?,?)",
+                                   ([_text(v) for v in row[:3]] + [row[3]] for row in history_rows or []))
+            self._conn.executemany(f"INSERT INTO ledger ({_COLS}) VALUES (?,?,?,?,?,?,?)",
+                                   ([_text(v) if i != 4 else v for i, v in enumerate(row)] for row in values))
+            self._conn.executemany("INSERT INTO sum_model VALUES (?, ?) "
+                                   "ON CONFLICT (model) DO UPDATE SET qty = qty + excluded.qty", by_model.items())
+            self._conn.executemany("INSERT INTO sum_proc_model VALUES (?, ?, ?) "
+                                   "ON CONFLICT (proc, model) DO UPDATE SET qty = qty + excluded.qty",
+                                   ((p, m, q) for (p, m), q in by_proc.items()))
+        return len(values)
+
+    def set_name_master(self, pairs) -> None:
+        """品名マスタを (品名, 型番) の並びで置き換える（同じ型番は後勝ち。ledger.name_map_from_rows と同じ）"""
+        name_map = name_map_from_rows(pairs)
+        with self._conn:
+            self._conn.execute("DELETE FROM item_master")
+            self._conn.executemany("INSERT INTO item_master VALUES (?, ?)", name_map.items())
+
+    def import_workbook(self, src: Source, sheet_name: str="編集用") -> int:
+        """既存の台帳 xlsx（bytes／パス）の編集用・品名マスタ・取込履歴を取り込む（初回の移行用）。取り込んだ行数を返す"""
+        from openpyxl import load_workbook
+        wb = load_workbook(excel_input(src), read_only=True)
+        try:
+            values = []
+            if sheet_name in wb.sheetnames:
+                for rec in read_sheet_as_records(wb[sheet_name]):
+                    values.append([rec.get(h) for h in HEADERS])
+                    q = values[-1][4]
+                    try: values[-1][4] = int(q)   # aggregate_records と同じく、数値にできない払出数は 0
+                    except (TypeError, ValueError): values[-1][4] = 0
+            if "品名マスタ" in wb.sheetnames:
+                self.set_name_master(wb["品名マスタ"].iter_rows(min_row=2, max_col=2, values_only=True))
+            history_rows = []
+            if HISTORY_SHEET in wb.sheetnames:
+                history_rows = [list(r) for r in wb[HISTORY_SHEET].iter_rows(min_row=2, max_col=4, values_only=True) if r[0]]
+        finally:
+            wb.close()
+        return self._insert(values, history_rows)
+
+    # ===================== 集計・レポート =====================
+    def history(self) -> ImportHistory:
+        """取込履歴の索引（import_history.split_known に渡す）"""
+        return ImportHistory(self._conn.execute(
+            "SELECT digest, name, imported_at, n_rows FROM import_history ORDER BY id"))
+
+    def row_keys(self) -> set[tuple]:
+        """ledger の行のキー（row_key）の集合（import_history.drop_duplicate_rows に渡す）"""
+        return {row_key(v) for v in self.iter_values()}
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+
+    def sums(self) -> tuple[dict, dict]:
+        """(型番別, (工程名, 型番)別) の合計（ledger.aggregate_records の戻り値と同じ形）"""
+        sum_by_model = dict(self._conn.execute("SELECT model, qty FROM sum_model"))
+        sum_by_proc_model = {(p, m): q for p, m, q in self._conn.execute("SELECT proc, model, qty FROM sum_proc_model")}
+        return sum_by_model, sum_by_proc_model
+
+    def report_rows(self) -> tuple[list[list], list[list]]:
+        """『品名ごと』『工程ごと』の本体行（ledger.report_rows と同じ並び）を集計表と品名マスタの結合で返す"""
+        item_rows = [list(r) for r in self._conn.execute(
+            "SELECT COALESCE(i.name, ''), s.model, s.qty FROM sum_model s "
+            "LEFT JOIN item_master i ON i.model = s.model ORDER BY s.model")]
+        proc_rows = [list(r) for r in self._conn.execute(
+            "SELECT s.proc, COALESCE(i.name, ''), s.model, s.qty FROM sum_proc_model s "
+            "LEFT JOIN item_master i ON i.model = s.model ORDER BY s.proc, s.model")]
+        return item_rows, proc_rows
+
+    def rebuild_sums(self) -> None:
+        """集計表を ledger の全行から作り直す（手で ledger を直したとき用）"""
+        rows = self._conn.execute('SELECT "工程名", "型番", SUM("払出数") FROM ledger GROUP BY "工程名", "型番"')
+        by_model, by_proc = aggregate_records({"工程名": proc, "型番": model, "払出数": qty} for proc, model, qty in rows)
+        with self._conn:
+            self._conn.execute("DELETE FROM sum_model")
+            self._conn.execute("DELETE FROM sum_proc_model")
+            self._conn.executemany("INSERT INTO sum_model VALUES (?, ?)", by_model.items())
+            self._conn.executemany("INSERT INTO sum_proc_model VALUES (?, ?, ?)",
+                                   ((p, m, q) for (p, m), q in by_proc.items()))
+
+    # ===================== xlsx 書き出し =====================
+    def iter_values(self):
+        """編集用の本体行（HEADERS 順、追記順）"""
+        yield from self._conn.execute(f"SELECT {_COLS} FROM ledger ORDER BY id")
+
+    def export_xlsx(self, dest: str|None=None, sheet_name: str="編集用") -> bytes|str:
+        """台帳 xlsx を書き出す（dest があればそこへ書いてパスを、無ければ bytes を返す）"""
+        widths = measure_widths([HEADERS])
+        n_rows = 0
+        for values in self.iter_values():   # write-only では列幅を先に決める必要がある
+            measure_widths((values,), widths)
+            n_rows += 1
+        master = [[name, model] for model, name in self._conn.execute("SELECT model, name FROM item_master ORDER BY model")]
+        history = [list(r) for r in self._conn.execute(
+            "SELECT digest, name, imported_at, n_rows FROM import_history ORDER BY id")]
+        return write_ledger_workbook((list(v) for v in self.iter_values()), widths, n_rows,
+                                     self.sums(), self.report_rows(), master, sheet_name, dest, history)
@@ -0,0 +1,173 @@
+# normalizers.py
+# セル値の正規化（日付・数量・文字列）。抽出の全行・ヘッダ走査の全セルで呼ばれるので、
+#   - 正規表現と変換テーブルはモジュール読み込み時に1回だけ作る
+#   - 日付・数量の文字列は同じ値の繰り返しが多いので、件数上限つき LRU でメモ化する
+#   - 列（Series／配列）向けの版は、ユニーク値ごとに1回だけ変換して全体へ配る
+# 結果は従来の extractor.normalize_date / _to_int_qty / _n と同じ（bench/bench_normalizers.py で照合）。
+# ------------------------------------------------------------
+import numbers, re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+_DATE_RE = re.compile(r"(\d{4})[./-](\d{1,2})[./-](\d{1,2})")
+_QTY_RE = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)")
+_QTY_TRANS = str.maketrans({**{c: h for c, h in zip("０１２３４５６７８９－．", "0123456789-.")}, "，": None, ",": None})
+_NORM_TRANS = str.maketrans({"\r": " ", "\n": " ", "　": " "})
+
+MEMO_SIZE = 8192   # 日付・数量文字列のメモ化件数
+
+# ===================== スカラー版 =====================
+@lru_cache(maxsize=MEMO_SIZE)
+def _normalize_date_str(s: str) -> Optional[str]:
+    m = _DATE_RE.search(s)
+    if not m:
+        return None
+    y, mth, d = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    try:
+        date(y, mth, d)   # 実在する日付か（2/30 などは None）
+    except ValueError:
+        return None
+    return f"{y}/{mth}/{d}"
+
+def normalize_date(s: Optional[str]) -> Optional[str]:
+    """'2025-9-16' / '2025/09/16 00:00:00' などから 'YYYY/M/D'。日付として不正なら None"""
+    if not s: return None
+    return _normalize_date_str(s)
+
+# 有効期限セルの型別の変換（日付型・シリアル値はそのまま整形し、文字列だけ正規表現へ）
+EXCEL_EPOCH = date(1899, 12, 30)
+EXCEL_SERIAL_MIN = 25569   # 1970/1/1
+EXCEL_SERIAL_MAX = 73050   # 2099/12/31（これより外の数値は日付とみなさない）
+DATE_PATHS = ("日付型", "シリアル値", "文字列")
+
+def _date_cell(v) -> tuple[Optional[str], Optional[str]]:
+    """(正規化した日付, 経路)。空セルは (None, None)"""
+    if v is None:
+        return None, None
+    if isinstance(v, (datetime, date)):   # pd.Timestamp は datetime のサブクラス（NaT は除く）
+        if v is pd.NaT:
+            return None, None
+        return f"{v.year}/{v.month}/{v.day}", "日付型"
+    # numbers.Real なら np.int64 / np.float32 などもシリアル値として扱う（エンジンによって数値の型が違う）
+    if isinstance(v, numbers.Real) and not isinstance(v, (bool, np.bool_)):
+        if v != v:
+            return None, None
+        if EXCEL_SERIAL_MIN <= v < EXCEL_SERIAL_MAX + 1:
+            d = EXCEL_EPOCH + timedelta(days=int(v))
+            return f"{d.year}/{d.month}/{d.day}", "シリアル値"
+    elif pd.isna(v):
+        return None, None
+    s = v.strip() if isinstance(v, str) else str(v).strip()
+    if not s:
+        return None, None
+    return normalize_date(s), "文字列"
+
+def normalize_date_cell(v, counts: Optional[dict]=None) -> Optional[str]:
+    """
+    有効期限セル1つを 'YYYY/M/D' に。datetime / Timestamp / date は直接整形、
+    Excel のシリアル値（1970〜2099年の範囲）は日付に換算し、それ以外（文字列など）だけ normalize_date へ。
+    counts を渡すと、通った経路（DATE_PATHS）ごとの件数を加算する。
+    """
+    out, path = _date_cell(v)
+    if counts is not None and path is not None:
+        counts[path] = counts.get(path, 0) + 1
+    return out
+
+@lru_cache(maxsize=MEMO_SIZE)
+def _qty_from_str(s: str) -> Optional[int]:
+    m = _QTY_RE.match(s.strip().translate(_QTY_TRANS))
+    if not m:
+        return None
+    try:
+        return int(round(float(m.group(1))))
+    except Exception:
+        return None
+
+# 数量の強化正規化：数値型/小数/カンマ/全角/単位付きもOK
+def to_int_qty(q) -> Optional[int]:
+    if q is None or (isinstance(q, float) and q != q):
+        return None
+    if isinstance(q, (int, float)):
+        return int(round(float(q)))
+    return _qty_from_str(q if isinstance(q, str) else str(q))
+
+def clean_cell(cell) -> str:
+    """ヘッダ照合用：前後の空白を除き、全角スペースを詰め、改行を空白にする（NaN/None は ''）"""
+    # 短い文字列では str.translate より replace の連鎖のほうが速い
+    if type(cell) is not str:
+        if cell is None or pd.isna(cell): return ""
+        cell = str(cell)
+    return cell.strip().replace("　","").replace("\n"," ").replace("\r"," ")
+
+def norm(s) -> str:
+    """表示用：改行・全角スペースを空白にして前後を除く"""
+    if s is None: return ""
+    return str(s).translate(_NORM_TRANS).strip()
+
+def str_or_none(v) -> Optional[str]:
+    if isinstance(v, str):
+        v = v.strip()
+        return v or None
+    if pd.isna(v):
+        return None
+    v = str(v).strip()
+    return v or None
+
+# ===================== 列版（ユニーク値ごとに1回） =====================
+def _numbers_may_merge(values: np.ndarray) -> bool:
+    """factorize は 1 と 1.0 と True を同じ値として束ねる。その束ね方が起こりうる列か"""
+    kinds = set(map(type, values)) - {str, type(None)}
+    if len(kinds) <= 1:
+        return False
+    if kinds == {int, float}:   # 数値列に空セル（NaN）が混じっただけなら束ねは起きない
+        return any(type(v) is float and v == v for v in values)
+    return True
+
+def map_unique(values, fn: Callable, numbers_merge_ok: bool=False) -> np.ndarray:
+    """
+    値の種類ごとに fn を1回だけ呼び、結果を全体へ配る（object 配列で返す）。NaN/None には fn(None)。
+    数値の型が混在して束ねが起きうる列は1セルずつ変換する（numbers_merge_ok=True なら、
+    等しい数値に fn が同じ結果を返すので束ねてよい）。
+    """
+    values = np.asarray(values, dtype=object)
+    if not numbers_merge_ok and _numbers_may_merge(values):
+        return np.array([fn(v) for v in values], dtype=object)
+    codes, uniques = pd.factorize(values)
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    mapped[:-1] = [fn(u) for u in uniques]
+    mapped[-1] = fn(None)   # codes == -1（欠損）
+    return mapped[codes]
+
+def str_or_none_array(values) -> np.ndarray:
+    return map_unique(values, str_or_none)
+
+def normalize_date_array(values) -> np.ndarray:
+    return map_unique(values, normalize_date)
+
+def normalize_date_cells(values, counts: Optional[dict]=None) -> np.ndarray:
+    """
+    有効期限列をまとめて normalize_date_cell する（ユニーク値ごとに1回）。
+    counts を渡すと、経路ごとのセル数（ユニーク値の数ではない）を加算する。
+    """
+    values = np.asarray(values, dtype=object)
+    if _numbers_may_merge(values):
+        return np.array([normalize_date_cell(v, counts) for v in values], dtype=object)
+    codes, uniques = pd.factorize(values)
+    conv = [_date_cell(u) for u in uniques]
+    mapped = np.empty(len(uniques) + 1, dtype=object)
+    mapped[:-1] = [out for out, _ in conv]
+    mapped[-1] = None
+    if counts is not None and len(uniques):
+        per_unique = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        for (_, path), k in zip(conv, per_unique):
+            if path is not None:
+                counts[path] = counts.get(path, 0) + int(k)
+    return mapped[codes]
+
+def to_int_qty_series(values) -> pd.Series:
+    """数量列を Int64 の Series に（変換できないセルは <NA>）"""
+    return pd.Series(pd.array(map_unique(values, to_int_qty, numbers_merge_ok=True), dtype="Int64"))
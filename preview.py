@@ -0,0 +1,86 @@
+# preview.py
+# 抽出結果のプレビュー（絞り込み・並べ替え・ページ送り）。Streamlit には依存しない。
+#   - DataFrame（category 列）は抽出1回につき1回だけ作り、ResultPreview ごと session_state に置く
+#   - 絞り込みは値の一覧（category）の上で判定し、行へは番号の表引きで配る（行ごとの文字列比較をしない）
+#   - 並べ替えの順序（全行の argsort）は列・向きごとに1回だけ計算して持つ
+#   - ブラウザへ送るのは表示中の1ページ分だけ（返すページは category ではなく値そのものの列にする）
+# ------------------------------------------------------------
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from rowtable import RowTable
+
+# 絞り込みに使える列（並べ替えは HEADERS のどの列でもよい）
+FILTER_COLUMNS = ["工程名", "型番", "ファイル名"]
+
+class ResultPreview:
+    def __init__(self, rows: RowTable):
+        self.frame = rows.to_frame()
+        self._orders: dict[tuple[str, bool], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def options(self, col: str) -> list:
+        """列に現れる値（名前順）"""
+        return sorted(self.frame[col].cat.categories)
+
+    def _mask(self, col: str, cond: Union[str, list]) -> Optional[np.ndarray]:
+        """cond が文字列なら部分一致、リストならそのいずれかに一致する行。条件なしは None"""
+        if not cond:
+            return None
+        cats = self.frame[col].cat.categories
+        if isinstance(cond, str):
+            hit = np.asarray(cats.astype(str).str.contains(cond, case=False, regex=False), dtype=bool)
+        else:
+            hit = np.asarray(cats.isin(cond), dtype=bool)
+        return hit[self.frame[col].cat.codes.to_numpy()]
+
+    def _order(self, col: str, ascending: bool) -> np.ndarray:
+        """全行の並び順（同じ値の中では元の順）。列・向きごとに1回だけ計算する"""
+        key = (col, ascending)
+        if key not in self._orders:
+            s = self.frame[col]
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                # 値の名前順の順位を番号から引く（文字列の比較は値の種類数の分だけ）
+                rank = np.empty(len(s.cat.categories), dtype=np.int64)
+                rank[np.argsort(s.cat.categories.astype(str).to_numpy(), kind="stable")] = np.arange(len(rank))
+                values = rank[s.cat.codes.to_numpy()]
+            else:
+                values = s.to_numpy()
+            self._orders[key] = np.argsort(values if ascending else -values, kind="stable")
+        return self._orders[key]
+
+    def query(self, filters: Optional[dict]=None, sort_by: Optional[str]=None, ascending: bool=True,
+              page: int=1, page_size: int=300) -> tuple[pd.DataFrame, int]:
+        """
+        filters = {列: 部分一致の文字列 または 値のリスト}（FILTER_COLUMNS の列。条件の無い列は無視）
+        返り値: (page ページ目（1始まり）の DataFrame, 条件に合う行数)。元の行番号（1始まり）を index にする
+        """
+        mask = None
+        for col, cond in (filters or {}).items():
+            m = self._mask(col, cond)
+            if m is not None:
+                mask = m if mask is None else mask & m
+        if sort_by:
+            idx = self._order(sort_by, ascending)
+            if mask is not None:
+                idx = idx[mask[idx]]
+        else:
+            idx = np.flatnonzero(mask) if mask is not None else None
+        n = len(self.frame) if idx is None else len(idx)
+        start = (max(page, 1) - 1) * page_size
+        if idx is None:
+            shown = np.arange(start, min(start + page_size, n))
+        else:
+            shown = idx[start:start + page_size]
+        out = self.frame.take(shown)
+        # category 列のままだと値の一覧（全行分）ごとブラウザへ送られるので、表示する1ページ分の値だけの列にする
+        out = out.astype({c: object for c in out.columns if isinstance(out[c].dtype, pd.CategoricalDtype)})
+        out.index = shown + 1
+        return out, n
+
+def page_count(n: int, page_size: int) -> int:
+    return max(1, -(-n // page_size))
@@ -0,0 +1,92 @@
+# readers.py
+# ブックの読み込み口（エンジン）。extractor.WorkbookSession はここ経由でシート一覧・シート・先頭行を読む。
+#   - openpyxl : 従来どおり（pandas の既定。シート評価の先頭行は read-only の iter_rows でストリーム読み）
+#   - calamine : python-calamine（Rust 実装）が入っていれば使える。DataFrame 化は pandas の engine="calamine"
+# どちらのエンジンでも同じ値になるようにしてある。
+#   - シート（parse）: pandas が両エンジンの値を同じ形にそろえる（日付＝Timestamp／整数値の数値＝int／
+#     結合セル＝左上以外は空／エラーセル＝NaN）
+#   - 先頭行（iter_rows）: openpyxl の values_only に合わせる（空セル None／日付 datetime／整数値 int／
+#     行末の空セルは詰める）。ただしエラーセルは calamine では None（openpyxl は '#DIV/0!' などの文字列）、
+#     結合範囲だけの末尾の行は calamine では返らない。どちらもシート評価（ヘッダ語・払出数のセル）には影響しない
+# 既定（auto）は「calamine が入っていれば calamine、無ければ openpyxl」。bench/bench_readers.py では 5 KB の小さい
+# ファイルから calamine の方が速く（抽出全体で 1.2〜10 倍）、ファイルの大きさで分ける理由が無かった。
+# 環境変数 EXTRACT_READER（auto / openpyxl / calamine）で既定を変えられる。calamine が無ければ openpyxl で読む。
+# ------------------------------------------------------------
+import datetime as dt, importlib.util, os
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from spill import Source, excel_input
+
+ENGINES = ("openpyxl", "calamine")
+DEFAULT_ENGINE = os.environ.get("EXTRACT_READER", "auto")
+
+def available_engines() -> list[str]:
+    """この環境で使えるエンジン（openpyxl は常に使える）"""
+    return [e for e in ENGINES if e == "openpyxl" or importlib.util.find_spec("python_calamine") is not None]
+
+def resolve_engine(engine: Optional[str]=None) -> str:
+    """engine（None は DEFAULT_ENGINE）を実際に使うエンジン名にする。auto は calamine が入っていれば calamine"""
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ("auto",) + ENGINES:
+        raise ValueError(f"未知の読み込みエンジン: {engine}（auto / {' / '.join(ENGINES)}）")
+    if "calamine" not in available_engines():
+        return "openpyxl"
+    return "calamine" if engine == "auto" else engine
+
+class OpenpyxlReader:
+    engine = "openpyxl"
+
+    def __init__(self, src: Source):
+        # bytes は BytesIO で包み、パスはそのまま渡す（一時ファイルに逃がした大きな入力を複製しない）
+        self._xls = pd.ExcelFile(excel_input(src), engine="openpyxl")
+        self.sheet_names: list[str] = self._xls.sheet_names
+
+    def parse(self, name: str) -> pd.DataFrame:
+        return self._xls.parse(sheet_name=name, header=None)
+
+    def iter_rows(self, name: str, max_row: int) -> Iterator[tuple]:
+        """先頭 max_row 行を openpyxl read-only の iter_rows で値タプルとして流す（DataFrame化しない）"""
+        ws = self._xls.book[name]
+        ws.reset_dimensions()
+        return ws.iter_rows(max_row=max_row, values_only=True)
+
+    def close(self):
+        self._xls.close()
+
+def _plain_value(v):
+    """calamine の生の値を openpyxl の values_only と同じ形にする"""
+    if isinstance(v, float):
+        return int(v) if v.is_integer() else v   # 3.0 → 3、-0.0 → 0
+    if isinstance(v, str):
+        return v if v else None
+    if isinstance(v, dt.date) and not isinstance(v, dt.datetime):
+        return dt.datetime(v.year, v.month, v.day)
+    return v
+
+class CalamineReader:
+    engine = "calamine"
+
+    def __init__(self, src: Source):
+        self._xls = pd.ExcelFile(excel_input(src), engine="calamine")
+        self.sheet_names: list[str] = self._xls.sheet_names
+
+    def parse(self, name: str) -> pd.DataFrame:
+        return self._xls.parse(sheet_name=name, header=None)
+
+    def iter_rows(self, name: str, max_row: int) -> Iterator[tuple]:
+        """先頭 max_row 行を値タプルで流す（左上の空き行・空き列も含めて A1 から。行末の空セルは詰める）"""
+        sheet = self._xls.book.get_sheet_by_name(name)
+        for row in sheet.to_python(skip_empty_area=False, nrows=max_row):
+            values = [_plain_value(v) for v in row]
+            while values and values[-1] is None:
+                values.pop()
+            yield tuple(values)
+
+    def close(self):
+        self._xls.close()
+
+def open_reader(src: Source, engine: Optional[str]=None):
+    """src を開いたリーダー（OpenpyxlReader / CalamineReader）。engine は resolve_engine と同じ"""
+    return CalamineReader(src) if resolve_engine(engine) == "calamine" else OpenpyxlReader(src)
@@ -0,0 +1,180 @@
+# rowtable.py
+# 抽出した明細の持ち方。1行1 dict（日本語キー7つ）のリストは、月末の数百万行で数GBになるため、
+# 列ごとの配列で持つ（RowTable）。
+#   - 文字列の列（工程名／LOT／型番／Lot No.／有効期限／ファイル名）は値を1回だけ持ち、行は番号（int32）で参照する
+#     （工程名・LOT・ファイル名は1ファイル内で同じ値なので、実質 4 バイト/行）
+#   - 払出数は int64 の配列
+#   - pickle（抽出キャッシュ・プロセス並列の受け渡し）は配列と値の一覧だけを送る
+#   - プレビュー用には pandas の category 列の DataFrame にする（文字列を行数分複製しない）
+# 行を dict で読む箇所（iter / to_records）は従来の list[dict] と同じ値を返す。
+# ------------------------------------------------------------
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+HEADERS = ["工程名","LOT","型番","Lot No.","払出数","有効期限","ファイル名"]
+
+class _Column:
+    """値の一覧（cats）と行ごとの番号（codes）で持つ文字列の列"""
+    __slots__ = ("cats", "index", "codes")
+
+    def __init__(self, cats: Optional[list]=None, codes: Optional[array]=None):
+        self.cats: list = cats if cats is not None else []
+        self.index: dict = {v: i for i, v in enumerate(self.cats)}
+        self.codes = codes if codes is not None else array("i")
+
+    def code(self, value) -> int:
+        c = self.index.get(value)
+        if c is None:
+            c = self.index[value] = len(self.cats)
+            self.cats.append(value)
+        return c
+
+    def extend_values(self, values: Iterable):
+        code = self.code
+        self.codes.extend(code(v) for v in values)
+
+    def extend_const(self, value, n: int):
+        self.codes.extend(array("i", [self.code(value)]) * n)
+
+    def extend_column(self, other: "_Column"):
+        remap = [self.code(v) for v in other.cats]
+        self.codes.extend(remap[c] for c in other.codes)
+
+    def take(self, idx: List[int]) -> "_Column":
+        codes = self.codes
+        return _Column(list(self.cats), array("i", (codes[i] for i in idx)))
+
+    def nbytes(self) -> int:
+        return (self.codes.itemsize * len(self.codes) + sys.getsizeof(self.cats) + sys.getsizeof(self.index)
+                + sum(sys.getsizeof(v) for v in self.cats))
+
+    def __getstate__(self):
+        return self.cats, self.codes   # index は読み込み側で作り直す
+
+    def __setstate__(self, state):
+        self.cats, self.codes = state
+        self.index = {v: i for i, v in enumerate(self.cats)}
+
+class RowTable:
+    """
+    明細（HEADERS の列）を列ごとに持つ入れ物。追記（append / extend）と、行の値の順次読み出しだけを想定する。
+      len(t)             行数
+      t.iter_values()    HEADERS 順の値のリストを1行ずつ（編集用へ書く形）
+      iter(t)            1行ずつ dict（従来の list[dict] の要素と同じ）
+      t.to_frame()       プレビュー用の DataFrame（払出数以外は category 列）
+      t.nbytes()         保持しているメモリの概算（バイト）
+    """
+    def __init__(self):
+        self._cols: Dict[str, _Column] = {h: _Column() for h in HEADERS if h != "払出数"}
+        self._qty = array("q")
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str,Any]]) -> "RowTable":
+        t = cls()
+        t.extend(records)
+        return t
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Any], n: int) -> "RowTable":
+        """列ごとの値から作る。列の値がリストでなく str なら全行同じ値（工程名・LOT・ファイル名など）"""
+        t = cls()
+        for h, col in t._cols.items():
+            v = columns[h]
+            if isinstance(v, str):
+                col.extend_const(v, n)
+            else:
+                col.extend_values(v)
+        t._qty.extend(columns["払出数"])
+        return t
+
+    def __len__(self) -> int:
+        return len(self._qty)
+
+    def append(self, rec: Dict[str,Any]):
+        for h, col in self._cols.items():
+            col.codes.append(col.code(rec.get(h, "")))
+        self._qty.append(int(rec.get("払出数") or 0))
+
+    def extend(self, rows):
+        """別の RowTable（列ごと付け替える）か dict の並びを足す"""
+        if isinstance(rows, RowTable):
+            for h, col in self._cols.items():
+                col.extend_column(rows._cols[h])
+            self._qty.extend(rows._qty)
+        else:
+            for rec in rows:
+                self.append(rec)
+
+    def relabel(self, file_label: str, qty_sign: int=1) -> "RowTable":
+        """ファイル名列を file_label に置き換え、払出数に qty_sign を掛けた複製（extractor.finish_extraction 用）"""
+        t = RowTable()
+        for h, col in self._cols.items():
+            if h == "ファイル名":
+                t._cols[h].extend_const(file_label, len(self))
+            else:
+                t._cols[h] = _Column(list(col.cats), array("i", col.codes))
+        t._qty = array("q", self._qty) if qty_sign == 1 else array("q", (q * qty_sign for q in self._qty))
+        return t
+
+    def take(self, idx: List[int]) -> "RowTable":
+        """idx の行だけを、その順で持つ複製"""
+        t = RowTable()
+        t._cols = {h: col.take(idx) for h, col in self._cols.items()}
+        qty = self._qty
+        t._qty = array("q", (qty[i] for i in idx))
+        return t
+
+    def head(self, n: int) -> "RowTable":
+        return self.take(list(range(min(n, len(self)))))
+
+    def column(self, name: str) -> list:
+        """1列分の値のリスト"""
+        if name == "払出数":
+            return self._qty.tolist()
+        col = self._cols[name]
+        cats = col.cats
+        return [cats[c] for c in col.codes]
+
+    def iter_values(self):
+        cols = [None if h == "払出数" else self._cols[h] for h in HEADERS]
+        streams = [iter(self._qty) if c is None else map(c.cats.__getitem__, c.codes) for c in cols]
+        for values in zip(*streams):
+            yield list(values)
+
+    def __iter__(self):
+        for values in self.iter_values():
+            yield dict(zip(HEADERS, values))
+
+    def to_records(self) -> List[Dict[str,Any]]:
+        return list(self)
+
+    def __eq__(self, other):
+        """行の値で比べる（dict のリストとも比べられる。ベンチでの参照実装との照合用）"""
+        if isinstance(other, RowTable):
+            other = other.to_records()
+        if isinstance(other, list):
+            return self.to_records() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def to_frame(self):
+        """DataFrame（HEADERS 列。払出数は int64、他は category）"""
+        import numpy as np
+        import pandas as pd
+        data = {}
+        for h in HEADERS:
+            if h == "払出数":
+                data[h] = np.array(self._qty, dtype=np.int64)
+            else:
+                col = self._cols[h]
+                data[h] = pd.Categorical.from_codes(np.array(col.codes, dtype=np.int32),
+                                                    categories=pd.Index(col.cats, dtype=object))
+        return pd.DataFrame(data, columns=HEADERS)
+
+    def nbytes(self) -> int:
+        return self._qty.itemsize * len(self._qty) + sum(col.nbytes() for col in self._cols.values())
+
+# 明細を受け取る関数の引数の型（RowTable か、従来の dict のリスト）
+Rows = Union[RowTable, List[Dict[str,Any]]]
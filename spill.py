@@ -0,0 +1,121 @@
+# spill.py
+# 入力Excel・台帳の「中身」の持ち方。メモリ上の bytes か、ディスク上のファイルパスのどちらでもよい（Source）。
+#   - メモリ予算（EXTRACT_MEMORY_BUDGET_MB）を超えるアップロードや生成した台帳は一時ファイルに逃がし、
+#     以降はファイルハンドル／mmap で読む（bytes の複製を作らない）
+#   - 一時ファイルは SpilledFile が持ち、参照が無くなった時点（セッション終了・次の実行での置き換え）か
+#     プロセス終了時に weakref.finalize で削除する
+#   - プロセス並列のワーカーにはパス（文字列）だけを渡す（bytes を pickle で送らない）
+# ------------------------------------------------------------
+import hashlib, io, mmap, os, tempfile, weakref, zipfile
+from typing import BinaryIO, Iterable, Union
+
+Source = Union[bytes, str]   # bytes またはファイルパス
+
+MEMORY_BUDGET = int(os.environ.get("EXTRACT_MEMORY_BUDGET_MB", "256")) * 1024**2
+
+# ===================== 読み出し =====================
+def open_source(src: Source) -> BinaryIO:
+    """読み出し用のファイルオブジェクト（bytes は BytesIO で包むだけで複製しない）"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(src)
+    return open(src, "rb")
+
+def excel_input(src: Source):
+    """pd.ExcelFile / load_workbook に渡す形（パスはそのまま渡し、ライブラリ側で必要な部分だけ読ませる）"""
+    return io.BytesIO(src) if isinstance(src, (bytes, bytearray, memoryview)) else src
+
+def source_size(src: Source) -> int:
+    return len(src) if isinstance(src, (bytes, bytearray, memoryview)) else os.path.getsize(src)
+
+def read_source(src: Source) -> bytes:
+    if isinstance(src, bytes):
+        return src
+    with open_source(src) as f:
+        return f.read()
+
+def content_digest(src: Source) -> str:
+    """中身の SHA-256（ファイルは mmap で読み、全体を bytes にしない）"""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(src).hexdigest()
+    with open(src, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:   # 空ファイルは mmap できない
+            return hashlib.sha256(b"").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return hashlib.sha256(mm).hexdigest()
+
+def estimate_unpacked_size(src: Source) -> int:
+    """
+    展開後の大きさの見積もり（読み込み時のメモリの目安）。zip の中央ディレクトリだけを読み、
+    シートXMLと共有文字列の元サイズを合計する。xlsx として読めなければファイルサイズを返す。
+    """
+    try:
+        with open_source(src) as fp, zipfile.ZipFile(fp) as z:
+            return sum(info.file_size for info in z.infolist()
+                       if info.filename.startswith("xl/worksheets/") or info.filename == "xl/sharedStrings.xml")
+    except (zipfile.BadZipFile, OSError):
+        return source_size(src)
+
+# ===================== 一時ファイル =====================
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+class SpilledFile:
+    """
+    削除を予約した一時ファイル1つ。path をそのまま Source として使う。
+    オブジェクトが回収されるか cleanup() を呼ぶか、プロセスが終了したときに削除される。
+    """
+    def __init__(self, suffix: str = ".xlsx"):
+        fd, self.path = tempfile.mkstemp(prefix="extract_", suffix=suffix)
+        os.close(fd)
+        self._finalizer = weakref.finalize(self, _remove_quietly, self.path)
+
+    @classmethod
+    def from_buffer(cls, data, suffix: str = ".xlsx") -> "SpilledFile":
+        """bytes / memoryview をそのまま書き出す（UploadedFile.getbuffer() なら複製なし）"""
+        sf = cls(suffix)
+        with open(sf.path, "wb") as f:
+            f.write(data)
+        return sf
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
+
+    def cleanup(self):
+        self._finalizer()
+
+    def __fspath__(self) -> str:
+        return self.path
+
+# ===================== アップロードの振り分け =====================
+def spill_uploads(uploads: Iterable, budget: int = MEMORY_BUDGET) -> tuple[list[tuple[str, Source]], list[SpilledFile]]:
+    """
+    Streamlit の UploadedFile 群を [(ファイル名, Source)] にする。
+    合計サイズが budget を超える分は、大きいファイルから順に一時ファイルへ逃がす（返り値の2つ目が保持用）。
+    呼び出し側は、抽出が終わるまで2つ目のリストを持っておくこと（手放すと一時ファイルが消える）。
+    """
+    uploads = list(uploads)
+    spill_at = set()
+    in_memory = sum(xf.size for xf in uploads)
+    for i in sorted(range(len(uploads)), key=lambda i: uploads[i].size, reverse=True):
+        if in_memory <= budget:
+            break
+        spill_at.add(i)
+        in_memory -= uploads[i].size
+
+    files: list[tuple[str, Source]] = []
+    spilled: list[SpilledFile] = []
+    for i, xf in enumerate(uploads):
+        if i in spill_at:
+            sf = SpilledFile.from_buffer(xf.getbuffer())
+            spilled.append(sf)
+            files.append((xf.name, sf.path))
+        else:
+            files.append((xf.name, xf.getvalue()))
+    return files, spilled
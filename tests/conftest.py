@@ -0,0 +1,8 @@
+# conftest.py
+# テストからリポジトリ直下のモジュール（extractor / import_history など）と bench/synth.py を import できるようにする。
+# ------------------------------------------------------------
+import os, sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
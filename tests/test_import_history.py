@@ -0,0 +1,52 @@
+# test_import_history.py
+# 取込履歴: 同じファイル名で内容の違うファイル（別フォルダ・zip の中身など）を取り込んだとき、
+# それぞれの内容ハッシュが履歴に残り、次の実行では両方とも取込済みとして飛ばされること。
+# ------------------------------------------------------------
+import openpyxl
+
+import extract_batch
+from extractor import run_extraction
+from import_history import HISTORY_SHEET, ImportHistory, history_rows_for, split_known
+from spill import content_digest
+from synth import make_workbook
+
+def same_name_inputs(tmp_path) -> list[str]:
+    paths = []
+    for folder, seed in (("a", 1), ("b", 2)):
+        (tmp_path / folder).mkdir()
+        p = tmp_path / folder / "x.xlsx"
+        p.write_bytes(make_workbook(rows=40, sheets=1, seed=seed))
+        paths.append(str(p))
+    return paths
+
+def test_same_name_files_keep_their_own_digest(tmp_path):
+    paths = same_name_inputs(tmp_path)
+    files = [("x.xlsx", p) for p in paths]
+    expected = [content_digest(p) for p in paths]
+    assert expected[0] != expected[1]
+
+    history = ImportHistory()
+    todo, digests, skipped, _ = split_known(files, history)
+    assert len(todo) == 2 and not skipped
+    assert digests == expected
+    results = run_extraction(todo, digests=digests)
+    rows = history_rows_for(results, digests, history)
+    assert sorted(r[0] for r in rows) == sorted(expected)
+
+    todo, digests, skipped, _ = split_known(files, ImportHistory(rows))
+    assert todo == [] and digests == [] and len(skipped) == 2
+
+def test_batch_rerun_skips_both_same_name_files(tmp_path):
+    paths = same_name_inputs(tmp_path)
+    out1, out2 = str(tmp_path / "out1.xlsx"), str(tmp_path / "out2.xlsx")
+    assert extract_batch.main([*paths, "-o", out1]) == 0
+    wb = openpyxl.load_workbook(out1, read_only=True)
+    recorded = [r[0] for r in wb[HISTORY_SHEET].iter_rows(min_row=2, values_only=True)]
+    n_rows = wb["編集用"].max_row
+    wb.close()
+    assert sorted(recorded) == sorted(content_digest(p) for p in paths)
+
+    assert extract_batch.main([*paths, "--base", out1, "-o", out2]) == 0
+    wb = openpyxl.load_workbook(out2, read_only=True)
+    assert wb["編集用"].max_row == n_rows
+    wb.close()
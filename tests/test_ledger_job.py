@@ -0,0 +1,45 @@
+# test_ledger_job.py
+# LedgerJob: discard() の後は（作成済み・作成中でも）読めず、「取り消されました」で失敗すること。
+# ------------------------------------------------------------
+import os, threading
+
+import pytest
+
+from ledger_job import LedgerJob
+
+def write_ledger(dest: str):
+    with open(dest, "wb") as f:
+        f.write(b"ledger")
+
+def test_read_after_discard_fails_with_cancel_message():
+    job = LedgerJob(write_ledger)
+    assert job.read_bytes() == b"ledger"
+    path = job.file.path
+    job.discard()
+    assert job.file is None and not job.ready and not os.path.exists(path)
+    with pytest.raises(RuntimeError, match="取り消されました"):
+        job.read_bytes()
+
+def test_discard_before_build_never_builds():
+    calls = []
+    job = LedgerJob(lambda dest: calls.append(dest))
+    job.discard()
+    with pytest.raises(RuntimeError, match="取り消されました"):
+        job.read_bytes()
+    assert calls == []
+
+def test_discard_during_build_removes_the_file():
+    started, release = threading.Event(), threading.Event()
+    def slow_build(dest: str):
+        started.set()
+        release.wait(5)
+        write_ledger(dest)
+    job = LedgerJob(slow_build)
+    job.start()
+    assert started.wait(5)
+    job.discard()
+    release.set()
+    job._thread.join(5)
+    assert job.file is None
+    with pytest.raises(RuntimeError, match="取り消されました"):
+        job.read_bytes()
@@ -0,0 +1,392 @@
+# xlsx_append.py
+# 既存台帳への追記を xlsx パッケージ（zip）の部品単位で行う。load_workbook で全シートを読み込まない。
+#   - 触らない部品（共有文字列・スタイル・他のシートなど）はそのままコピー
+#   - 『編集用』のシートXMLは既存の行をストリームで写し、</sheetData> の直前に新しい行を足す
+#     （dimension と列幅だけ書き換える。列幅は広げるだけ）
+#   - 『品名ごと』『工程ごと』『_集計スナップショット』は、スナップショットの集計＋追記分から作り直す
+# 読むのは小さなシート（スナップショット・品名マスタ・各シートの1行目）と必要な共有文字列だけなので、
+# メモリは追記行数ぶんで済み、台帳の大きさには比例しない（編集用のXMLは1回流し読みするだけ）。
+# 次の場合は None を返し、呼び出し側（ledger.update_workbook_with_rows）が openpyxl の通常経路で処理する:
+#   スナップショットが無い／編集用の行数と合わない、ヘッダが HEADERS と違う、列幅が未設定の列がある、
+#   数式・結合セルなど想定外の構造がある、書けない型の値がある
+# ------------------------------------------------------------
+import io, re, shutil, zipfile
+import xml.etree.ElementTree as ET
+from posixpath import join, normpath
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import column_index_from_string, get_column_letter
+
+from extractor import HEADERS
+from ledger import (
+    AUTOSIZE_MAX_WIDTH, ITEM_HEADERS, PROC_HEADERS, REPORT_SNAPSHOT_SHEET,
+    aggregate_records, iter_ledger_values, measure_widths, name_map_from_rows,
+    parse_report_snapshot, report_rows, report_snapshot_rows, save_output,
+)
+from import_history import HISTORY_HEADERS, HISTORY_SHEET
+from rowtable import Rows
+from spill import Source, open_source
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_SHARED_STRINGS_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"
+_COPY_CHUNK = 1 << 20
+
+class _Fallback(Exception):
+    """パッケージ単位では扱えない（openpyxl の通常経路に任せる）"""
+
+# ===================== 読み取り（小さな部品だけ） =====================
+def _workbook_parts(zin: zipfile.ZipFile) -> tuple[dict[str, str], str|None]:
+    """シート名→部品パス と 共有文字列の部品パス"""
+    wb = ET.fromstring(zin.read("xl/workbook.xml"))
+    rels = ET.fromstring(zin.read("xl/_rels/workbook.xml.rels"))
+    def part(target: str) -> str:
+        return target.lstrip("/") if target.startswith("/") else normpath(join("xl", target))
+    targets = {r.get("Id"): r.get("Target") for r in rels}
+    sheets = {}
+    for sh in wb.iter(_NS + "sheet"):
+        target = targets.get(sh.get(_NS_R + "id"))
+        if target:
+            sheets[sh.get("name")] = part(target)
+    sst = next((part(r.get("Target")) for r in rels if r.get("Type") == _SHARED_STRINGS_TYPE), None)
+    return sheets, sst
+
+def _rich_text(el) -> str:
+    """<si>／<is> の文字列（ふりがな rPh は除く。openpyxl と同じ）"""
+    t = el.find(_NS + "t")
+    if t is not None:
+        return t.text or ""
+    return "".join(r.findtext(_NS + "t") or "" for r in el.findall(_NS + "r"))
+
+def _read_raw_rows(fp, max_rows: int|None=None):
+    """シートXMLの行を (行番号, {列番号: (型, 値の文字列)}) で返す。共有文字列は番号のまま"""
+    n = 0
+    for _, el in ET.iterparse(fp):
+        if el.tag != _NS + "row":
+            continue
+        cells = {}
+        for c in el.iter(_NS + "c"):
+            if c.find(_NS + "f") is not None:
+                raise _Fallback("数式セル")
+            t = c.get("t", "n")
+            if t == "inlineStr":
+                is_ = c.find(_NS + "is")
+                raw = None if is_ is None else _rich_text(is_)
+            else:
+                raw = c.findtext(_NS + "v")
+            m = re.fullmatch(r"([A-Z]+)\d+", c.get("r") or "")
+            if m is None:
+                raise _Fallback("セル参照なし")
+            cells[column_index_from_string(m.group(1))] = (t, raw)
+        yield int(el.get("r")), cells
+        el.clear()
+        n += 1
+        if max_rows and n >= max_rows:
+            return
+
+def _load_shared_strings(zin: zipfile.ZipFile, path: str|None, needed: set[int]) -> dict[int, str]:
+    """必要な番号の共有文字列だけを読む（全部そろったら途中でやめる）"""
+    out: dict[int, str] = {}
+    if not needed or path is None:
+        return out
+    i = 0
+    with zin.open(path) as fp:
+        for _, el in ET.iterparse(fp):
+            if el.tag != _NS + "si":
+                continue
+            if i in needed:
+                out[i] = _rich_text(el)
+                if len(out) == len(needed):
+                    break
+            el.clear()
+            i += 1
+    return out
+
+def _cell_value(t: str, raw: str|None, sst: dict[int, str]):
+    """openpyxl の読み取りと同じ値に変換する"""
+    if raw is None:
+        return None
+    if t == "s":
+        return sst[int(raw)]
+    if t in ("str", "inlineStr", "e"):
+        return raw
+    if t == "b":
+        return bool(int(raw))
+    if t == "n":
+        return float(raw) if any(ch in raw for ch in ".eE") else int(raw)
+    raise _Fallback(f"未対応のセル型 {t}")
+
+def _row_values(cells: dict, sst: dict[int, str], ncols: int|None=None) -> list:
+    ncols = max(cells, default=0) if ncols is None else ncols
+    return [_cell_value(*cells[c], sst) if c in cells else None for c in range(1, ncols + 1)]
+
+def _shared_indexes(raw_rows) -> set[int]:
+    return {int(raw) for _, cells in raw_rows for t, raw in cells.values() if t == "s" and raw is not None}
+
+# ===================== 書き出し（行XML・列幅・dimension） =====================
+def _check_value(v):
+    if v is None or isinstance(v, (bool, int, float)):
+        return
+    if not isinstance(v, str) or ILLEGAL_CHARACTERS_RE.search(v):
+        raise _Fallback("書けない値")
+
+def _row_xml(r: int, values: list) -> str:
+    """openpyxl が書くのと同じ形（文字列は inlineStr）の行XML"""
+    parts = [f'<row r="{r}">']
+    for i, v in enumerate(values, 1):
+        ref = f"{get_column_letter(i)}{r}"
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            parts.append(f'<c r="{ref}" t="b"><v>{int(v)}</v></c>')
+        elif isinstance(v, (int, float)):
+            parts.append(f'<c r="{ref}" t="n"><v>{v}</v></c>')
+        elif v == "":
+            parts.append(f'<c r="{ref}" t="inlineStr" />')
+        else:
+            space = ' xml:space="preserve"' if v != v.strip() else ""
+            parts.append(f'<c r="{ref}" t="inlineStr"><is><t{space}>{escape(v)}</t></is></c>')
+    parts.append("</row>")
+    return "".join(parts)
+
+_COLS_RE = re.compile(rb"<cols>(.*?)</cols>|<cols\s*/>", re.S)
+_COL_RE = re.compile(rb"<col\b([^>]*?)/?>")
+_ATTR_RE = re.compile(rb'([\w:]+)="([^"]*)"')
+_DIMENSION_RE = re.compile(rb'(<dimension\s+ref=")([^"]*)(")')
+
+def _set_col_widths(head: bytes, widths: dict[int, float], grow_only: bool) -> bytes:
+    """
+    シートXMLの先頭部分（<sheetData より前）の <cols> を書き換える。
+    範囲指定（min〜max）の <col> は必要に応じて分割する。grow_only では設定済みの幅より狭くせず、
+    幅が未設定の列があれば扱わない（_Fallback）。
+    """
+    m = _COLS_RE.search(head)
+    cols: list[dict] = []
+    if m and m.group(1):
+        cols = [dict(_ATTR_RE.findall(a)) for a in _COL_RE.findall(m.group(1))]
+    for idx, width in sorted(widths.items()):
+        hit = next((k for k, c in enumerate(cols) if int(c[b"min"]) <= idx <= int(c[b"max"])), None)
+        cur = float(cols[hit].get(b"width", b"0")) if hit is not None else 0.0
+        if grow_only and (hit is None or not cur):
+            raise _Fallback("列幅が未設定")
+        if grow_only and cur >= width:
+            continue
+        new = {b"width": str(width).encode(), b"customWidth": b"1", b"min": str(idx).encode(), b"max": str(idx).encode()}
+        if hit is None:
+            cols.append(new)
+            continue
+        c = cols.pop(hit)
+        lo, hi = int(c[b"min"]), int(c[b"max"])
+        pieces = []
+        if lo < idx:
+            pieces.append({**c, b"max": str(idx - 1).encode()})
+        pieces.append({**c, **new})
+        if idx < hi:
+            pieces.append({**c, b"min": str(idx + 1).encode()})
+        cols[hit:hit] = pieces
+    cols.sort(key=lambda c: int(c[b"min"]))
+    xml = b"<cols>" + b"".join(
+        b"<col " + b" ".join(k + b'="' + v + b'"' for k, v in c.items()) + b" />" for c in cols) + b"</cols>"
+    if m:
+        return head[:m.start()] + xml + head[m.end():]
+    return head + xml   # <cols> は <sheetData> の直前に置く（スキーマ順）
+
+def _set_dimension(head: bytes, ncols: int, nrows: int) -> bytes:
+    def repl(m):
+        start, _, end = m.group(2).partition(b":")
+        end_col = re.match(rb"[A-Z]*", end or start).group(0).decode()
+        last_col = max(ncols, column_index_from_string(end_col) if end_col else 0)
+        start = start if start else b"A1"
+        return m.group(1) + start + b":" + f"{get_column_letter(last_col)}{nrows}".encode() + m.group(3)
+    return _DIMENSION_RE.sub(repl, head, count=1)
+
+def _split_sheet_xml(xml: bytes) -> tuple[bytes, bytes, bytes]:
+    """(<sheetData ...> の手前まで, sheetData の中身, </sheetData> 以降) に分ける"""
+    m = re.search(rb"<sheetData\b[^>]*?(/?)>", xml)
+    if m is None:
+        raise _Fallback("sheetData なし")
+    if m.group(1):
+        return xml[:m.start()], b"", b"</sheetData>" + xml[m.end():]
+    end = xml.index(b"</sheetData>", m.end())
+    return xml[:m.start()], xml[m.end():end], xml[end:]
+
+def _rebuild_sheet(xml: bytes, body_rows: list[list], first: int, ncols: int, widths: dict[int, float]|None) -> bytes:
+    """
+    シートXMLの sheetData を作り直す（first 行目より前の既存行は残す）。
+    小さなシート（品名ごと／工程ごと／スナップショット）用。
+    """
+    head, data, tail = _split_sheet_xml(xml)
+    if b"<mergeCells" in tail:
+        raise _Fallback("結合セル")
+    kept = b""
+    if first > 1:
+        m = re.match(rb'\s*(<row\b[^>]*\sr="1"[^>]*?(?:/>|>.*?</row>))', data, re.S)
+        if m is None:
+            raise _Fallback("1行目なし")
+        kept = m.group(1)
+    rows_xml = "".join(_row_xml(first + k, values) for k, values in enumerate(body_rows)).encode()
+    head = _set_dimension(head, ncols, max(first + len(body_rows) - 1, 1))
+    if widths:
+        head = _set_col_widths(head, widths, grow_only=False)
+    return head + b"<sheetData>" + kept + rows_xml + tail
+
+_ROW_TAG_RE = re.compile(rb"<row\b([^>]*?)(/?)>")
+_R_ATTR_RE = re.compile(rb'\sr="(\d+)"')
+
+def _stream_append_sheet(src, dst, new_rows: list[list], expected_rows: int, widths: dict[int, float]):
+    """
+    『編集用』のシートXMLを src から dst へ流し写しつつ、</sheetData> の直前に new_rows を足す。
+    既存の最終行（セルを持つ行）が expected_rows と違えば _Fallback。
+    """
+    buf = b""
+    while True:
+        chunk = src.read(_COPY_CHUNK)
+        if not chunk:
+            raise _Fallback("sheetData なし")
+        buf += chunk
+        m = re.search(rb"<sheetData\b[^>]*?(/?)>", buf)
+        if m:
+            break
+    if m.group(1):
+        raise _Fallback("編集用が空")
+    head = _set_col_widths(buf[:m.start()], widths, grow_only=True)
+    head = _set_dimension(head, len(HEADERS), expected_rows + len(new_rows))
+    dst.write(head + b"<sheetData>")
+    buf = buf[m.end():]
+
+    last_cells = last_any = 0
+    def scan(part: bytes):
+        nonlocal last_cells, last_any
+        for rm in _ROW_TAG_RE.finditer(part):
+            ra = _R_ATTR_RE.search(rm.group(1))
+            if ra is None:
+                raise _Fallback("行番号なし")
+            r = int(ra.group(1))
+            last_any = max(last_any, r)
+            if not rm.group(2):
+                last_cells = max(last_cells, r)
+    while True:
+        end = buf.find(b"</sheetData>")
+        if end >= 0:
+            scan(buf[:end])
+            if last_cells != expected_rows or last_any > last_cells:
+                raise _Fallback("編集用の行数がスナップショットと違う")
+            dst.write(buf[:end])
+            dst.write("".join(_row_xml(expected_rows + 1 + k, values) for k, values in enumerate(new_rows)).encode())
+            dst.write(buf[end:])
+            shutil.copyfileobj(src, dst, _COPY_CHUNK)
+            return
+        cut = buf.rfind(b"<")   # 途中で切れたタグは次のチャンクと合わせて見る
+        if cut > 0:
+            scan(buf[:cut])
+            dst.write(buf[:cut])
+            buf = buf[cut:]
+        chunk = src.read(_COPY_CHUNK)
+        if not chunk:
+            raise _Fallback("</sheetData> なし")
+        buf += chunk
+
+# ===================== 追記本体 =====================
+def append_rows_to_package(
+    base_xlsx: Source,
+    rows: Rows,
+    sheet_name:str="編集用",
+    dest: str|None=None,
+    history_rows: list[list]|None=None,
+) -> bytes|str|None:
+    """
+    既存台帳（集計スナップショットあり、bytes またはパス）へ rows を追記した xlsx を返す。
+    dest（パス）を渡すとそこへ書き出してパスを返す（途中で None になった場合 dest の中身は不定）。
+    history_rows があれば『_取込履歴』に足す（シートが無い台帳は None。openpyxl の経路でシートを作る）。
+    パッケージ単位で扱えない台帳なら None（openpyxl の通常経路に任せる）。
+    結果は update_workbook_with_openpyxl(..., report_mode="auto") と同じ内容になる。
+    """
+    try:
+        with open_source(base_xlsx) as fp, zipfile.ZipFile(fp) as zin:
+            return _append_rows_to_package(zin, rows, sheet_name, dest, history_rows)
+    except (_Fallback, KeyError, ValueError, ET.ParseError, zipfile.BadZipFile):
+        return None
+
+def _append_rows_to_package(zin: zipfile.ZipFile, rows, sheet_name: str, dest: str|None,
+                            history_rows: list[list]|None) -> bytes|str:
+    new_rows = list(iter_ledger_values(rows))
+    for values in new_rows + list(history_rows or []):
+        for v in values:
+            _check_value(v)
+
+    sheets, sst_path = _workbook_parts(zin)
+    for name in (sheet_name, "品名ごと", "工程ごと", REPORT_SNAPSHOT_SHEET):
+        if name not in sheets:
+            raise _Fallback(f"{name} なし")
+    edit_part, snap_part = sheets[sheet_name], sheets[REPORT_SNAPSHOT_SHEET]
+    report_parts = {sheets["品名ごと"]: ITEM_HEADERS, sheets["工程ごと"]: PROC_HEADERS}
+    history_part = None
+    if history_rows:
+        if HISTORY_SHEET not in sheets:
+            raise _Fallback(f"{HISTORY_SHEET} なし")
+        history_part = sheets[HISTORY_SHEET]
+
+    # ---- 小さな部品だけ読む（共有文字列は必要な番号だけ後でまとめて引く） ----
+    with zin.open(edit_part) as fp:
+        edit_head = list(_read_raw_rows(fp, max_rows=1))
+    snap_raw = list(_read_raw_rows(io.BytesIO(zin.read(snap_part))))
+    report_xml = {part: zin.read(part) for part in report_parts}
+    report_head = {part: list(_read_raw_rows(io.BytesIO(xml), max_rows=1)) for part, xml in report_xml.items()}
+    master_raw = []
+    if "品名マスタ" in sheets:
+        with zin.open(sheets["品名マスタ"]) as fp:
+            master_raw = list(_read_raw_rows(fp))
+    history_raw = list(_read_raw_rows(io.BytesIO(zin.read(history_part)))) if history_part else []
+    needed = _shared_indexes(edit_head + snap_raw + master_raw + history_raw + [r for v in report_head.values() for r in v])
+    sst = _load_shared_strings(zin, sst_path, needed)
+
+    if not edit_head or edit_head[0][0] != 1 or _row_values(edit_head[0][1], sst) != HEADERS:
+        raise _Fallback("編集用のヘッダ")
+    for part, headers in report_parts.items():
+        head = report_head[part]
+        if not head or head[0][0] != 1 or _row_values(head[0][1], sst) != headers:
+            raise _Fallback("レポートのヘッダ")
+    edit_rows, sum_by_model, sum_by_proc_model = parse_report_snapshot(
+        _row_values(cells, sst, 4) for r, cells in snap_raw if r >= 2)
+    if not isinstance(edit_rows, int) or edit_rows < 1:
+        raise _Fallback("スナップショットの行数")
+    history_body = None
+    if history_part:
+        if not history_raw or history_raw[0][0] != 1 or _row_values(history_raw[0][1], sst, 4) != HISTORY_HEADERS:
+            raise _Fallback("取込履歴のヘッダ")
+        history_body = [_row_values(cells, sst, 4) for r, cells in history_raw if r >= 2] + list(history_rows)
+
+    # ---- 集計（スナップショット＋追記分）と書き出す中身 ----
+    aggregate_records((dict(zip(HEADERS, values)) for values in new_rows), sum_by_model, sum_by_proc_model)
+    if (sum_by_model or sum_by_proc_model) and "品名マスタ" not in sheets:
+        raise _Fallback("品名マスタなし")
+    name_map = name_map_from_rows(_row_values(cells, sst, 2) for r, cells in master_raw if r >= 2) \
+        if (sum_by_model or sum_by_proc_model) else {}
+    item_rows, proc_rows = report_rows(sum_by_model, sum_by_proc_model, name_map)
+    report_body = {sheets["品名ごと"]: item_rows, sheets["工程ごと"]: proc_rows}
+    snapshot = report_snapshot_rows(sum_by_model, sum_by_proc_model, edit_rows + len(new_rows))
+    edit_widths = {i: min(w + 2, AUTOSIZE_MAX_WIDTH) for i, w in enumerate(measure_widths([HEADERS] + new_rows), 1)}
+
+    # ---- パッケージを書き出す（触らない部品はそのままコピー） ----
+    def write(out):
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                zi = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                zi.compress_type = info.compress_type
+                zi.external_attr = info.external_attr
+                if info.filename == edit_part:
+                    with zin.open(info) as src, zout.open(zi, "w", force_zip64=info.file_size > 1 << 30) as dst:
+                        _stream_append_sheet(src, dst, new_rows, edit_rows, edit_widths)
+                elif info.filename in report_parts:
+                    headers, body = report_parts[info.filename], report_body[info.filename]
+                    widths = {i: min(w + 2, AUTOSIZE_MAX_WIDTH) for i, w in enumerate(measure_widths([headers] + body), 1)}
+                    zout.writestr(zi, _rebuild_sheet(report_xml[info.filename], body, 2, len(headers), widths))
+                elif info.filename == snap_part:
+                    zout.writestr(zi, _rebuild_sheet(zin.read(snap_part), snapshot, 1, 4, None))
+                elif info.filename == history_part:
+                    zout.writestr(zi, _rebuild_sheet(zin.read(history_part), history_body, 2, 4, None))
+                else:
+                    with zin.open(info) as src, zout.open(zi, "w", force_zip64=info.file_size > 1 << 30) as dst:
+                        shutil.copyfileobj(src, dst, _COPY_CHUNK)
+    return save_output(write, dest)